@@ -0,0 +1,102 @@
+import atexit
+import threading
+import time
+
+from db_pool import ConnectionPool
+
+# Process-wide assistant shared by every chatbot session.
+#
+# Streamlit re-runs the page script per session and per interaction, so the
+# service lives here, at module level, like the connection pools and the
+# data cache. The assistant itself is stateless apart from its connection
+# pool, which caps how many SQLite connections the process opens no matter
+# how many browser sessions are connected. Sessions only report that they
+# are alive (touch), so stats() can show active sessions next to open
+# connections.
+
+DEFAULT_MAX_CONNECTIONS = 4
+SESSION_TTL = 30 * 60     # seconds without a rerun before a session counts as gone
+
+
+class AssistantService:
+    def __init__(self, factory, db_path, max_connections=DEFAULT_MAX_CONNECTIONS, session_ttl=SESSION_TTL):
+        """factory(db_path, pool) builds the assistant the sessions share"""
+        self.db_path = db_path
+        self.max_connections = max_connections
+        self.session_ttl = session_ttl
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._sessions = {}       # session id -> last seen (monotonic)
+        self._closed = False
+        self._open()
+
+    def _open(self):
+        # Read-only database swapped in by bootstrap.build_once: no WAL file
+        # that could outlive the database it belongs to
+        self.pool = ConnectionPool(self.db_path, max_readers=self.max_connections, journal_mode=None)
+        self.assistant = self._factory(self.db_path, self.pool)
+
+    def touch(self, session_id):
+        """Mark a session as active; returns the shared assistant"""
+        with self._lock:
+            self._sessions[session_id] = time.monotonic()
+            return self.assistant
+
+    def reopen(self):
+        """Start over on fresh connections, e.g. after the database file was replaced.
+
+        Queries already running finish on the old connections.
+        """
+        with self._lock:
+            old = self.pool
+            self._open()
+        old.close()
+
+    def active_sessions(self):
+        with self._lock:
+            cutoff = time.monotonic() - self.session_ttl
+            for session_id in [s for s, seen in self._sessions.items() if seen < cutoff]:
+                del self._sessions[session_id]
+            return len(self._sessions)
+
+    def stats(self):
+        """Active sessions vs open connections"""
+        pool = self.pool.stats()
+        return {
+            'active_sessions': self.active_sessions(),
+            'open_connections': pool['open_readers'] + pool['writer_open'],
+            'connections_in_use': pool['readers_in_use'],
+            'max_connections': self.max_connections,
+            'connection_waits': pool['reader_waits'],
+        }
+
+    def shutdown(self):
+        """Close every connection; the service cannot be used afterwards"""
+        with self._lock:
+            self._closed = True
+            self._sessions.clear()
+        self.pool.close()
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_assistant_service(db_path, factory, max_connections=DEFAULT_MAX_CONNECTIONS):
+    """Process-wide service for `db_path`, created on first use"""
+    with _services_lock:
+        service = _services.get(db_path)
+        if service is None or service._closed:
+            service = AssistantService(factory, db_path, max_connections)
+            _services[db_path] = service
+        return service
+
+
+@atexit.register
+def shutdown_services():
+    """Shut down every assistant service (also run at interpreter exit)"""
+    with _services_lock:
+        services = list(_services.values())
+        _services.clear()
+    for service in services:
+        service.shutdown()
@@ -1,26 +1,164 @@
 import pandas as pd
-from database import get_db_connection
+from database import DB_NAME
+from db_pool import get_pool
+from cache import get_data_cache
+from response_cache import get_response_cache
+from render import render_bullets, render_table_header, render_table_rows
+from schemas import apply_schema
+from intent_router import clinical_router, resolve_tests
+from ingest import ingest
+from cohort import Cohort, CohortCount, CohortError, LabStat, parse as parse_cohort_query
+import columnar
+import retrieval
+import similarity
+import summaries
+import tracing
+import itertools
+import re
 import sqlite3
+import time
 import streamlit as st
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+
+LAB_TABLE_COLUMNS = {
+    'Date': '{result_date:%Y-%m-%d}',
+    'Test': '{test_name}',
+    'Value': '{value} {unit}',
+    'Status': '{interpretation}',
+}
+LAB_BULLET_TEMPLATE = "**{result_date:%Y-%m-%d}**: {test_name} = {value} {unit} ({interpretation})"
+LAB_TREND_TEMPLATE = ("**{test_name}**: latest {latest_value} {unit} ({latest_date:%Y-%m-%d}), "
+                      "{change:+.1f} since {first_date:%Y-%m-%d}, range {min_value}-{max_value} "
+                      "over {n} readings{slope}")
+
+# Patient IDs per `IN (...)` list in batch reads (SQLite builds before 3.32
+# allow at most 999 bound parameters per statement)
+BATCH_CHUNK = 500
+
+# Rows per chunk when answers are streamed (stream_analysis_query)
+STREAM_CHUNK_ROWS = 5
+
+# Tests whose latest value and trend per year are shown beside similar patients
+SIMILARITY_PROFILE = ('HbA1c', 'LDL Cholesterol', 'BP Systolic')
+
+# Reference time for "last N years/months" questions (simulated current date, end of 2025)
+REFERENCE_DATE = pd.Timestamp("2025-12-31")
+
+
+def window_cutoff(window, now=REFERENCE_DATE):
+    """ISO date string strictly after which rows fall inside `window`, or None"""
+    if window is None:
+        return None
+    unit, n = window
+    return (now - pd.DateOffset(**{unit: n})).strftime('%Y-%m-%d')
+
+
+def build_lab_query(patient_id, tests=None, since=None, limit=None, columns='*'):
+    """Parameterized lab_results query for one patient; returns (sql, params).
+
+    tests: restrict to these test names; since: ISO date, keep rows strictly
+    after it (dates are stored as 'YYYY-MM-DD' text, so string comparison is
+    date comparison); limit: newest N rows only. The filters map onto the
+    (patient_id, result_date) and (patient_id, test_name, result_date)
+    indexes, so SQLite reads just the rows that are returned.
+    """
+    sql = f"SELECT {columns} FROM lab_results WHERE patient_id = ?"
+    params = [patient_id]
+    if tests:
+        tests = list(tests)
+        sql += f" AND test_name IN ({', '.join('?' * len(tests))})"
+        params += tests
+    if since is not None:
+        sql += " AND result_date > ?"
+        params.append(since)
+    # id breaks ties between same-day results; the index already carries it
+    sql += " ORDER BY result_date DESC, id"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+    return sql, params
+
 
 class ClinicalBackend:
-    def __init__(self):
-        self.conn = get_db_connection()
+    def __init__(self, db_name=DB_NAME, use_columnar=False):
+        # Connections are borrowed from the shared process-wide pool
+        self.pool = get_pool(db_name)
+        self.cache = get_data_cache(db_name)
+        self.responses = get_response_cache(db_name)
+        # Analytical reads (cohort_stats) go to the Arrow mirror when enabled
+        # and pyarrow is installed; see columnar.py
+        self.mirror = columnar.get_mirror(db_name) if use_columnar and columnar.available() else None
+
+    def _read_sql(self, sql, params=None, parse_dates=None, table=None):
+        """Run a read query; rows of a known `table` get its declared dtypes (see schemas.py)"""
+        with self.pool.reader() as conn:
+            df = pd.read_sql_query(sql, conn, params=params, parse_dates=parse_dates)
+        return apply_schema(df, table) if table else df
+
+    def _cached_read(self, table, patient_id, sql, params=None):
+        return self.cache.get_or_load(table, patient_id, lambda: self._read_sql(sql, params, table=table))
+
+    def cache_stats(self):
+        """Hit/miss/eviction counters of the shared read cache"""
+        return self.cache.stats()
+
+    def response_cache_stats(self):
+        """Hit/miss/expiry counters of the run_analysis_query answer cache"""
+        return self.responses.stats()
 
     def get_all_patients(self):
-        return pd.read_sql_query("SELECT * FROM patients ORDER BY patient_id", self.conn)
+        return self._cached_read('patients', None, "SELECT * FROM patients ORDER BY patient_id")
+
+    def search_patients(self, query='', after_id=None, limit=50):
+        """Keyset-paginated patient directory lookup.
+
+        `query` is a prefix of the patient ID, first name or last name
+        ("first last" prefixes also work). Only the ID/name columns plus a
+        ready-made selectbox label are returned. Returns (page, next_after_id);
+        pass next_after_id back as `after_id` for the next page, it is None on
+        the last page.
+        """
+        # LIKE 'prefix%' is served from the NOCASE indexes as long as the
+        # pattern has no other wildcards
+        terms = re.sub(r'[%_]', '', query or '').split()
+        where, params = [], []
+        if len(terms) == 1:
+            where.append("(patient_id LIKE ? OR first_name LIKE ? OR last_name LIKE ?)")
+            params += [terms[0] + '%'] * 3
+        elif terms:
+            where.append("first_name LIKE ? AND last_name LIKE ?")
+            params += [terms[0] + '%', ' '.join(terms[1:]) + '%']
+        if after_id is not None:
+            where.append("patient_id > ?")
+            params.append(after_id)
+
+        sql = """SELECT patient_id, first_name, last_name,
+                   patient_id || ' - ' || COALESCE(first_name, '') || ' ' || COALESCE(last_name, '') AS label
+            FROM patients"""
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY patient_id LIMIT ?"
+        params.append(limit + 1)
+
+        page = self._read_sql(sql, params)
+        next_after_id = None
+        if len(page) > limit:
+            page = page.iloc[:limit]
+            next_after_id = page['patient_id'].iloc[-1]
+        return page, next_after_id
 
     def add_patient(self, pt_data):
         """
         pt_data: dict containing patient details
         """
         try:
-            with self.conn:
-                self.conn.execute('''
+            with self.pool.writer() as conn:
+                conn.execute('''
                 INSERT INTO patients (patient_id, first_name, last_name, date_of_birth, age, gender, contact_number, email, address, primary_diagnosis, allergies, last_visit)
                 VALUES (:patient_id, :first_name, :last_name, :date_of_birth, :age, :gender, :contact_number, :email, :address, :primary_diagnosis, :allergies, :last_visit)
                 ''', pt_data)
+            self.cache.invalidate('patients', pt_data['patient_id'])
+            self._refresh_summary(pt_data['patient_id'])
             return True, "Patient added successfully"
         except sqlite3.IntegrityError:
             return False, "Error: Patient ID already exists"
@@ -29,79 +167,305 @@ class ClinicalBackend:
 
     def add_appointment(self, appt_data):
         try:
-            with self.conn:
-                self.conn.execute('''
+            with self.pool.writer() as conn:
+                conn.execute('''
                 INSERT INTO appointments (patient_id, appointment_date, appointment_time, doctor_name, reason, status, notes)
                 VALUES (:patient_id, :appointment_date, :appointment_time, :doctor_name, :reason, :status, :notes)
                 ''', appt_data)
+            self.cache.invalidate('appointments', appt_data['patient_id'])
+            self._refresh_summary(appt_data['patient_id'])
             return True, "Appointment scheduled successfully"
         except Exception as e:
             return False, f"Error: {str(e)}"
 
+    def add_lab_result(self, lab_data):
+        """
+        lab_data: dict with patient_id, result_date, test_name, value, unit,
+        reference_low, reference_high, interpretation. lab_trend_summary is
+        updated by the insert trigger in the same transaction.
+        """
+        try:
+            with self.pool.writer() as conn:
+                conn.execute('''
+                INSERT INTO lab_results (patient_id, result_date, test_name, value, unit, reference_low, reference_high, interpretation)
+                VALUES (:patient_id, :result_date, :test_name, :value, :unit, :reference_low, :reference_high, :interpretation)
+                ''', lab_data)
+            self.cache.invalidate('lab_results', lab_data['patient_id'])
+            self.cache.invalidate('lab_trend_summary', lab_data['patient_id'])
+            self._refresh_summary(lab_data['patient_id'])
+            return True, "Lab result added successfully"
+        except Exception as e:
+            return False, f"Error: {str(e)}"
+
+    def _refresh_summary(self, patient_id):
+        # Rebuild right away so the next summary read is a plain lookup; if
+        # this fails the snapshot just stays stale and is rebuilt on read
+        try:
+            summaries.refresh_snapshot(self.pool, patient_id)
+        except sqlite3.Error:
+            pass
+
+    def bulk_ingest(self, table, source, fmt=None, defer_indexes=False):
+        """
+        Stream a CSV/NDJSON file or upload into lab_results, medications or
+        appointments (see ingest.py). Invalid rows are skipped and listed.
+        """
+        try:
+            report = ingest(table, source, fmt=fmt, db_name=self.pool.db_name, defer_indexes=defer_indexes)
+        except Exception as e:
+            return False, f"Error: {str(e)}"
+        msg = str(report)
+        for line_no, error in report.errors[:10]:
+            msg += f"\n- line {line_no}: {error}"
+        return True, msg
+
     def get_patient_details(self, patient_id):
-        patient = pd.read_sql_query("SELECT * FROM patients WHERE patient_id = ?", self.conn, params=[patient_id])
+        patient = self._cached_read('patients', patient_id, "SELECT * FROM patients WHERE patient_id = ?", [patient_id])
         if patient.empty:
             return None
         return patient.iloc[0].to_dict()
 
     def get_patient_labs(self, patient_id):
-        return pd.read_sql_query("SELECT * FROM lab_results WHERE patient_id = ? ORDER BY result_date DESC", self.conn, params=[patient_id])
+        return self._cached_read('lab_results', patient_id, "SELECT * FROM lab_results WHERE patient_id = ? ORDER BY result_date DESC", [patient_id])
+
+    def query_labs(self, patient_id, tests=None, since=None, limit=None):
+        """Newest-first lab rows filtered in SQL (see build_lab_query).
+
+        Typed like get_patient_labs. Not cached - the result depends on the
+        filters, and the indexed query is cheap.
+        """
+        sql, params = build_lab_query(patient_id, tests, since, limit)
+        return self._read_sql(sql, params, table='lab_results')
+
+    def iter_labs(self, patient_id, tests=None, since=None, limit=None, chunk_rows=STREAM_CHUNK_ROWS):
+        """query_labs in typed chunks of `chunk_rows`, fetched from an open cursor as they are consumed"""
+        sql, params = build_lab_query(patient_id, tests, since, limit)
+        with self.pool.reader() as conn:
+            for chunk in pd.read_sql_query(sql, conn, params=params, chunksize=chunk_rows):
+                if not chunk.empty:
+                    yield apply_schema(chunk, 'lab_results')
+
+    def get_lab_trends(self, patient_id):
+        """Pre-aggregated trend row per test (lab_trend_summary), by test name.
+
+        Columns: test_name, unit, n, first_date, first_value, latest_date,
+        latest_value, min_value, max_value, change (latest - first) and
+        slope_per_year (least-squares, value units per year; NaN with < 2
+        readings).
+        """
+        return self._cached_read('lab_trend_summary', patient_id, """
+            SELECT test_name, unit, n, first_date, first_value, latest_date, latest_value,
+                   min_value, max_value, latest_value - first_value AS change,
+                   slope * 365.25 AS slope_per_year
+            FROM lab_trend_summary WHERE patient_id = ? ORDER BY test_name""", [patient_id])
+
+    def get_lab_trend(self, patient_id, test_name):
+        """Trend row for one test as a dict, or None if the test was never run"""
+        trends = self.get_lab_trends(patient_id)
+        row = trends[trends['test_name'] == test_name]
+        if row.empty:
+            return None
+        return row.iloc[0].to_dict()
 
     def get_patient_appointments(self, patient_id):
-        return pd.read_sql_query("SELECT * FROM appointments WHERE patient_id = ? ORDER BY appointment_date DESC", self.conn, params=[patient_id])
+        return self._cached_read('appointments', patient_id, "SELECT * FROM appointments WHERE patient_id = ? ORDER BY appointment_date DESC", [patient_id])
     
     def get_patient_medications(self, patient_id):
-        return pd.read_sql_query("SELECT * FROM medications WHERE patient_id = ? ORDER BY status ASC, start_date DESC", self.conn, params=[patient_id])
+        return self._cached_read('medications', patient_id, "SELECT * FROM medications WHERE patient_id = ? ORDER BY status ASC, start_date DESC", [patient_id])
+
+    # --- Batch (multi-patient) reads ---
+    #
+    # One set-based query per table for a whole list of patients instead of
+    # one round trip (and one DataFrame) per patient. IDs are de-duplicated,
+    # sorted and sent BATCH_CHUNK at a time as `patient_id IN (...)`, which
+    # SQLite answers from the same per-patient indexes as the single reads.
+    # Results are one DataFrame sorted by patient_id (rows for a patient are
+    # contiguous, in the single-patient order); iterate it with
+    # groupby('patient_id', sort=False). Not cached - panel queries rarely
+    # repeat.
+
+    def _batch_read(self, sql, patient_ids, params=(), table=None):
+        """Run `sql` (with an {ids} placeholder) per chunk of patient IDs and concatenate"""
+        ids = sorted(set(patient_ids))
+        chunks = [ids[i:i + BATCH_CHUNK] for i in range(0, len(ids), BATCH_CHUNK)] or [[]]
+        frames = []
+        with self.pool.reader() as conn:
+            for chunk in chunks:
+                chunk_sql = sql.format(ids=', '.join('?' * len(chunk)))
+                frames.append(pd.read_sql_query(chunk_sql, conn, params=[*chunk, *params]))
+        # Typed after concatenation so categoricals share one set of categories
+        df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        return apply_schema(df, table) if table else df
+
+    def get_patients_details(self, patient_ids):
+        """{patient_id: details dict} for the patients that exist"""
+        patients = self._batch_read("SELECT * FROM patients WHERE patient_id IN ({ids}) ORDER BY patient_id",
+                                    patient_ids, table='patients')
+        return {row['patient_id']: row for row in patients.to_dict('records')}
+
+    def get_patients_labs(self, patient_ids):
+        return self._batch_read("SELECT * FROM lab_results WHERE patient_id IN ({ids}) "
+                                "ORDER BY patient_id, result_date DESC, id", patient_ids, table='lab_results')
+
+    def query_labs_batch(self, patient_ids, tests=None, since=None):
+        """query_labs for many patients at once (no per-patient limit)"""
+        sql = "SELECT * FROM lab_results WHERE patient_id IN ({ids})"
+        params = []
+        if tests:
+            tests = list(tests)
+            sql += f" AND test_name IN ({', '.join('?' * len(tests))})"
+            params += tests
+        if since is not None:
+            sql += " AND result_date > ?"
+            params.append(since)
+        sql += " ORDER BY patient_id, result_date DESC, id"
+        return self._batch_read(sql, patient_ids, params, table='lab_results')
+
+    def get_patients_lab_trends(self, patient_ids):
+        """get_lab_trends for many patients (with a patient_id column)"""
+        return self._batch_read("""
+            SELECT patient_id, test_name, unit, n, first_date, first_value, latest_date, latest_value,
+                   min_value, max_value, latest_value - first_value AS change,
+                   slope * 365.25 AS slope_per_year
+            FROM lab_trend_summary WHERE patient_id IN ({ids}) ORDER BY patient_id, test_name""",
+            patient_ids, table='lab_trend_summary')
+
+    def get_patients_appointments(self, patient_ids):
+        return self._batch_read("SELECT * FROM appointments WHERE patient_id IN ({ids}) "
+                                "ORDER BY patient_id, appointment_date DESC", patient_ids, table='appointments')
+
+    def get_patients_medications(self, patient_ids):
+        return self._batch_read("SELECT * FROM medications WHERE patient_id IN ({ids}) "
+                                "ORDER BY patient_id, status ASC, start_date DESC", patient_ids, table='medications')
+
+    # --- Cohort queries (see cohort.py) ---
+
+    def get_lab_catalog(self):
+        """Every test name on file, for resolving cohort query names"""
+        return self.cache.get_or_load('lab_trend_summary', None, lambda: self._read_sql(
+            "SELECT DISTINCT test_name FROM lab_trend_summary ORDER BY test_name"))['test_name'].tolist()
+
+    def parse_cohort(self, query):
+        """Cohort, LabStat or CohortCount for a cohort query string (raises CohortError)"""
+        if isinstance(query, (Cohort, LabStat, CohortCount)):
+            return query
+        return parse_cohort_query(query, self.get_lab_catalog(), REFERENCE_DATE)
+
+    def iter_cohort(self, query, chunksize=5000):
+        """Stream the patients matching `query` as DataFrames of up to `chunksize` rows"""
+        cohort = self.parse_cohort(query)
+        if not isinstance(cohort, Cohort):
+            raise CohortError("Expected a cohort (conditions), not a statistic")
+        sql, params = cohort.compile()
+        with self.pool.reader() as conn:
+            yield from pd.read_sql_query(sql, conn, params=params, chunksize=chunksize)
+
+    def find_cohort(self, query):
+        """All patients matching `query` (e.g. "diagnosis = Hypertension AND latest BP Systolic > 140")"""
+        chunks = list(self.iter_cohort(query))
+        return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+    def cohort_stats(self, query):
+        """Result of a stat query (e.g. "median HbA1c by diagnosis by year",
+        "count of patients with at least 3 High LDL in 2024")"""
+        stat = self.parse_cohort(query)
+        if not isinstance(stat, (LabStat, CohortCount)):
+            raise CohortError("Expected a statistic such as 'median HbA1c by year'")
+        # Patient counts read only the cohort, never the readings the mirror holds
+        if isinstance(stat, CohortCount):
+            return self._read_sql(*stat.compile())
+        if self.mirror is not None:
+            return stat.typed(self._columnar_stats(stat))
+        return stat.typed(self._read_sql(*stat.compile()))
+
+    def refresh_columnar(self, full=False):
+        """Export rows added since the last refresh to the columnar mirror"""
+        return self.mirror.refresh(full=full) if self.mirror is not None else {}
+
+    def _columnar_stats(self, stat):
+        # Appends new lab rows first (a MAX(rowid) lookup when nothing changed)
+        self.mirror.refresh(['lab_results'])
+        field = columnar.ds.field
+        where = (field('test_name') == stat.test) & field('value').is_valid()
+        start, end = stat.window or (None, None)
+        # The year conditions prune whole partitions; result_date trims the edges
+        if start is not None:
+            where &= (field('year') >= start[:4]) & (field('result_date') >= start)
+        if end is not None:
+            where &= (field('year') <= end[:4]) & (field('result_date') < end)
+        if stat.cohort.conditions:
+            ids = pd.concat(self.iter_cohort(stat.cohort))['patient_id'].tolist()
+            where &= field('patient_id').isin(columnar.pa.array(ids, type=columnar.pa.string()))
+        readings = self.mirror.read('lab_results', ['patient_id', 'result_date', 'value'], where).to_pandas()
+        if {'diagnosis', 'gender'} & set(stat.by):
+            patients = self.get_all_patients()[['patient_id', 'primary_diagnosis', 'gender']]
+            readings = readings.merge(patients, on='patient_id', how='inner')
+        return stat.aggregate(readings)
+
+    def explain_cohort(self, query):
+        """Planner steps followed by SQLite's query plan, as text lines"""
+        parsed = self.parse_cohort(query)
+        steps = parsed.describe() if isinstance(parsed, Cohort) else parsed.cohort.describe()
+        sql, params = parsed.compile()
+        with self.pool.reader() as conn:
+            plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        return steps + ["SQLite plan:"] + [f"  {line}" for line in plan]
+
+    def search_records(self, query, patient_id=None, k=5):
+        """Top-k passages (labs, medications, appointment notes) matching `query` by BM25.
+
+        For one patient or, with patient_id=None, the whole clinic; see
+        retrieval.py. Rows added since the last search are indexed first.
+        """
+        index = retrieval.get_index(self.pool.db_name)
+        index.refresh()
+        return pd.DataFrame(index.search(query, patient_id, k), columns=retrieval.PASSAGE_COLUMNS)
+
+    def similar_patients(self, patient_id, k=10, same_diagnosis=True):
+        """The k patients nearest to `patient_id` on lab feature vectors (see similarity.py).
+
+        Columns: patient_id, first_name, last_name, age, primary_diagnosis,
+        distance, then latest value and slope per year of each
+        SIMILARITY_PROFILE test. Labs added since the last call are folded in
+        first.
+        """
+        index = similarity.get_index(self.pool.db_name)
+        index.refresh()
+        neighbours = index.similar(patient_id, k, same_diagnosis)
+        details = self.get_patients_details([n['patient_id'] for n in neighbours])
+        rows = []
+        for neighbour in neighbours:
+            patient = details.get(neighbour['patient_id'], {})
+            features = index.features(neighbour['patient_id'])
+            row = {name: patient.get(name) for name in ('first_name', 'last_name', 'age', 'primary_diagnosis')}
+            row.update(patient_id=neighbour['patient_id'], distance=neighbour['distance'])
+            for test in SIMILARITY_PROFILE:
+                row[test] = features.get(f"{test} latest")
+                row[f"{test} /yr"] = features.get(f"{test} slope")
+            rows.append(row)
+        columns = ['patient_id', 'first_name', 'last_name', 'age', 'primary_diagnosis', 'distance']
+        columns += [c for test in SIMILARITY_PROFILE for c in (test, f"{test} /yr")]
+        # Features are float32; two decimals hides the noise
+        return pd.DataFrame(rows, columns=columns).round(2)
 
     def get_clinical_summary(self, patient_id):
         """Generate comprehensive clinical summary (Logic from original RAG system)"""
-        patient = self.get_patient_details(patient_id)
-        if not patient:
+        snapshot = self.get_patient_snapshot(patient_id)
+        if snapshot is None:
             return "Patient not found."
-        
-        # Gather all data (Retrieval Step)
-        labs = self.get_patient_labs(patient_id)
-        appts = self.get_patient_appointments(patient_id)
-        meds = self.get_patient_medications(patient_id)
-        
-        # Build Context (Generation Step - Template Based)
-        summary = f"""### 📋 Patient Summary: {patient['first_name']} {patient['last_name']}
-**Demographics:** {patient['age']}y {patient['gender']}
-**Diagnosis:** {patient['primary_diagnosis']}
-**Last Visit:** {patient['last_visit']}
-
-#### 🔍 Recent Clinical Data
-"""
-        
-        if not meds.empty:
-            summary += f"\n**Current Medications:**"
-            active_meds = meds[meds['status'] == 'Active']
-            if not active_meds.empty:
-                for _, med in active_meds.iterrows():
-                    summary += f"\n- {med['medication_name']} {med['dosage']} ({med['frequency']})"
-            else:
-                summary += "\n*No active medications.*"
-        else:
-            summary += "\n*No medication history.*"
-        
-        if not labs.empty:
-            summary += f"\n\n**Recent Lab Results ({len(labs)}):**"
-            # Sort by date and show more results (up to 15) to cover expanded panels
-            labs_sorted = labs.sort_values('result_date', ascending=False)
-            for _, lab in labs_sorted.head(15).iterrows():
-                icon = "✅" if lab['interpretation'] == 'Normal' else "⚠️"
-                summary += f"\n- {icon} {lab['test_name']}: {lab['value']} {lab['unit']} ({lab['interpretation']}) on {lab['result_date']}"
-        else:
-            summary += "\n\n*No lab results found.*"
+        return summaries.render_summary(snapshot)
 
-        if not appts.empty:
-            summary += f"\n\n**Recent Appointments ({len(appts)}):**"
-            for _, appt in appts.head(3).iterrows():
-                summary += f"\n- {appt['appointment_date']}: {appt['reason']} ({appt['status']})"
-        else:
-            summary += "\n\n*No appointments found.*"
-            
-        return summary
+    def get_patient_snapshot(self, patient_id):
+        """
+        Materialized summary of a patient (see summaries.py): active meds,
+        recent and latest labs, abnormal counts, BP/HbA1c control status.
+        Rebuilt first if the patient's data changed since it was stored.
+        """
+        return summaries.get_snapshot(self.pool, patient_id)
+
+    def refresh_summaries(self, limit=None):
+        """Rebuild stale summary snapshots (up to `limit`); returns the number rebuilt"""
+        return summaries.refresh_stale(self.pool, limit)
 
     def get_styles(self):
         """Returns shared CSS from app.css for a premium, modern clinical look."""
@@ -113,154 +477,176 @@ class ClinicalBackend:
             return ""
 
     def run_analysis_query(self, query, patient_id=None):
-        # Intelligent Query Router (Simulated RAG)
-        response = ""
-        query = query.lower()
-        
+        """Answer a free-text question about a patient.
+
+        Answers are cached by the parsed question and the patient's data
+        version (see response_cache.py), so rephrasings and repeats of a
+        question are answered without touching the database.
+        """
+        with tracing.span('run_analysis_query', patient_id=patient_id) as trace:
+            # Single pass over the query: intent, lab aliases, status words, time window
+            with tracing.span('parse'):
+                parsed = clinical_router.parse(query)
+            trace.set(intent=parsed.intent)
+            if not patient_id:
+                return self._analyze(parsed, patient_id)
+            with tracing.span('response_key'):
+                key = self.response_key(parsed, patient_id)
+            # No 'analyze' child in the trace means a cache hit
+            return self.responses.get_or_compute(key, lambda: self._analyze(parsed, patient_id))
+
+    def stream_analysis_query(self, query, patient_id=None):
+        """run_analysis_query as a generator of markdown pieces, for st.write_stream.
+
+        The heading is yielded as soon as the patient and intent are known,
+        then lab rows chunk by chunk as they come off the cursor. The pieces
+        join to exactly run_analysis_query's answer, which is cached once the
+        stream is consumed to the end; a cached answer is yielded whole.
+        """
+        start = time.perf_counter()
+        # Only this function's own steps are timed, not the consumer's between pieces
+        trace = tracing.span('stream_analysis_query', patient_id=patient_id)
+        with trace.resume():
+            with tracing.span('parse'):
+                parsed = clinical_router.parse(query)
+            trace.set(intent=parsed.intent)
+            key, found = None, False
+            if patient_id:
+                with tracing.span('response_key'):
+                    key = self.response_key(parsed, patient_id)
+                found, answer = self.responses.lookup(key)
+        if found:
+            trace.finish()
+            yield answer
+            return
+        pieces = []
+        stream = self._analyze_stream(parsed, patient_id)
+        while True:
+            with trace.resume():
+                piece = next(stream, None)
+            if piece is None:
+                break
+            if not pieces:
+                tracing.record('stream_first_piece', time.perf_counter() - start)
+            pieces.append(piece)
+            yield piece
+        trace.finish()
         if patient_id:
-            pt = self.get_patient_details(patient_id)
-            if not pt: return "Patient not found"
-            
-            # Helper for date filtering
-            def filter_by_time(df, date_col, query_text):
-                import re
-                try:
-                    # Fix reference time to simulated current date (End of 2025)
-                    now = pd.to_datetime("2025-12-31")
-                    cutoff = None
-                    
-                    # Regex for "last X years"
-                    year_match = re.search(r'last (\d+) years?', query_text)
-                    if year_match:
-                        years = int(year_match.group(1))
-                        cutoff = now - pd.DateOffset(years=years)
-                    elif 'last year' in query_text:
-                        cutoff = now - pd.DateOffset(years=1)
-                    
-                    # Regex for "last X months"
-                    month_match = re.search(r'last (\d+) months?', query_text)
-                    if month_match:
-                        months = int(month_match.group(1))
-                        cutoff = now - pd.DateOffset(months=months)
-                        
-                    if cutoff is None:
-                        return df # No filter found
-                    
-                    df[date_col] = pd.to_datetime(df[date_col])
-                    return df[df[date_col] > cutoff]
-                except Exception:
-                    return df
-                    
+            self.responses.put(key, ''.join(pieces))
+
+    def response_key(self, parsed, patient_id):
+        """Cache key for a parsed question: everything its answer depends on"""
+        key = (patient_id, self.cache.version(patient_id), parsed.intent, parsed.tags, parsed.window)
+        if parsed.intent == 'lab':
+            # Tests named verbatim are only in the text; key on the resolved set
+            # (against the cached catalog, so a lookup runs no query)
+            key += (tuple(resolve_tests(parsed, self.get_lab_catalog())),)
+        elif parsed.intent == 'appointment':
+            # "today", "tomorrow" and "upcoming" depend on when they are asked
+            key += (date.today(),)
+        return key
+
+    def _analyze(self, parsed, patient_id):
+        with tracing.span('analyze'):
+            return ''.join(self._analyze_stream(parsed, patient_id))
 
+    def _analyze_stream(self, parsed, patient_id):
+        # Intelligent Query Router (Simulated RAG); yields the answer piece by piece
+        if patient_id:
+            with tracing.span('patient_lookup'):
+                pt = self.get_patient_details(patient_id)
+            if not pt:
+                yield "Patient not found"
+                return
             
             # Intent Recognition
             # Specific Component Intents
-            if any(x in query.lower() for x in ['medication', 'medicine', 'drug', 'prescription', 'taking']):
-                meds = self.get_patient_medications(patient_id)
+            if parsed.intent == 'medication':
+                with tracing.span('fetch', table='medications'):
+                    meds = self.get_patient_medications(patient_id)
                 if meds.empty:
-                    response = f"No medication history found for {pt['first_name']}."
+                    yield f"No medication history found for {pt['first_name']}."
                 else:
-                    active = meds[meds['status'] == 'Active']
-                    discontinued = meds[meds['status'] == 'Discontinued']
+                    with tracing.span('filter'):
+                        active = meds[meds['status'] == 'Active']
+                        discontinued = meds[meds['status'] == 'Discontinued']
                     
                     # Detect intent for specific status
-                    show_active = any(x in query for x in ['active', 'current', 'taking', 'now'])
-                    show_discontinued = any(x in query for x in ['discontinued', 'past', 'history', 'stopped', 'old'])
+                    show_active = parsed.has('med:active')
+                    show_discontinued = parsed.has('med:discontinued')
                     
                     # If neither specified, show both (default)
                     if not show_active and not show_discontinued:
                         show_active = True
                         show_discontinued = True
                     
-                    response = f"**Medications for {pt['first_name']}**"
-                    if show_active and not show_discontinued: response += " (Active only)"
-                    if show_discontinued and not show_active: response += " (Discontinued only)"
-                    response += ":\n"
+                    heading = f"**Medications for {pt['first_name']}**"
+                    if show_active and not show_discontinued: heading += " (Active only)"
+                    if show_discontinued and not show_active: heading += " (Discontinued only)"
+                    yield heading + ":\n"
                     
                     if show_active:
                         if not active.empty:
-                            response += "\n*Active:*\n"
-                            for _, med in active.iterrows():
-                                response += f"- **{med['medication_name']}** {med['dosage']} ({med['frequency']})\n"
+                            yield "\n*Active:*\n"
+                            yield render_bullets(active, "**{medication_name}** {dosage} ({frequency})")
                         else:
-                            response += "\n*Active:* None\n"
+                            yield "\n*Active:* None\n"
                             
                     if show_discontinued:
                         if not discontinued.empty:
-                            response += "\n*Discontinued:*\n"
-                            for _, med in discontinued.iterrows():
-                                response += f"- {med['medication_name']} (Ended {med['end_date']})\n"
+                            yield "\n*Discontinued:*\n"
+                            yield render_bullets(discontinued, "{medication_name} (Ended {end_date:%Y-%m-%d})")
                         else:
-                            response += "\n*Discontinued:* None\n"
+                            yield "\n*Discontinued:* None\n"
                             
-            elif any(x in query.lower() for x in ['lab', 'result', 'test', 'blood', 'glucose', 'a1c', 'bp', 'pressure', 'cholesterol', 'hemoglobin', 'bun', 'ldl', 'hdl', 'triglycerides', 'creatinine', 'lipid']):
-                labs = self.get_patient_labs(patient_id)
-                labs['result_date'] = pd.to_datetime(labs['result_date'])
-                
-                # Apply time filter if requested (past 1 year, 2 years, etc)
-                labs = filter_by_time(labs, 'result_date', query)
-                
-                # Identify which specific tests are being asked for
-                all_test_names = labs['test_name'].unique()
-                requested_tests = []
-                
-                # Check for aliases and test names in query
-                if any(x in query for x in ['bp', 'blood pressure', 'pressure']):
-                    requested_tests.extend([t for t in all_test_names if 'BP' in t])
-                
-                if 'lipid' in query:
-                    # Lipid panel usually includes everything
-                    requested_tests.extend([t for t in all_test_names if any(l in t for l in ['Cholesterol', 'LDL', 'HDL', 'Triglycerides'])])
-                elif 'cholesterol' in query:
-                    # Cholesterol specifically (excluding triglycerides by user request)
-                    requested_tests.extend([t for t in all_test_names if 'Cholesterol' in t or any(l in t for l in ['LDL', 'HDL'])])
-                
-                if 'triglyceride' in query:
-                    requested_tests.extend([t for t in all_test_names if 'Triglycerides' in t])
+            elif parsed.intent == 'lab':
+                # Time filter if requested (past 1 year, 2 years, etc)
+                since = window_cutoff(parsed.window)
                 
-                # Specific components
-                for comp in ['LDL', 'HDL', 'A1c', 'Glucose', 'Hemoglobin', 'BUN', 'Creatinine']:
-                    if comp.lower() in query:
-                        requested_tests.extend([t for t in all_test_names if comp in t])
+                # Identify which specific tests are being asked for (aliases and test names in query)
+                with tracing.span('resolve_tests'):
+                    requested_tests = resolve_tests(parsed, self.get_lab_catalog())
                 
-                # Direct match for any other unique tests that might be in the query
-                for t in all_test_names:
-                    if t.lower() in query and t not in requested_tests:
-                        requested_tests.append(t)
+                # The heading goes out before the cursor is opened; if no rows
+                # come back it is followed by the no-results line instead.
+                yield f"**Laboratory Analysis for {pt['first_name']}:**\n\n"
                 
-                # Deduplicate
-                requested_tests = list(set(requested_tests))
+                # Filtering, newest-first ordering and the row limit all run in SQLite:
+                # up to 20 matching records for specific tests, otherwise the top 10
+                # for general "show labs" queries. Rows are rendered chunk by chunk
+                # as the cursor returns them.
+                chunks = self.iter_labs(patient_id, tests=requested_tests, since=since,
+                                        limit=20 if requested_tests else 10)
+                with tracing.span('fetch', table='lab_results'):
+                    first = next(chunks, None)
                 
-                # Filter records
-                if requested_tests:
-                    filtered_labs = labs[labs['test_name'].isin(requested_tests)]
-                else:
-                    # If it's a general "show labs" query, just use everything (will be limited in display)
-                    filtered_labs = labs
-                
-                if not filtered_labs.empty:
-                    # Sort Descending (Newest First)
-                    filtered_labs = filtered_labs.sort_values(by='result_date', ascending=False)
-                    
-                    response = f"**Laboratory Analysis for {pt['first_name']}:**\n\n"
+                if first is not None:
+                    if requested_tests and parsed.has('trend'):
+                        # One pre-aggregated row per test, no scan of the history
+                        with tracing.span('fetch', table='lab_trend_summary'):
+                            trends = self.get_lab_trends(patient_id)
+                        with tracing.span('filter'):
+                            trends = trends[trends['test_name'].isin(requested_tests)]
+                        if not trends.empty:
+                            trends = trends.assign(slope=[
+                                f", {v:+.2f} {u}/year" if pd.notna(v) else ""
+                                for v, u in zip(trends['slope_per_year'], trends['unit'])])
+                            yield "*All-time trend:*\n"
+                            yield render_bullets(trends, LAB_TREND_TEMPLATE) + "\n"
                     
                     if requested_tests:
-                         response += "| Date | Test | Value | Status |\n"
-                         response += "|---|---|---|---|\n"
-                         # Show up to 20 matching records for specific tests
-                         for _, row in filtered_labs.head(20).iterrows():
-                             date_str = row['result_date'].strftime('%Y-%m-%d')
-                             response += f"| {date_str} | {row['test_name']} | {row['value']} {row['unit']} | {row['interpretation']} |\n"
-                    else:
-                         # For general "show labs" queries, provide a bulleted list of the top 10
-                         for _, row in filtered_labs.head(10).iterrows():
-                             date_str = row['result_date'].strftime('%Y-%m-%d')
-                             response += f"- **{date_str}**: {row['test_name']} = {row['value']} {row['unit']} ({row['interpretation']})\n"
+                        yield render_table_header(LAB_TABLE_COLUMNS)
+                    for labs in itertools.chain([first], chunks):
+                        if requested_tests:
+                            yield render_table_rows(labs, LAB_TABLE_COLUMNS)
+                        else:
+                            yield render_bullets(labs, LAB_BULLET_TEMPLATE)
                 else:
-                    response = "No matching lab results found for the specified tests or time period."
+                    yield "No matching lab results found for the specified tests or time period."
                         
-            elif any(x in query.lower() for x in ['appointment', 'visit', 'scheduled', 'checkup']):
-                appts = self.get_patient_appointments(patient_id)
+            elif parsed.intent == 'appointment':
+                with tracing.span('fetch', table='appointments'):
+                    appts = self.get_patient_appointments(patient_id)
                 # appts = filter_by_time(appts, 'appointment_date', query) # OLD Logic
                 
                 # Enhanced Logic for specific dates (Today, Tomorrow, Yesterday)
@@ -269,54 +655,52 @@ class ClinicalBackend:
                 
                 today_obj = datetime.now()
                 
-                if 'today' in query:
+                if parsed.has('date:today'):
                     target_date_str = today_obj.strftime('%Y-%m-%d')
                     date_label = f"today ({target_date_str})"
-                elif 'tomorrow' in query:
+                elif parsed.has('date:tomorrow'):
                     target_date_str = (today_obj + timedelta(days=1)).strftime('%Y-%m-%d')
                     date_label = f"tomorrow ({target_date_str})"
-                elif 'yesterday' in query:
+                elif parsed.has('date:yesterday'):
                     target_date_str = (today_obj - timedelta(days=1)).strftime('%Y-%m-%d')
                     date_label = f"yesterday ({target_date_str})"
                 
                 if target_date_str:
                     # Filter for the specific date
-                    specific_appts = appts[appts['appointment_date'] == target_date_str]
+                    with tracing.span('filter'):
+                        specific_appts = appts[appts['appointment_date'] == pd.Timestamp(target_date_str)]
                     
                     if not specific_appts.empty:
-                        response = f"**Yes, there is an appointment {date_label}:**\n"
-                        for _, appt in specific_appts.iterrows():
-                            response += f"- **{appt['appointment_time']}**: {appt['reason']} with **{appt['doctor_name']}** ({appt['status']})\n"
+                        yield f"**Yes, there is an appointment {date_label}:**\n"
+                        yield render_bullets(specific_appts, "**{appointment_time}**: {reason} with **{doctor_name}** ({status})")
                     else:
-                        response = f"No appointments found for {date_label}."
+                        yield f"No appointments found for {date_label}."
                         
                 else:
                     # General History / Future Logic
-                    if 'upcoming' in query or 'next' in query:
-                        # Simple string comparison works for ISO dates
+                    if parsed.has('upcoming'):
                         today_str = today_obj.strftime('%Y-%m-%d')
-                        upcoming = appts[appts['appointment_date'] >= today_str]
+                        with tracing.span('filter'):
+                            upcoming = appts[appts['appointment_date'] >= pd.Timestamp(today_str)]
                         if not upcoming.empty:
-                             response = f"**Upcoming Appointments:**\n"
-                             for _, appt in upcoming.sort_values('appointment_date').iterrows():
-                                response += f"- {appt['appointment_date']} @ {appt['appointment_time']}: {appt['reason']} ({appt['doctor_name']})\n"
+                             yield f"**Upcoming Appointments:**\n"
+                             yield render_bullets(upcoming.sort_values('appointment_date', kind='stable'), "{appointment_date:%Y-%m-%d} @ {appointment_time}: {reason} ({doctor_name})")
                         else:
-                            response = "No upcoming appointments found."
+                            yield "No upcoming appointments found."
                     else:
                         # Default history
-                        response = f"**Appointment History for {pt['first_name']}:**\n"
-                        for _, appt in appts.head(10).iterrows():
-                            # Sort by date desc for history
-                            response += f"- {appt['appointment_date']}: {appt['reason']} with {appt['doctor_name']}\n"
+                        yield f"**Appointment History for {pt['first_name']}:**\n"
+                        # Already sorted by date desc for history
+                        yield render_bullets(appts.head(10), "{appointment_date:%Y-%m-%d}: {reason} with {doctor_name}")
             
             # General Summary Intent (Lower Priority - used if no specific component found)
-            elif any(x in query for x in ['summary', 'overview', 'report', 'status']):
-                response = self.get_clinical_summary(patient_id)
+            elif parsed.intent == 'summary':
+                with tracing.span('summary'):
+                    summary = self.get_clinical_summary(patient_id)
+                yield summary
             
             else:
-                response = f"I can help you analyze {pt['first_name']}'s data. Try asking for a 'summary', 'medications', 'lab results', or 'appointments'."
+                yield f"I can help you analyze {pt['first_name']}'s data. Try asking for a 'summary', 'medications', 'lab results', or 'appointments'."
                 
         else:
-            response = "Please select a patient first to analyze their records."
-                
-        return response
+            yield "Please select a patient first to analyze their records."
@@ -0,0 +1,68 @@
+import random
+from datetime import date, timedelta
+
+from database import create_tables
+
+TESTS = [
+    ('Glucose', 'mg/dL', 70, 100, 70, 250),
+    ('Creatinine', 'mg/dL', 0.6, 1.2, 0.5, 1.5),
+    ('Hemoglobin', 'g/dL', 12.0, 16.0, 11.0, 17.0),
+    ('BP Systolic', 'mmHg', 90, 120, 100, 170),
+    ('BP Diastolic', 'mmHg', 60, 80, 60, 105),
+    ('LDL Cholesterol', 'mg/dL', 0, 100, 70, 190),
+    ('HDL Cholesterol', 'mg/dL', 40, 100, 30, 80),
+    ('Triglycerides', 'mg/dL', 0, 150, 50, 350),
+    ('BUN', 'mg/dL', 7, 20, 7, 20),
+    ('HbA1c', '%', 4.0, 5.7, 4.5, 9.0),
+]
+DIAGNOSES = ['Type 2 Diabetes', 'Hypertension', 'Coronary Artery Disease', 'Asthma',
+             'Hyperlipidemia', 'GERD', 'None']
+STATUSES = ['Active', 'Discontinued']
+
+
+def make_database(conn, n_patients, visits=20, start_year=2016, seed=0, batch=50_000):
+    """Fill `conn` with a simple synthetic clinic of `n_patients` patients.
+
+    Each patient gets `visits` appointments spread from `start_year` to 2025,
+    a full lab panel per visit and four medications. Rows are streamed in
+    batches so large sizes don't hold everything in memory.
+    """
+    rng = random.Random(seed)
+    create_tables(conn)
+    span = (date(2025, 12, 31) - date(start_year, 1, 1)).days
+
+    patients, appts, labs, meds = [], [], [], []
+
+    def flush(force=False):
+        if force or len(labs) >= batch:
+            conn.executemany("INSERT INTO patients VALUES (?,?,?,?,?,?,?,?,?,?,?,?)", patients)
+            conn.executemany('''INSERT INTO appointments (patient_id, appointment_date, appointment_time, doctor_name, reason, status, notes)
+                VALUES (?,?,?,?,?,?,?)''', appts)
+            conn.executemany('''INSERT INTO lab_results (patient_id, result_date, test_name, value, unit, reference_low, reference_high, interpretation)
+                VALUES (?,?,?,?,?,?,?,?)''', labs)
+            conn.executemany('''INSERT INTO medications (patient_id, medication_name, dosage, frequency, start_date, end_date, status)
+                VALUES (?,?,?,?,?,?,?)''', meds)
+            for rows in (patients, appts, labs, meds):
+                rows.clear()
+
+    for i in range(1, n_patients + 1):
+        p_id = f'P{i:07d}'
+        dates = sorted(date(start_year, 1, 1) + timedelta(days=rng.randrange(span)) for _ in range(visits))
+        patients.append((p_id, f'First{i}', f'Last{i}', '1970-01-01', 55, rng.choice('MF'),
+                         '555-0000', f'p{i}@example.com', '123 Main St', rng.choice(DIAGNOSES),
+                         'None', str(dates[-1])))
+        for d in dates:
+            day = str(d)
+            appts.append((p_id, day, '10:00', 'Dr. Sarah Chen', 'Routine Checkup', 'Completed', ''))
+            for name, unit, low, high, vmin, vmax in TESTS:
+                value = round(rng.uniform(vmin, vmax), 1)
+                interp = 'High' if value > high else ('Low' if value < low else 'Normal')
+                labs.append((p_id, day, name, value, unit, low, high, interp))
+        for m in range(4):
+            status = STATUSES[m % 2]
+            meds.append((p_id, f'Drug{m}', '10mg', 'Daily', str(dates[m % len(dates)]),
+                         None if status == 'Active' else str(dates[-1]), status))
+        flush()
+
+    flush(force=True)
+    conn.commit()
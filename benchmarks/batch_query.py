@@ -0,0 +1,66 @@
+"""Panel reads: N single-patient calls vs one batch call.
+
+Loads patient details and the full lab history for a panel of patients,
+either with get_patient_details + get_patient_labs per patient (cold cache,
+as for a panel nobody has opened yet) or with get_patients_details +
+get_patients_labs, which run one chunked `IN (...)` query per table.
+
+    python -m benchmarks.batch_query [--patients 50000] [--visits 4] [--sizes 1000 50000]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from backend import ClinicalBackend
+from benchmarks._data import make_database
+from database import get_db_connection
+from migrations import apply_migrations
+
+
+def single_calls(backend, ids):
+    backend.cache.clear()
+    return [(backend.get_patient_details(p_id), backend.get_patient_labs(p_id)) for p_id in ids]
+
+
+def batch_call(backend, ids):
+    return backend.get_patients_details(ids), backend.get_patients_labs(ids)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def run(n_patients, visits, sizes):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        conn = get_db_connection(db_path)
+        make_database(conn, n_patients, visits=visits)
+        apply_migrations(conn)
+        conn.execute("ANALYZE")
+        conn.close()
+
+        backend = ClinicalBackend(db_path)
+        print(f"{n_patients:,} patients, {visits * 10} lab rows each\n")
+        print(f"{'panel':>8} {'single s':>9} {'batch s':>9} {'speedup':>8}")
+        rng = random.Random(0)
+        all_ids = [f'P{i:07d}' for i in range(1, n_patients + 1)]
+        for size in sizes:
+            ids = rng.sample(all_ids, min(size, n_patients))
+            single = timed(single_calls, backend, ids)
+            batch = timed(batch_call, backend, ids)
+            print(f"{len(ids):>8,} {single:>9.2f} {batch:>9.2f} {single / batch:>7.1f}x")
+        backend.cache.clear()
+        backend.pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--patients', type=int, default=50_000)
+    parser.add_argument('--visits', type=int, default=4, help='full lab panels per patient')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 50_000])
+    args = parser.parse_args()
+    run(args.patients, args.visits, args.sizes)
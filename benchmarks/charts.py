@@ -0,0 +1,68 @@
+"""Lab trend chart cost: every point vs a downsampled, cached figure.
+
+Builds the dashboard's lab chart (px.line + reference lines) for one long
+series and measures build time and the JSON size Streamlit ships to the
+browser:
+
+- full: every reading, as before
+- lttb / minmax: thinned to --points with charts.downsample
+- cached: charts.cached_figure on a warm cache
+
+    python -m benchmarks.charts [--readings 20000] [--points 500]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.io as pio
+
+from charts import cached_figure, downsample
+
+
+def make_series(n, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2015-01-01', periods=n, freq='h')
+    values = 120 + 10 * np.sin(np.arange(n) / 300) + rng.normal(0, 4, n)
+    return pd.DataFrame({'result_date': dates, 'value': values.round(0),
+                         'reference_low': 90.0, 'reference_high': 120.0})
+
+
+def build(df):
+    fig = px.line(df, x='result_date', y='value', markers=True, title="BP Systolic Over Time")
+    fig.add_hline(y=90, line_dash="dash", line_color="green", annotation_text="Low Ref")
+    fig.add_hline(y=120, line_dash="dash", line_color="red", annotation_text="High Ref")
+    return fig
+
+
+def measure(make_figure, repeat=5):
+    """(ms per figure incl. serialization, JSON bytes)"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        payload = pio.to_json(make_figure(), validate=False)
+    return (time.perf_counter() - start) * 1000 / repeat, len(payload)
+
+
+def run(readings, points):
+    df = make_series(readings)
+    print(f"{readings:,} readings, {points} point budget\n")
+    print(f"{'variant':>10} {'ms':>9} {'JSON KB':>9}")
+    cases = [
+        ('full', lambda: build(df)),
+        ('lttb', lambda: build(downsample(df, 'result_date', 'value', points))),
+        ('minmax', lambda: build(downsample(df, 'result_date', 'value', points, method='minmax'))),
+    ]
+    cached_figure('P0000001', 'bench', None, readings, lambda: build(downsample(df, 'result_date', 'value', points)))
+    cases.append(('cached', lambda: cached_figure('P0000001', 'bench', None, readings, None)))
+    for label, make_figure in cases:
+        ms, size = measure(make_figure)
+        print(f"{label:>10} {ms:>9.1f} {size / 1024:>9.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--readings', type=int, default=20_000)
+    parser.add_argument('--points', type=int, default=500)
+    args = parser.parse_args()
+    run(args.readings, args.points)
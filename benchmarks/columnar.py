@@ -0,0 +1,66 @@
+"""Lab statistics: SQLite vs the Arrow IPC mirror.
+
+Runs the same cohort_stats queries against SQLite (window functions /
+aggregates over the covering index) and against the memory-mapped columnar
+mirror (partition-pruned Arrow read + pandas groupby), after timing the
+initial export and a one-row incremental refresh.
+
+    python -m benchmarks.columnar [--patients 20000] [--visits 10]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from backend import ClinicalBackend
+from benchmarks._data import make_database
+from database import get_db_connection
+from migrations import apply_migrations
+
+QUERIES = [
+    'median HbA1c',
+    'median BP Systolic by year',
+    'median Glucose by diagnosis by year',
+    'mean LDL Cholesterol in 2024 by gender',
+    'patients HbA1c by diagnosis',
+    'median HbA1c where age > 60',
+]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def run(n_patients, visits):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        conn = get_db_connection(db_path)
+        make_database(conn, n_patients, visits=visits)
+        apply_migrations(conn)
+        conn.execute("ANALYZE")
+        conn.close()
+
+        sqlite_backend = ClinicalBackend(db_path)
+        arrow_backend = ClinicalBackend(db_path, use_columnar=True)
+        print(f"{n_patients:,} patients, {visits * 10} lab rows each\n")
+        print(f"initial export      {timed(arrow_backend.refresh_columnar):8.2f} s")
+        with sqlite_backend.pool.writer() as w:
+            w.execute("INSERT INTO lab_results (patient_id, result_date, test_name, value) "
+                      "VALUES ('P0000001', '2025-12-31', 'HbA1c', 6.1)")
+        print(f"one-row refresh     {timed(arrow_backend.refresh_columnar) * 1000:8.1f} ms\n")
+
+        print(f"{'query':<40} {'sqlite s':>9} {'arrow s':>9}")
+        for query in QUERIES:
+            print(f"{query:<40} {timed(sqlite_backend.cohort_stats, query):>9.3f} "
+                  f"{timed(arrow_backend.cohort_stats, query):>9.3f}")
+        sqlite_backend.pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--patients', type=int, default=20_000)
+    parser.add_argument('--visits', type=int, default=10, help='full lab panels per patient')
+    args = parser.parse_args()
+    run(args.patients, args.visits)
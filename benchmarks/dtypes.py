@@ -0,0 +1,78 @@
+"""Memory footprint of backend DataFrames: as read vs typed (schemas.py).
+
+For every table, reports the deep memory_usage of
+- the whole table in one DataFrame, and
+- the per-patient frames the read cache holds (one per patient, summed),
+as pandas returns them from read_sql_query and after apply_schema. The
+"object MB" column is the whole table with text held as Python str objects
+(pandas < 3, or without pyarrow).
+
+    python -m benchmarks.dtypes [--db clinical_system.db] [--max-patients 2000]
+"""
+import argparse
+import sqlite3
+
+import pandas as pd
+
+from database import DB_NAME
+from schemas import apply_schema
+
+TABLES = {
+    'patients': "SELECT * FROM patients",
+    'lab_results': "SELECT * FROM lab_results",
+    'appointments': "SELECT * FROM appointments",
+    'medications': "SELECT * FROM medications",
+    'lab_trend_summary': "SELECT * FROM lab_trend_summary",
+}
+
+
+def footprint(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def mb(n):
+    return f"{n / 1024 ** 2:9.2f}"
+
+
+def ratio(before, after):
+    return f"{before / after:>5.1f}x" if after else f"{'-':>6}"
+
+
+def run(db_path, max_patients):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    present = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    print(f"{db_path}\n")
+    print(f"{'table':<18} {'rows':>10} {'object MB':>9} {'whole MB':>9} {'typed MB':>9} {'ratio':>6}"
+          f" {'per-pt MB':>9} {'typed MB':>9} {'ratio':>6}")
+    totals = [0, 0, 0, 0, 0]
+    for table, sql in TABLES.items():
+        if table not in present:
+            continue
+        raw = pd.read_sql_query(sql, conn)
+        text = raw.select_dtypes(include=['object', 'string']).columns
+        as_object = footprint(raw.astype({c: object for c in text}))
+        whole = footprint(raw), footprint(apply_schema(raw.copy(), table))
+
+        # Cache entries: one frame per patient (not for the patients table itself)
+        per_patient = (0, 0)
+        if 'patient_id' in raw and table != 'patients':
+            ids = raw['patient_id'].drop_duplicates().head(max_patients)
+            frames = [group for _, group in raw[raw['patient_id'].isin(ids)].groupby('patient_id', sort=False)]
+            per_patient = (sum(footprint(f.reset_index(drop=True)) for f in frames),
+                           sum(footprint(apply_schema(f.reset_index(drop=True), table)) for f in frames))
+        for i, n in enumerate((as_object,) + whole + per_patient):
+            totals[i] += n
+        print(f"{table:<18} {len(raw):>10,} {mb(as_object)} {mb(whole[0])} {mb(whole[1])} {ratio(*whole)}"
+              f" {mb(per_patient[0])} {mb(per_patient[1])} {ratio(*per_patient)}")
+    print(f"{'total':<18} {'':>10} {mb(totals[0])} {mb(totals[1])} {mb(totals[2])} {ratio(*totals[1:3])}"
+          f" {mb(totals[3])} {mb(totals[4])} {ratio(*totals[3:])}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db', default=DB_NAME)
+    parser.add_argument('--max-patients', type=int, default=2000,
+                        help='patients whose per-patient frames are measured')
+    args = parser.parse_args()
+    run(args.db, args.max_patients)
@@ -0,0 +1,93 @@
+"""Lab result ingestion: one transaction per row vs ingest.py.
+
+Writes a CSV of synthetic lab results, then loads it into a database that
+already holds `--patients` patients' history:
+
+- row-at-a-time: ClinicalBackend.add_lab_result per row (its own
+  transaction, trend trigger per row) - measured on a sample
+- ingest: executemany in 100k-row transactions, trend summary folded per
+  transaction
+- ingest --defer-indexes: as above with the lab indexes rebuilt at the end
+
+    python -m benchmarks.ingest [--rows 200000] [--patients 2000]
+"""
+import argparse
+import csv
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from backend import ClinicalBackend
+from benchmarks._data import TESTS, make_database
+from database import get_db_connection
+from db_pool import get_pool
+from ingest import ingest
+from migrations import apply_migrations
+
+COLUMNS = ['patient_id', 'result_date', 'test_name', 'value', 'unit', 'reference_low', 'reference_high']
+
+
+def write_csv(path, n_rows, n_patients, seed=0):
+    rng = random.Random(seed)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for _ in range(n_rows):
+            name, unit, low, high, vmin, vmax = rng.choice(TESTS)
+            writer.writerow([f'P{rng.randint(1, n_patients):07d}',
+                             f'2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+                             name, round(rng.uniform(vmin, vmax), 1), unit, low, high])
+
+
+def fresh_copy(template, path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    shutil.copy(template, path)
+
+
+def row_at_a_time(db_path, csv_path, sample):
+    backend = ClinicalBackend(db_path)
+    with open(csv_path, newline='') as f:
+        rows = [dict(r, interpretation='Normal') for _, r in zip(range(sample), csv.DictReader(f))]
+    start = time.perf_counter()
+    for row in rows:
+        backend.add_lab_result(row)
+    return len(rows) / (time.perf_counter() - start)
+
+
+def run(n_rows, n_patients, sample):
+    with tempfile.TemporaryDirectory() as tmp:
+        template = os.path.join(tmp, 'template.db')
+        conn = get_db_connection(template)
+        make_database(conn, n_patients)
+        apply_migrations(conn)
+        conn.close()
+
+        csv_path = os.path.join(tmp, 'labs.csv')
+        write_csv(csv_path, n_rows, n_patients)
+        db_path = os.path.join(tmp, 'bench.db')
+        print(f"{n_rows:,} lab rows into a database with {n_patients:,} patients' history\n")
+
+        fresh_copy(template, db_path)
+        rate = row_at_a_time(db_path, csv_path, sample)
+        get_pool(db_path).close()
+        print(f"{'row-at-a-time':>24} {rate:>10,.0f} rows/sec  ({sample:,}-row sample)")
+
+        for defer in (False, True):
+            fresh_copy(template, db_path)
+            report = ingest('lab_results', csv_path, db_name=db_path, defer_indexes=defer)
+            get_pool(db_path).close()
+            label = 'ingest --defer-indexes' if defer else 'ingest'
+            print(f"{label:>24} {report.rows_per_sec:>10,.0f} rows/sec  ({report.inserted:,} rows in {report.seconds:.1f}s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--patients', type=int, default=2000)
+    parser.add_argument('--sample', type=int, default=5000, help='rows inserted one at a time')
+    args = parser.parse_args()
+    run(args.rows, args.patients, args.sample)
@@ -0,0 +1,127 @@
+"""Query classification throughput: chained any(x in query) scans vs the
+compiled intent router, for the current 10-test catalog and a larger lab
+catalog (the verbatim test-name match is linear in catalog size for the
+chained scans).
+
+    python -m benchmarks.intent_router [--rounds 2000] [--catalogs 10 300]
+"""
+import argparse
+import time
+
+from intent_router import clinical_router, resolve_tests
+
+CORPUS = [
+    "Show me the glucose trend for the last 3 years",
+    "What is the latest HbA1c?",
+    "BP readings over the last 18 months",
+    "Is the blood pressure controlled on the current regimen?",
+    "List active medications",
+    "Which drugs were discontinued last year?",
+    "What prescriptions is the patient taking now?",
+    "Show the lipid panel for the last 2 years",
+    "Cholesterol results since last year",
+    "LDL and HDL over the last 5 years",
+    "Any triglycerides above range recently?",
+    "Creatinine and BUN trend for the last 24 months",
+    "Hemoglobin results",
+    "Show all lab results",
+    "Latest test results please",
+    "Do I have an appointment tomorrow?",
+    "Was there a visit yesterday?",
+    "Upcoming appointments for this patient",
+    "When is the next checkup scheduled?",
+    "Appointment history",
+    "Give me a summary",
+    "Clinical overview before rounds",
+    "Status report for the family meeting",
+    "How is the patient doing?",
+    "Past medication history including stopped statins",
+    "Has the a1c improved in the last 12 months?",
+    "Fasting glucose last 6 months",
+    "Blood work from the last year",
+    "Pressure readings at home vs clinic",
+    "Summarize the old prescriptions",
+]
+TEST_NAMES = ['Glucose', 'Creatinine', 'Hemoglobin', 'BP Systolic', 'BP Diastolic', 'LDL Cholesterol',
+              'HDL Cholesterol', 'Triglycerides', 'BUN', 'HbA1c']
+
+
+EXTRA_TESTS = ['Vitamin D', 'TSH', 'Free T4', 'Ferritin', 'Iron', 'Sodium', 'Potassium', 'Chloride',
+               'Calcium', 'Magnesium', 'Phosphorus', 'Albumin', 'ALT', 'AST', 'ALP', 'Total Bilirubin',
+               'WBC', 'Platelets', 'Hematocrit', 'MCV', 'INR', 'PSA', 'eGFR', 'Uric Acid', 'CRP']
+
+
+def make_catalog(size):
+    names = list(TEST_NAMES) + EXTRA_TESTS
+    names += [f'Panel {i} Marker' for i in range(max(0, size - len(names)))]
+    return names[:size]
+
+
+def classify_chained(query, test_names=TEST_NAMES):
+    """Keyword chain as run_analysis_query did it before the router"""
+    query = query.lower()
+    if any(x in query.lower() for x in ['medication', 'medicine', 'drug', 'prescription', 'taking']):
+        active = any(x in query for x in ['active', 'current', 'taking', 'now'])
+        stopped = any(x in query for x in ['discontinued', 'past', 'history', 'stopped', 'old'])
+        return 'medication', (active, stopped)
+    if any(x in query.lower() for x in ['lab', 'result', 'test', 'blood', 'glucose', 'a1c', 'bp', 'pressure',
+                                        'cholesterol', 'hemoglobin', 'bun', 'ldl', 'hdl', 'triglycerides',
+                                        'creatinine', 'lipid']):
+        requested = []
+        if any(x in query for x in ['bp', 'blood pressure', 'pressure']):
+            requested.extend(t for t in test_names if 'BP' in t)
+        if 'lipid' in query:
+            requested.extend(t for t in test_names if any(l in t for l in ['Cholesterol', 'LDL', 'HDL', 'Triglycerides']))
+        elif 'cholesterol' in query:
+            requested.extend(t for t in test_names if 'Cholesterol' in t or any(l in t for l in ['LDL', 'HDL']))
+        if 'triglyceride' in query:
+            requested.extend(t for t in test_names if 'Triglycerides' in t)
+        for comp in ['LDL', 'HDL', 'A1c', 'Glucose', 'Hemoglobin', 'BUN', 'Creatinine']:
+            if comp.lower() in query:
+                requested.extend(t for t in test_names if comp in t)
+        for t in test_names:
+            if t.lower() in query and t not in requested:
+                requested.append(t)
+        return 'lab', sorted(set(requested))
+    if any(x in query.lower() for x in ['appointment', 'visit', 'scheduled', 'checkup']):
+        return 'appointment', None
+    if any(x in query for x in ['summary', 'overview', 'report', 'status']):
+        return 'summary', None
+    return None, None
+
+
+def classify_router(query, test_names=TEST_NAMES):
+    parsed = clinical_router.parse(query)
+    if parsed.intent == 'lab':
+        return parsed.intent, resolve_tests(parsed, test_names)
+    return parsed.intent, parsed.window
+
+
+def throughput(fn, rounds, test_names):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for q in CORPUS:
+            fn(q, test_names)
+    return rounds * len(CORPUS) / (time.perf_counter() - start)
+
+
+def run(rounds, catalogs):
+    for q in CORPUS:
+        old, new = classify_chained(q)[0], classify_router(q)[0]
+        if old != new:
+            print(f"  routing differs: {q!r}: chained={old} router={new}")
+
+    print(f"{'tests':>6} {'chained q/s':>12} {'router q/s':>12} {'speedup':>8}")
+    for size in catalogs:
+        names = make_catalog(size)
+        old = throughput(classify_chained, rounds, names)
+        new = throughput(classify_router, rounds, names)
+        print(f"{size:>6} {old:>12,.0f} {new:>12,.0f} {new / old:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rounds', type=int, default=2000)
+    parser.add_argument('--catalogs', type=int, nargs='+', default=[10, 300])
+    args = parser.parse_args()
+    run(args.rounds, args.catalogs)
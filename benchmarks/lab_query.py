@@ -0,0 +1,94 @@
+"""Lab question latency: filtering in pandas vs pushing it down into SQL.
+
+Patients get dense, 10+ year lab histories (a full panel every ~week by
+default). The old path loads every lab row for the patient, converts the
+dates twice and filters/sorts/limits in pandas; the new path asks SQLite
+for just the rows it will show (ClinicalBackend.query_labs).
+
+    python -m benchmarks.lab_query [--patients 200] [--visits 600] [--samples 100]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import pandas as pd
+
+from backend import ClinicalBackend, window_cutoff
+from benchmarks._data import make_database
+from database import get_db_connection
+from intent_router import clinical_router, resolve_tests
+from migrations import apply_migrations
+
+QUESTIONS = [
+    "show labs",
+    "blood pressure",
+    "glucose trend last 3 years",
+    "lipid panel last 18 months",
+    "hba1c last year",
+]
+
+
+def answer_pandas(backend, patient_id, parsed):
+    """The pre-pushdown lab branch of run_analysis_query, kept for comparison"""
+    labs = backend.get_patient_labs(patient_id)
+    labs['result_date'] = pd.to_datetime(labs['result_date'])
+    if parsed.window is not None:
+        unit, n = parsed.window
+        cutoff = pd.to_datetime("2025-12-31") - pd.DateOffset(**{unit: n})
+        labs['result_date'] = pd.to_datetime(labs['result_date'])
+        labs = labs[labs['result_date'] > cutoff]
+    requested = resolve_tests(parsed, labs['test_name'].unique())
+    if requested:
+        labs = labs[labs['test_name'].isin(requested)]
+    return labs.sort_values(by='result_date', ascending=False).head(20 if requested else 10)
+
+
+def answer_sql(backend, patient_id, parsed):
+    since = window_cutoff(parsed.window)
+    requested = resolve_tests(parsed, backend.get_lab_catalog())
+    return backend.query_labs(patient_id, tests=requested, since=since, limit=20 if requested else 10)
+
+
+def time_answers(fn, backend, ids, parsed, clear_cache):
+    """Mean milliseconds per question"""
+    start = time.perf_counter()
+    for p_id in ids:
+        if clear_cache:
+            backend.cache.clear()
+        fn(backend, p_id, parsed)
+    return (time.perf_counter() - start) * 1000 / len(ids)
+
+
+def run(n_patients, visits, samples):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        conn = get_db_connection(db_path)
+        make_database(conn, n_patients, visits=visits, start_year=2014)
+        apply_migrations(conn)
+        conn.execute("ANALYZE")
+        conn.close()
+
+        backend = ClinicalBackend(db_path)
+        rows = len(backend.get_patient_labs('P0000001'))
+        print(f"{n_patients} patients, ~{rows:,} lab rows each (2014-2025)\n")
+        print(f"{'question':>28} {'pandas cold':>12} {'pandas warm':>12} {'sql ms':>8} {'speedup':>8}")
+
+        ids = [f'P{random.randint(1, n_patients):07d}' for _ in range(samples)]
+        for question in QUESTIONS:
+            parsed = clinical_router.parse(question)
+            cold = time_answers(answer_pandas, backend, ids, parsed, clear_cache=True)
+            warm = time_answers(answer_pandas, backend, ids, parsed, clear_cache=False)
+            sql = time_answers(answer_sql, backend, ids, parsed, clear_cache=False)
+            print(f"{question:>28} {cold:>12.2f} {warm:>12.2f} {sql:>8.2f} {min(cold, warm) / sql:>7.1f}x")
+        backend.pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--patients', type=int, default=200)
+    parser.add_argument('--visits', type=int, default=600, help='full lab panels per patient')
+    parser.add_argument('--samples', type=int, default=100, help='patients queried per question')
+    args = parser.parse_args()
+    run(args.patients, args.visits, args.samples)
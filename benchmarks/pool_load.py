@@ -0,0 +1,100 @@
+"""Read throughput of the connection pool under 1-32 concurrent sessions.
+
+Each simulated session is a thread that loops over random patients and
+loads their labs, appointments and medications, like a dashboard rerun.
+For comparison the same load is run against one shared connection behind
+a lock (the pre-pool behaviour).
+
+    python -m benchmarks.pool_load [--patients 2000] [--seconds 3]
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from benchmarks._data import make_database
+from database import get_db_connection
+from db_pool import ConnectionPool
+from migrations import apply_migrations
+
+READS = [
+    "SELECT * FROM lab_results WHERE patient_id = ? ORDER BY result_date DESC",
+    "SELECT * FROM appointments WHERE patient_id = ? ORDER BY appointment_date DESC",
+    "SELECT * FROM medications WHERE patient_id = ? ORDER BY status ASC, start_date DESC",
+]
+
+
+def run_sessions(borrow, n_sessions, n_patients, seconds):
+    """Run `n_sessions` reader threads for `seconds`; returns page loads/sec"""
+    counts = [0] * n_sessions
+    stop = threading.Event()
+
+    def session(idx):
+        rng = random.Random(idx)
+        while not stop.is_set():
+            p_id = f'P{rng.randint(1, n_patients):07d}'
+            with borrow() as conn:
+                for sql in READS:
+                    conn.execute(sql, (p_id,)).fetchall()
+            counts[idx] += 1
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(n_sessions)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return sum(counts) / seconds
+
+
+class SharedConnection:
+    """Single connection serialized by a lock"""
+    def __init__(self, db_name):
+        self.conn = get_db_connection(db_name)
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        shared = self
+
+        class _Borrow:
+            def __enter__(self):
+                shared.lock.acquire()
+                return shared.conn
+
+            def __exit__(self, *exc):
+                shared.lock.release()
+
+        return _Borrow()
+
+
+def run(n_patients, seconds, sessions):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, 'bench.db')
+        conn = get_db_connection(db_name)
+        make_database(conn, n_patients, visits=20)
+        apply_migrations(conn)
+        conn.close()
+
+        pool = ConnectionPool(db_name, max_readers=max(sessions))
+        shared = SharedConnection(db_name)
+
+        print(f"{'sessions':>8} {'shared conn/s':>14} {'pool/s':>10} {'ratio':>6}")
+        for n in sessions:
+            base = run_sessions(shared, n, n_patients, seconds)
+            pooled = run_sessions(pool.reader, n, n_patients, seconds)
+            print(f"{n:>8} {base:>14.0f} {pooled:>10.0f} {pooled / base:>5.1f}x")
+        print("pool stats:", pool.stats())
+        pool.close()
+        shared.conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--patients', type=int, default=2000)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+    run(args.patients, args.seconds, args.sessions)
@@ -0,0 +1,59 @@
+"""Per-patient query latency before and after the migration indexes.
+
+    python -m benchmarks.query_indexes [--sizes 100 10000 100000] [--visits 20]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks._data import make_database
+from database import get_db_connection
+from migrations import apply_migrations
+
+# Same statements ClinicalBackend issues for a patient
+QUERIES = {
+    'labs': "SELECT * FROM lab_results WHERE patient_id = ? ORDER BY result_date DESC",
+    'appointments': "SELECT * FROM appointments WHERE patient_id = ? ORDER BY appointment_date DESC",
+    'medications': "SELECT * FROM medications WHERE patient_id = ? ORDER BY status ASC, start_date DESC",
+}
+
+
+def time_queries(conn, patient_ids):
+    """Mean milliseconds per call for each query over `patient_ids`"""
+    results = {}
+    for name, sql in QUERIES.items():
+        start = time.perf_counter()
+        for p_id in patient_ids:
+            conn.execute(sql, (p_id,)).fetchall()
+        results[name] = (time.perf_counter() - start) * 1000 / len(patient_ids)
+    return results
+
+
+def run(sizes, visits, samples):
+    print(f"{'patients':>10} {'query':>13} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = get_db_connection(os.path.join(tmp, 'bench.db'))
+            make_database(conn, n, visits=visits)
+            ids = [f'P{random.randint(1, n):07d}' for _ in range(samples)]
+
+            # Fewer samples before the indexes exist - every call is a full scan
+            before = time_queries(conn, ids[:max(5, samples // 20)] if n > 1000 else ids)
+            apply_migrations(conn)
+            conn.execute("ANALYZE")
+            after = time_queries(conn, ids)
+            conn.close()
+
+        for name in QUERIES:
+            print(f"{n:>10} {name:>13} {before[name]:>10.3f} {after[name]:>10.3f} {before[name] / after[name]:>7.0f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10_000, 100_000])
+    parser.add_argument('--visits', type=int, default=20, help='visits (full lab panels) per patient')
+    parser.add_argument('--samples', type=int, default=200, help='patients queried per measurement')
+    args = parser.parse_args()
+    run(args.sizes, args.visits, args.samples)
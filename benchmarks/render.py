@@ -0,0 +1,61 @@
+"""Markdown rendering: iterrows + string concatenation vs render.py.
+
+    python -m benchmarks.render [--sizes 20 1000 100000]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from backend import LAB_TABLE_COLUMNS
+from render import render_table
+
+
+def make_labs(n, seed=0):
+    rng = np.random.default_rng(seed)
+    tests = np.array(['Glucose', 'HbA1c', 'LDL Cholesterol', 'BP Systolic', 'Creatinine'])
+    return pd.DataFrame({
+        'result_date': pd.Timestamp('2025-12-31') - pd.to_timedelta(rng.integers(0, 3650, n), unit='D'),
+        'test_name': tests[rng.integers(0, len(tests), n)],
+        'value': rng.uniform(1, 200, n).round(1),
+        'unit': 'mg/dL',
+        'interpretation': np.where(rng.random(n) < 0.7, 'Normal', 'High'),
+    })
+
+
+def render_iterrows(df):
+    """The pre-render.py implementation, kept for comparison"""
+    response = "| Date | Test | Value | Status |\n"
+    response += "|---|---|---|---|\n"
+    for _, row in df.iterrows():
+        date_str = row['result_date'].strftime('%Y-%m-%d')
+        response += f"| {date_str} | {row['test_name']} | {row['value']} {row['unit']} | {row['interpretation']} |\n"
+    return response
+
+
+def best_of(fn, df, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn(df)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, out
+
+
+def run(sizes):
+    print(f"{'rows':>8} {'iterrows ms':>12} {'vectorized ms':>14} {'speedup':>8}")
+    for n in sizes:
+        df = make_labs(n)
+        repeat = 5 if n <= 10_000 else 1
+        old_ms, old = best_of(render_iterrows, df, repeat)
+        new_ms, new = best_of(lambda d: render_table(d, LAB_TABLE_COLUMNS), df, repeat)
+        assert old == new, "renderers disagree"
+        print(f"{n:>8} {old_ms:>12.2f} {new_ms:>14.2f} {old_ms / new_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 1_000, 100_000])
+    args = parser.parse_args()
+    run(args.sizes)
@@ -0,0 +1,58 @@
+"""Passage retrieval: index build, incremental refresh and top-k search.
+
+Builds the BM25 passage index (retrieval.py) over a synthetic clinic,
+times a one-row incremental refresh and reopening the memory-mapped index,
+then per-patient and clinic-wide searches.
+
+    python -m benchmarks.retrieval [--patients 5000] [--visits 10]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks._data import make_database
+from database import get_db_connection
+from db_pool import get_pool
+from retrieval import PassageIndex
+
+QUERIES = ['HbA1c high', 'LDL Cholesterol 2024', 'metformin twice daily', 'follow-up visit']
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def run(n_patients, visits, repeat=20):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        conn = get_db_connection(db_path)
+        make_database(conn, n_patients, visits=visits)
+        conn.close()
+
+        index = PassageIndex(db_path)
+        print(f"{n_patients:,} patients, {visits * 10} lab rows each\n")
+        print(f"initial build       {timed(index.refresh):8.2f} s   ({index.stats()['passages']:,} passages)")
+        with get_pool(db_path).writer() as w:
+            w.execute("INSERT INTO lab_results (patient_id, result_date, test_name, value) "
+                      "VALUES ('P0000001', '2025-12-31', 'HbA1c', 6.1)")
+        print(f"one-row refresh     {timed(index.refresh) * 1000:8.1f} ms")
+        print(f"reopen (mmap)       {timed(PassageIndex(db_path).search, 'HbA1c', 'P0000001') * 1000:8.1f} ms\n")
+
+        print(f"{'query':<28} {'patient ms':>11} {'clinic ms':>10}")
+        for query in QUERIES:
+            patient = statistics.median(timed(index.search, query, 'P0000001') for _ in range(repeat))
+            clinic = statistics.median(timed(index.search, query) for _ in range(repeat))
+            print(f"{query:<28} {patient * 1000:>11.2f} {clinic * 1000:>10.2f}")
+        get_pool(db_path).close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--patients', type=int, default=5_000)
+    parser.add_argument('--visits', type=int, default=10, help='full lab panels per patient')
+    args = parser.parse_args()
+    run(args.patients, args.visits)
@@ -0,0 +1,61 @@
+"""Similar patients: feature-matrix build, incremental refresh and kNN search.
+
+Builds the similarity index (similarity.py) over a synthetic clinic, times
+refreshing it after one new lab result, then top-k searches over the whole
+clinic and within the patient's diagnosis.
+
+    python -m benchmarks.similarity [--patients 500000] [--visits 2] [--k 10]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks._data import make_database
+from database import get_db_connection
+from db_pool import get_pool
+from migrations import apply_migrations
+from similarity import SimilarityIndex
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def run(n_patients, visits, k, repeat=50):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        conn = get_db_connection(db_path)
+        start = time.perf_counter()
+        make_database(conn, n_patients, visits=visits)
+        apply_migrations(conn)
+        conn.close()
+        print(f"{n_patients:,} patients, {visits * 10} lab rows each "
+              f"(generated in {time.perf_counter() - start:.0f}s)\n")
+
+        index = SimilarityIndex(db_path)
+        print(f"initial build       {timed(index.refresh):8.2f} s   "
+              f"({index.stats()['patients']:,} x {index.stats()['features']} features)")
+        with get_pool(db_path).writer() as w:
+            w.execute("INSERT INTO lab_results (patient_id, result_date, test_name, value) "
+                      "VALUES ('P0000001', '2025-12-31', 'HbA1c', 6.1)")
+        print(f"one-row refresh     {timed(index.refresh) * 1000:8.1f} ms\n")
+
+        patients = [f'P{i:07d}' for i in range(1, n_patients + 1, max(1, n_patients // repeat))]
+        for label, same in (('clinic-wide', False), ('same diagnosis', True)):
+            times = [timed(index.similar, p, k, same) for p in patients]
+            print(f"top-{k} {label:<15} median {statistics.median(times) * 1000:6.1f} ms   "
+                  f"max {max(times) * 1000:6.1f} ms")
+        get_pool(db_path).close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--patients', type=int, default=500_000)
+    parser.add_argument('--visits', type=int, default=2, help='full lab panels per patient')
+    parser.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+    run(args.patients, args.visits, args.k)
@@ -0,0 +1,78 @@
+"""Streamed answers: time to first byte vs total time.
+
+Times stream_analysis_query (first piece, and the whole answer) against
+run_analysis_query on cold caches, for a patient with a long history.
+
+    python -m benchmarks.streaming [--patients 2000] [--visits 100]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from backend import ClinicalBackend
+from benchmarks._data import make_database
+from database import get_db_connection
+from migrations import apply_migrations
+
+QUERIES = [
+    'summary',
+    'show labs',
+    'glucose trend last 3 years',
+    'hemoglobin and creatinine',
+    'show medications',
+    'appointments',
+]
+
+
+def cold(backend):
+    backend.responses.clear()
+    backend.cache.clear()
+
+
+def stream_times(backend, query, patient_id):
+    cold(backend)
+    start = time.perf_counter()
+    stream = backend.stream_analysis_query(query, patient_id)
+    next(stream)
+    first = time.perf_counter() - start
+    for _ in stream:
+        pass
+    return first, time.perf_counter() - start
+
+
+def run_time(backend, query, patient_id):
+    cold(backend)
+    start = time.perf_counter()
+    backend.run_analysis_query(query, patient_id)
+    return time.perf_counter() - start
+
+
+def run(n_patients, visits, repeat=20):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        conn = get_db_connection(db_path)
+        make_database(conn, n_patients, visits=visits)
+        apply_migrations(conn)
+        conn.close()
+
+        backend = ClinicalBackend(db_path)
+        patient = 'P0000001'
+        print(f"{n_patients:,} patients, {visits * 10} lab rows each; cold caches, median of {repeat}\n")
+        print(f"{'query':<28} {'first ms':>9} {'stream ms':>10} {'blocking ms':>12}")
+        for query in QUERIES:
+            streamed = [stream_times(backend, query, patient) for _ in range(repeat)]
+            blocking = [run_time(backend, query, patient) for _ in range(repeat)]
+            print(f"{query:<28} {statistics.median(t[0] for t in streamed) * 1000:>9.2f} "
+                  f"{statistics.median(t[1] for t in streamed) * 1000:>10.2f} "
+                  f"{statistics.median(blocking) * 1000:>12.2f}")
+        backend.pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--patients', type=int, default=2_000)
+    parser.add_argument('--visits', type=int, default=100, help='full lab panels per patient')
+    args = parser.parse_args()
+    run(args.patients, args.visits)
@@ -0,0 +1,70 @@
+"""Tracing overhead: the query pipeline with tracing off vs on.
+
+Times run_analysis_query on cold caches with tracing disabled and enabled,
+the cost of a disabled span() call, and prints the per-stage p50 / p95
+table the dashboard panel shows.
+
+    python -m benchmarks.tracing [--patients 2000] [--visits 20]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import timeit
+
+import tracing
+from backend import ClinicalBackend
+from benchmarks._data import make_database
+from database import get_db_connection
+from migrations import apply_migrations
+
+QUERIES = ['summary', 'show labs', 'glucose trend last 3 years', 'show medications', 'appointments']
+
+
+def pipeline_time(backend, patients):
+    start = time.perf_counter()
+    for patient_id in patients:
+        for query in QUERIES:
+            backend.responses.clear()
+            backend.cache.clear()
+            backend.run_analysis_query(query, patient_id)
+    return time.perf_counter() - start
+
+
+def run(n_patients, visits, repeat=5):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        conn = get_db_connection(db_path)
+        make_database(conn, n_patients, visits=visits)
+        apply_migrations(conn)
+        conn.close()
+
+        backend = ClinicalBackend(db_path)
+        patients = [f'P{i:07d}' for i in range(1, min(n_patients, 20) + 1)]
+        n_calls = len(patients) * len(QUERIES)
+        pipeline_time(backend, patients)     # warm up connections and imports
+
+        tracing.disable()
+        off = statistics.median(pipeline_time(backend, patients) for _ in range(repeat))
+        tracing.enable()
+        on = statistics.median(pipeline_time(backend, patients) for _ in range(repeat))
+        tracing.disable()
+        noop = min(timeit.repeat(lambda: tracing.span('x'), number=100_000, repeat=5)) / 100_000
+
+        print(f"{n_patients:,} patients, {visits * 10} lab rows each; {n_calls} cold run_analysis_query calls\n")
+        print(f"tracing off     {off / n_calls * 1000:8.2f} ms / call")
+        print(f"tracing on      {on / n_calls * 1000:8.2f} ms / call   ({(on / off - 1) * 100:+.1f}%)")
+        print(f"disabled span() {noop * 1e9:8.0f} ns\n")
+        print(f"{'stage':<22} {'count':>6} {'p50 ms':>8} {'p95 ms':>8}")
+        for row in tracing.stats():
+            print(f"{row['stage']:<22} {row['count']:>6} {row['p50_ms']:>8.3f} {row['p95_ms']:>8.3f}")
+        backend.pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--patients', type=int, default=2_000)
+    parser.add_argument('--visits', type=int, default=20, help='full lab panels per patient')
+    args = parser.parse_args()
+    run(args.patients, args.visits)
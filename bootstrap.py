@@ -0,0 +1,127 @@
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+# Build-once database bootstrap.
+#
+# A seeded database is built into a temporary file next to the target,
+# stamped with a fingerprint of its seed definition, and swapped into place
+# with os.replace, so readers only ever see the old file or the complete new
+# one. A lock file serializes builders: the first process rebuilds, the rest
+# wait and then find the fingerprint already current. When the fingerprint
+# matches nothing is built at all.
+#
+# Windows refuses to replace a file that is open, so the caller passes a
+# release() that closes its own connections first, and the swap is retried
+# for SWAP_TIMEOUT seconds while queries still running elsewhere let go.
+# If the file stays busy the old database is kept and PermissionError is
+# raised.
+
+SWAP_TIMEOUT = 10
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _lock(f):
+        while True:
+            try:
+                # LK_LOCK itself gives up after ~10 seconds
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                time.sleep(0.1)
+
+    def _unlock(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    def _unlock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive inter-process lock on `path` (created if missing)"""
+    with open(path, 'a+') as f:
+        f.seek(0)
+        _lock(f)
+        try:
+            yield
+        finally:
+            _unlock(f)
+
+
+def stored_fingerprint(db_path):
+    """Fingerprint stamped into `db_path` by build_once, or None"""
+    if not os.path.exists(db_path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            row = conn.execute("SELECT value FROM build_info WHERE key = 'fingerprint'").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        # Missing table (built before fingerprints existed) or not a database
+        return None
+    return row[0] if row else None
+
+
+def _swap(tmp_path, db_path):
+    deadline = time.monotonic() + SWAP_TIMEOUT
+    while True:
+        try:
+            os.replace(tmp_path, db_path)
+            return
+        except PermissionError:
+            # Still open somewhere (Windows); readers finish within moments
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.1)
+
+
+def build_once(db_path, fingerprint, build, release=None):
+    """Build `db_path` with build(conn) unless it already carries `fingerprint`.
+
+    build() runs inside one transaction on a fresh temporary database;
+    release(), if given, is called just before the new file replaces the
+    old one, to close this process's connections to it. Returns True if
+    this call built the database, False if it was current.
+    """
+    if stored_fingerprint(db_path) == fingerprint:
+        return False
+
+    with file_lock(db_path + '.lock'):
+        # Another process may have finished the build while we waited
+        if stored_fingerprint(db_path) == fingerprint:
+            return False
+
+        tmp_path = f"{db_path}.{os.getpid()}.tmp"
+        for suffix in ('', '-journal'):
+            if os.path.exists(tmp_path + suffix):
+                os.remove(tmp_path + suffix)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            with conn:
+                build(conn)
+                conn.execute("CREATE TABLE build_info (key TEXT PRIMARY KEY, value TEXT)")
+                conn.execute("INSERT INTO build_info VALUES ('fingerprint', ?)", (fingerprint,))
+        except BaseException:
+            conn.close()
+            os.remove(tmp_path)
+            raise
+        conn.close()
+        try:
+            if release is not None:
+                release()
+            _swap(tmp_path, db_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    return True
@@ -0,0 +1,138 @@
+import sys
+import threading
+from collections import OrderedDict
+import pandas as pd
+from database import DB_NAME
+
+# Process-wide read cache shared by every ClinicalBackend instance.
+#
+# Streamlit constructs a new backend on every rerun, so the cache lives at
+# module level. Entries are keyed by (table, patient_id) - patient_id is None
+# for whole-table reads like the patient list - and evicted least recently
+# used once the total size exceeds max_bytes.
+#
+# Every invalidation also bumps a data version: per patient, or for
+# everyone when no patient is given. Caches of derived results (see
+# response_cache.py) put version(patient_id) in their keys, so a write makes
+# the patient's old entries unreachable without them having to be found.
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def _sizeof(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+def _copy(value):
+    # Callers are free to mutate what they get back (e.g. re-typing columns)
+    if isinstance(value, (pd.DataFrame, dict)):
+        return value.copy()
+    return value
+
+
+class DataCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._epoch = 0
+        self._versions = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_load(self, table, patient_id, loader):
+        """Return the cached value for (table, patient_id), loading it on a miss"""
+        key = (table, patient_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _copy(entry[0])
+            self.misses += 1
+            generation = self._generation
+
+        value = loader()
+
+        with self._lock:
+            # Don't store a result that may predate an invalidation that
+            # happened while we were loading
+            if generation == self._generation:
+                self._put(key, value)
+        return _copy(value)
+
+    def _put(self, key, value):
+        size = _sizeof(value)
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._entries[key] = (value, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def invalidate(self, table=None, patient_id=None):
+        """Drop entries for a table and/or patient (None matches everything).
+
+        Whole-table entries (patient_id None) of the given table are always
+        dropped, since any patient's write changes them.
+        """
+        with self._lock:
+            self._generation += 1
+            if patient_id is None:
+                self._epoch += 1
+            else:
+                self._versions[patient_id] = self._versions.get(patient_id, 0) + 1
+            for key in list(self._entries):
+                k_table, k_patient = key
+                if table is not None and k_table != table:
+                    continue
+                if patient_id is not None and k_patient not in (patient_id, None):
+                    continue
+                self._bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        self.invalidate()
+
+    def version(self, patient_id):
+        """Opaque data version of a patient's rows; changes on every write to them"""
+        with self._lock:
+            return self._epoch, self._versions.get(patient_id, 0)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_data_cache(db_name=DB_NAME):
+    """Process-wide cache for `db_name`, created on first use"""
+    with _caches_lock:
+        cache = _caches.get(db_name)
+        if cache is None:
+            cache = DataCache()
+            _caches[db_name] = cache
+        return cache
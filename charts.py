@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+
+from cache import DataCache
+
+# Chart building for long lab and vital series.
+#
+# Plotly ships every point to the browser as JSON, so a series with
+# thousands of readings is dominated by serialization, not drawing. Series
+# are thinned to a point budget before plotting:
+#
+# - 'lttb' (Largest-Triangle-Three-Buckets) keeps, per bucket, the point
+#   that spans the largest triangle with its neighbours - the visual shape
+#   of the line survives.
+# - 'minmax' keeps each bucket's lowest and highest reading - no spike is
+#   ever dropped, at the cost of a noisier line.
+#
+# Built figures are cached as JSON keyed by (series, window, version) and
+# patient, where `version` is anything that changes with the data (e.g. the
+# reading count and latest date from lab_trend_summary). Callers build
+# charts only when the tab or message showing them is open.
+
+DEFAULT_MAX_POINTS = 500
+
+_figure_cache = DataCache(max_bytes=64 * 1024 * 1024)
+
+
+def _as_float(values):
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[ns]').astype(np.int64).astype(float)
+    return values.astype(float)
+
+
+def lttb_indices(x, y, n_out):
+    """Indices of the `n_out` points LTTB keeps (x ascending, no NaNs)"""
+    x, y = _as_float(x), _as_float(y)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # First and last points are always kept; n_out - 2 buckets in between.
+    # Each bucket is compared against the average of the next one (the
+    # last point, for the last bucket) - precomputed for all buckets at once
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    counts = np.diff(np.r_[edges, n])
+    avg_x = np.add.reduceat(x, edges) / counts
+    avg_y = np.add.reduceat(y, edges) / counts
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        xa, ya = x[a], y[a]
+        area = np.abs((xa - avg_x[i + 1]) * (y[lo:hi] - ya) - (xa - x[lo:hi]) * (avg_y[i + 1] - ya))
+        a = lo + area.argmax()
+        out[i + 1] = a
+    return out
+
+
+def minmax_indices(y, n_out):
+    """Indices of each bucket's min and max, about `n_out` points in all"""
+    y = _as_float(y)
+    n = len(y)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+    edges = np.linspace(0, n, n_out // 2 + 1).astype(np.int64)
+    keep = [(lo + y[lo:hi].argmin(), lo + y[lo:hi].argmax()) for lo, hi in zip(edges[:-1], edges[1:]) if hi > lo]
+    return np.unique(np.array(keep, dtype=np.int64).ravel())
+
+
+def downsample(df, x, ys, max_points=DEFAULT_MAX_POINTS, method='lttb'):
+    """Rows of `df` (sorted by `x`) to plot for the `ys` columns.
+
+    Each y column is thinned separately and the kept rows are merged, so
+    several traces still share one x axis.
+    """
+    if len(df) <= max_points:
+        return df
+    if isinstance(ys, str):
+        ys = [ys]
+    xs = df[x]
+    if not pd.api.types.is_numeric_dtype(xs):
+        xs = pd.to_datetime(xs)
+    xs = xs.to_numpy()
+    keep = []
+    for column in ys:
+        values = df[column].to_numpy(dtype=float)
+        valid = np.flatnonzero(~np.isnan(values))
+        if method == 'minmax':
+            picked = minmax_indices(values[valid], max_points)
+        else:
+            picked = lttb_indices(xs[valid], values[valid], max_points)
+        keep.append(valid[picked])
+    return df.iloc[np.unique(np.concatenate(keep))]
+
+
+def cached_figure(patient_id, series, window, version, build):
+    """Figure from the cache, or build() it (a plotly Figure) and cache its JSON"""
+    key = (series, window, version)
+    fig_json = _figure_cache.get_or_load(key, patient_id, lambda: pio.to_json(build(), validate=False))
+    return pio.from_json(fig_json, skip_invalid=True)
+
+
+def figure_cache_stats():
+    return _figure_cache.stats()
@@ -0,0 +1,81 @@
+import json
+import os
+import tempfile
+import weakref
+from collections import deque
+
+# Compact chat history for long chatbot sessions.
+#
+# Messages keep only text: the role, the content and, for assistant answers,
+# the spec the answer was computed from ({'patient_id', 'query'}). Tables
+# and charts are not stored; the page recomputes them from the spec when
+# the user opens them. Only the newest `max_messages` stay in memory; older
+# ones are appended to a per-session JSONL file and read back on request.
+# The file is removed with clear() or when the history is garbage collected
+# (i.e. the session ended).
+
+DEFAULT_MAX_MESSAGES = 40
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class ChatHistory:
+    def __init__(self, max_messages=DEFAULT_MAX_MESSAGES, spill_dir=None):
+        self.max_messages = max_messages
+        self.spill_dir = spill_dir
+        self._recent = deque()
+        self._spilled = 0
+        self._next_id = 0
+        self._path = None
+        self._finalizer = None
+
+    def append(self, role, content, spec=None):
+        """Add a message; `spec` reproduces an assistant answer's data"""
+        message = {'id': self._next_id, 'role': role, 'content': content, 'spec': spec}
+        self._next_id += 1
+        self._recent.append(message)
+        if len(self._recent) > self.max_messages:
+            self._spill(self._recent.popleft())
+        return message
+
+    def _spill(self, message):
+        if self._path is None:
+            fd, self._path = tempfile.mkstemp(prefix='chat-', suffix='.jsonl', dir=self.spill_dir)
+            os.close(fd)
+            self._finalizer = weakref.finalize(self, _remove, self._path)
+        with open(self._path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(message) + '\n')
+        self._spilled += 1
+
+    @property
+    def spilled(self):
+        """Number of older messages on disk"""
+        return self._spilled
+
+    def recent(self):
+        """In-memory messages, oldest first"""
+        return list(self._recent)
+
+    def older(self, limit=None):
+        """Spilled messages read back from disk, oldest first (the newest `limit` only)"""
+        if not self._spilled:
+            return []
+        with open(self._path, encoding='utf-8') as f:
+            if limit is None:
+                return [json.loads(line) for line in f]
+            return [json.loads(line) for line in deque(f, maxlen=limit)]
+
+    def clear(self):
+        self._recent.clear()
+        self._spilled = 0
+        if self._finalizer is not None:
+            self._finalizer()
+            self._path = self._finalizer = None
+
+    def __len__(self):
+        return self._spilled + len(self._recent)
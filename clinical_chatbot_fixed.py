@@ -5,30 +5,34 @@ import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
 from datetime import datetime, timedelta
-import sqlite3
-import os
 import re
 from typing import Dict, List, Optional
 import random
+import hashlib
+import json
+from render import render_rows
+from summaries import control_status
+from intent_router import IntentRouter
+from bootstrap import build_once
+from db_pool import ConnectionPool
+from assistant_service import get_assistant_service
+from chat_history import ChatHistory
+from charts import cached_figure, downsample
+from response_cache import ResponseCache
+from retrieval import PASSAGE_COLUMNS, PassageIndex, query_terms
+import tracing
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
 # ============================================
 # 1. COMPLETE DATABASE CREATION WITH ALL DATA
 # ============================================
-def create_complete_database():
-    """Create a fully populated clinical database"""
-    
-    # Remove old database if exists
-    if os.path.exists('complete_clinical.db'):
-        os.remove('complete_clinical.db')
-    
-    conn = sqlite3.connect('complete_clinical.db')
-    
-    # ============================================
-    # CREATE ALL TABLES
-    # ============================================
-    
-    # Patients table
-    conn.execute('''
+# The demo database is rebuilt only when this definition (schema + seed
+# rows) changes; see bootstrap.py
+COMPLETE_DB = 'complete_clinical.db'
+SEED = 42
+
+COMPLETE_SCHEMA = [
+    '''
     CREATE TABLE patients (
         patient_id TEXT PRIMARY KEY,
         first_name TEXT,
@@ -44,10 +48,8 @@ def create_complete_database():
         next_appointment DATE,
         emergency_contact TEXT
     )
-    ''')
-    
-    # Lab results table
-    conn.execute('''
+    ''',
+    '''
     CREATE TABLE lab_results (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         patient_id TEXT,
@@ -60,10 +62,8 @@ def create_complete_database():
         interpretation TEXT,
         lab_name TEXT
     )
-    ''')
-    
-    # Vital signs table
-    conn.execute('''
+    ''',
+    '''
     CREATE TABLE vital_signs (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         patient_id TEXT,
@@ -78,10 +78,8 @@ def create_complete_database():
         height_cm REAL,
         bmi REAL
     )
-    ''')
-    
-    # Medications table
-    conn.execute('''
+    ''',
+    '''
     CREATE TABLE medications (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         patient_id TEXT,
@@ -96,10 +94,8 @@ def create_complete_database():
         prescribing_physician TEXT,
         pharmacy TEXT
     )
-    ''')
-    
-    # Clinical notes table
-    conn.execute('''
+    ''',
+    '''
     CREATE TABLE clinical_notes (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         patient_id TEXT,
@@ -109,10 +105,101 @@ def create_complete_database():
         content TEXT,
         physician TEXT
     )
-    ''')
-    
+    ''',
+    '''
+    CREATE INDEX idx_clinical_notes_patient ON clinical_notes (patient_id, note_date)
+    ''',
+    # Full-text index over note titles and bodies, plus the patient ID so a
+    # search can be narrowed to one patient inside the index. External
+    # content: the text is only stored in clinical_notes, and the triggers
+    # keep the index in step with it
+    '''
+    CREATE VIRTUAL TABLE clinical_notes_fts USING fts5(
+        patient_id, title, content,
+        content='clinical_notes', content_rowid='id',
+        tokenize='porter unicode61'
+    )
+    ''',
+    '''
+    CREATE TRIGGER clinical_notes_fts_insert AFTER INSERT ON clinical_notes BEGIN
+        INSERT INTO clinical_notes_fts (rowid, patient_id, title, content)
+        VALUES (new.id, new.patient_id, new.title, new.content);
+    END
+    ''',
+    '''
+    CREATE TRIGGER clinical_notes_fts_delete AFTER DELETE ON clinical_notes BEGIN
+        INSERT INTO clinical_notes_fts (clinical_notes_fts, rowid, patient_id, title, content)
+        VALUES ('delete', old.id, old.patient_id, old.title, old.content);
+    END
+    ''',
+    '''
+    CREATE TRIGGER clinical_notes_fts_update AFTER UPDATE OF patient_id, title, content ON clinical_notes BEGIN
+        INSERT INTO clinical_notes_fts (clinical_notes_fts, rowid, patient_id, title, content)
+        VALUES ('delete', old.id, old.patient_id, old.title, old.content);
+        INSERT INTO clinical_notes_fts (rowid, patient_id, title, content)
+        VALUES (new.id, new.patient_id, new.title, new.content);
+    END
+    ''',
+    # One JSON snapshot per patient for the clinical summary, written at
+    # build time (the database is read-only afterwards)
+    '''
+    CREATE TABLE patient_summary (
+        patient_id TEXT PRIMARY KEY,
+        snapshot TEXT NOT NULL
+    ) WITHOUT ROWID
+    ''',
+]
+
+# Ranked note search; highlights are markdown bold
+NOTE_SEARCH_SQL = '''
+    SELECT n.id AS note_id, n.patient_id, n.note_date, n.note_type,
+           highlight(clinical_notes_fts, 1, '**', '**') AS title,
+           snippet(clinical_notes_fts, 2, '**', '**', ' … ', 16) AS snippet,
+           n.physician
+    FROM clinical_notes_fts
+    JOIN clinical_notes n ON n.id = clinical_notes_fts.rowid
+    WHERE clinical_notes_fts MATCH ?
+    ORDER BY clinical_notes_fts.rank
+    LIMIT ? OFFSET ?
+'''
+NOTES_PER_PAGE = 10
+
+
+def fts_query(text, patient_id=None):
+    """FTS5 MATCH expression for free text: every word must occur in the title
+    or body, the last one as a prefix; optionally only in one patient's notes"""
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    match = f"{{title content}} : ({' '.join(terms)})"
+    if patient_id is not None:
+        # Intersected inside the index: the patient's doclist is short
+        match = f'patient_id : "{patient_id.replace(chr(34), chr(34) * 2)}" AND ' + match
+    return match
+
+# table -> insert columns, in the order the seed rows are laid out
+SEED_COLUMNS = {
+    'patients': ['patient_id', 'first_name', 'last_name', 'date_of_birth', 'age', 'gender', 'primary_diagnosis',
+                 'secondary_diagnosis', 'allergies', 'primary_physician', 'last_visit', 'next_appointment',
+                 'emergency_contact'],
+    'lab_results': ['patient_id', 'result_date', 'test_name', 'value', 'unit', 'reference_low', 'reference_high',
+                    'interpretation', 'lab_name'],
+    'vital_signs': ['patient_id', 'measurement_date', 'systolic_bp', 'diastolic_bp', 'heart_rate', 'temperature',
+                    'respiratory_rate', 'oxygen_saturation', 'weight_kg', 'height_cm', 'bmi'],
+    'medications': ['patient_id', 'medication_name', 'generic_name', 'dosage', 'frequency', 'route', 'start_date',
+                    'end_date', 'status', 'prescribing_physician', 'pharmacy'],
+    'clinical_notes': ['patient_id', 'note_date', 'note_type', 'title', 'content', 'physician'],
+}
+
+
+def seed_rows(seed=SEED):
+    """Seed data as {table: [row tuples]}; the same seed always gives the same rows"""
+    rng = random.Random(seed)
+
     # ============================================
-    # INSERT PATIENTS
+    # PATIENTS
     # ============================================
     
     patients = [
@@ -147,13 +234,9 @@ def create_complete_database():
          'Linda Brown (555-0127)'),
     ]
     
-    for patient in patients:
-        conn.execute('''
-        INSERT INTO patients VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
-        ''', patient)
     
     # ============================================
-    # INSERT LAB RESULTS (HbA1c, Glucose, Cholesterol, etc.)
+    # LAB RESULTS (HbA1c, Glucose, Cholesterol, etc.)
     # ============================================
     
     # Lab test definitions
@@ -176,6 +259,7 @@ def create_complete_database():
     }
     
     # Generate lab data for each patient
+    lab_results = []
     for patient_id in ['P001', 'P002', 'P003', 'P004', 'P005']:
         # Different test sets based on patient condition
         if patient_id == 'P001':  # Diabetic
@@ -202,24 +286,24 @@ def create_complete_database():
                 # Patient-specific patterns
                 if patient_id == 'P001' and test_name == 'HbA1c':
                     # Improving trend for diabetic patient
-                    value = round(8.5 - (month * 0.2) + random.uniform(-0.1, 0.1), 1)
+                    value = round(8.5 - (month * 0.2) + rng.uniform(-0.1, 0.1), 1)
                 elif patient_id == 'P001' and test_name == 'Fasting Glucose':
-                    value = round(145 - (month * 3) + random.uniform(-10, 10), 0)
+                    value = round(145 - (month * 3) + rng.uniform(-10, 10), 0)
                 elif patient_id == 'P003' and test_name == 'LDL Cholesterol':
                     # Improving with treatment
-                    value = round(110 - (month * 2) + random.uniform(-5, 5), 0)
+                    value = round(110 - (month * 2) + rng.uniform(-5, 5), 0)
                 elif patient_id == 'P005' and test_name == 'Creatinine':
                     # Stable but elevated for renal patient
-                    value = round(1.8 + random.uniform(-0.1, 0.1), 1)
+                    value = round(1.8 + rng.uniform(-0.1, 0.1), 1)
                 elif patient_id == 'P005' and test_name == 'eGFR':
                     # Reduced for renal patient
-                    value = round(45 + random.uniform(-2, 2), 0)
+                    value = round(45 + rng.uniform(-2, 2), 0)
                 else:
                     # Random normal/abnormal values
-                    if random.random() < 0.8:  # 80% normal
-                        value = round(random.uniform(test_info['low'], test_info['high']), 1)
+                    if rng.random() < 0.8:  # 80% normal
+                        value = round(rng.uniform(test_info['low'], test_info['high']), 1)
                     else:  # 20% abnormal
-                        value = round(test_info['high'] * random.uniform(1.1, 1.5), 1)
+                        value = round(test_info['high'] * rng.uniform(1.1, 1.5), 1)
                 
                 # Determine interpretation
                 if value < test_info['low']:
@@ -229,55 +313,47 @@ def create_complete_database():
                 else:
                     interpretation = 'Normal'
                 
-                conn.execute('''
-                INSERT INTO lab_results 
-                (patient_id, result_date, test_name, value, unit, reference_low, reference_high, interpretation, lab_name)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
+                lab_results.append((
                     patient_id, date, test_name, value, test_info['unit'],
                     test_info['low'], test_info['high'], interpretation, 'Main Hospital Lab'
                 ))
     
     # ============================================
-    # INSERT VITAL SIGNS (BP, HR, etc.)
+    # VITAL SIGNS (BP, HR, etc.)
     # ============================================
     
+    vital_signs = []
     for patient_id in ['P001', 'P002', 'P003', 'P004', 'P005']:
         for month in range(6):  # 6 months of vital signs
             date = (datetime(2023, 7, 1) + timedelta(days=30*month)).strftime('%Y-%m-%d')
             
             # Patient-specific patterns
             if patient_id == 'P001':  # Diabetic - improving BP
-                systolic = 140 - (month * 3) + random.randint(-5, 5)
-                diastolic = 90 - (month * 1) + random.randint(-3, 3)
+                systolic = 140 - (month * 3) + rng.randint(-5, 5)
+                diastolic = 90 - (month * 1) + rng.randint(-3, 3)
             elif patient_id == 'P002':  # Hypertensive - controlled
-                systolic = 125 + random.randint(-5, 5)
-                diastolic = 80 + random.randint(-3, 3)
+                systolic = 125 + rng.randint(-5, 5)
+                diastolic = 80 + rng.randint(-3, 3)
             elif patient_id == 'P003':  # Cardiac - stable
-                systolic = 130 + random.randint(-5, 5)
-                diastolic = 85 + random.randint(-3, 3)
+                systolic = 130 + rng.randint(-5, 5)
+                diastolic = 85 + rng.randint(-3, 3)
             else:
-                systolic = random.randint(110, 130)
-                diastolic = random.randint(70, 85)
+                systolic = rng.randint(110, 130)
+                diastolic = rng.randint(70, 85)
             
-            conn.execute('''
-            INSERT INTO vital_signs 
-            (patient_id, measurement_date, systolic_bp, diastolic_bp, heart_rate, 
-             temperature, respiratory_rate, oxygen_saturation, weight_kg, height_cm, bmi)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
+            vital_signs.append((
                 patient_id, date, systolic, diastolic,
-                random.randint(65, 85),  # Heart rate
-                round(random.uniform(36.5, 37.2), 1),  # Temperature
-                random.randint(12, 18),  # Respiratory rate
-                random.randint(95, 99),  # Oxygen saturation
-                round(random.uniform(70, 90), 1),  # Weight
+                rng.randint(65, 85),  # Heart rate
+                round(rng.uniform(36.5, 37.2), 1),  # Temperature
+                rng.randint(12, 18),  # Respiratory rate
+                rng.randint(95, 99),  # Oxygen saturation
+                round(rng.uniform(70, 90), 1),  # Weight
                 175 if patient_id in ['P001', 'P003', 'P005'] else 165,  # Height
-                round(random.uniform(24, 30), 1)  # BMI
+                round(rng.uniform(24, 30), 1)  # BMI
             ))
     
     # ============================================
-    # INSERT MEDICATIONS
+    # MEDICATIONS
     # ============================================
     
     medications = [
@@ -320,16 +396,9 @@ def create_complete_database():
          '2023-04-10', None, 'Active', 'Dr. Sarah Chen', 'Walgreens'),
     ]
     
-    for med in medications:
-        conn.execute('''
-        INSERT INTO medications 
-        (patient_id, medication_name, generic_name, dosage, frequency, route, 
-         start_date, end_date, status, prescribing_physician, pharmacy)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', med)
     
     # ============================================
-    # INSERT CLINICAL NOTES
+    # CLINICAL NOTES
     # ============================================
     
     clinical_notes = [
@@ -368,26 +437,133 @@ Continue current cardiac medications. Schedule stress test in 6 months.''',
          'Dr. Michael Rodriguez'),
     ]
     
-    for note in clinical_notes:
-        conn.execute('''
-        INSERT INTO clinical_notes 
-        (patient_id, note_date, note_type, title, content, physician)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ''', note)
     
-    conn.commit()
-    conn.close()
-    
-    print("✅ Complete database created with ALL medical records!")
-    return True
+    return {
+        'patients': patients,
+        'lab_results': lab_results,
+        'vital_signs': vital_signs,
+        'medications': medications,
+        'clinical_notes': clinical_notes,
+    }
+
+
+SUMMARY_FORMAT = 1            # bump when the summary snapshot layout changes
+SUMMARY_RECENT_LABS = 5
+
+
+def seed_fingerprint(tables):
+    """Content hash of the schema, summary layout and seed rows"""
+    return hashlib.sha256(repr((COMPLETE_SCHEMA, SEED_COLUMNS, SUMMARY_FORMAT, tables)).encode()).hexdigest()
+
+
+def build_summary_snapshot(conn, patient_id):
+    """Everything the clinical summary shows for one patient (None if unknown).
+
+    Reads in the same order as the assistant's getters: the latest BP and
+    HbA1c are the last rows by date, alerts come from the most recent labs.
+    """
+    def rows(sql):
+        cursor = conn.execute(sql, [patient_id])
+        names = [d[0] for d in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+    patient = rows("""SELECT first_name, last_name, age, gender, primary_diagnosis, secondary_diagnosis,
+            allergies, last_visit, next_appointment
+        FROM patients WHERE patient_id = ?""")
+    if not patient:
+        return None
+    bp = rows("SELECT systolic_bp, diastolic_bp FROM vital_signs WHERE patient_id = ? ORDER BY measurement_date")
+    hba1c = rows("""SELECT value, interpretation FROM lab_results
+        WHERE patient_id = ? AND test_name = 'HbA1c' ORDER BY result_date""")
+    active = conn.execute("SELECT COUNT(*) FROM medications WHERE patient_id = ? AND status = 'Active'",
+                          [patient_id]).fetchone()[0]
+    recent = rows(f"""SELECT test_name, value, unit, interpretation FROM lab_results
+        WHERE patient_id = ? ORDER BY result_date DESC LIMIT {SUMMARY_RECENT_LABS}""")
+
+    latest = {}
+    if bp:
+        latest.update({'BP Systolic': bp[-1]['systolic_bp'], 'BP Diastolic': bp[-1]['diastolic_bp']})
+    if hba1c:
+        latest['HbA1c'] = hba1c[-1]['value']
+    return {
+        'format': SUMMARY_FORMAT,
+        'patient': patient[0],
+        'bp': {
+            'systolic': bp[-1]['systolic_bp'],
+            'diastolic': bp[-1]['diastolic_bp'],
+            'change': bp[-1]['systolic_bp'] - bp[0]['systolic_bp'],
+            'readings': len(bp),
+        } if bp else None,
+        'hba1c': hba1c[-1] if hba1c else None,
+        'active_medications': active,
+        'abnormal': [lab for lab in recent if lab['interpretation'] != 'Normal'],
+        'control': control_status(latest),
+    }
+
+
+def create_complete_database(db_path=COMPLETE_DB, release=None):
+    """Build the fully populated clinical database if its seed definition changed.
+
+    release() closes connections to the old file before it is replaced (see
+    bootstrap.build_once). Returns True if the database was (re)built, False
+    if it was already current.
+    """
+    tables = seed_rows()
+
+    def populate(conn):
+        for ddl in COMPLETE_SCHEMA:
+            conn.execute(ddl)
+        for table, rows in tables.items():
+            columns = SEED_COLUMNS[table]
+            conn.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows)
+        patient_ids = [row[0] for row in conn.execute("SELECT patient_id FROM patients")]
+        conn.executemany("INSERT INTO patient_summary (patient_id, snapshot) VALUES (?, ?)",
+                         [(pid, json.dumps(build_summary_snapshot(conn, pid))) for pid in patient_ids])
+
+    built = build_once(db_path, seed_fingerprint(tables), populate, release)
+    if built:
+        print("✅ Complete database created with ALL medical records!")
+    return built
 
 # ============================================
 # 2. INTELLIGENT QUERY PROCESSOR
 # ============================================
+
+# Keyword vocabulary for process_query, compiled into a single
+# token-boundary matcher (see intent_router.py)
+ASSISTANT_ROUTER = IntentRouter({
+    'intent:bp': ['blood pressure', 'bp', 'pressure', 'hypertension'],
+    'intent:hba1c': ['hba1c', 'a1c', 'diabetes', 'sugar'],
+    'intent:medication': ['medication', 'drug', 'prescription', 'meds'],
+    'intent:lab': ['lab', 'test', 'result'],
+    'intent:summary': ['summary', 'overview', 'report', 'status'],
+    'intent:notes': ['note', 'notes', 'documented', 'mentioned', 'search', 'find'],
+    'trend': ['trend', 'over time'],
+    'history': ['history'],
+}, priority=['notes', 'bp', 'hba1c', 'medication', 'lab', 'summary'])
+
+PASSAGE_ICONS = {'note': '📝', 'lab': '🔬', 'medication': '💊', 'vitals': '🩺', 'appointment': '📅'}
+PASSAGE_CHARS = 300
+
 class CompleteClinicalAssistant:
-    def __init__(self, db_path='complete_clinical.db'):
+    def __init__(self, db_path=COMPLETE_DB, pool=None):
+        # Shared by every session (see assistant_service.py): no per-instance
+        # state besides the pool and the answer cache, connections are
+        # borrowed per query. The database is read-only while the assistant
+        # lives (a rebuild reopens the service with a new assistant), so
+        # cached answers need no data version.
         self.db_path = db_path
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.pool = pool or ConnectionPool(db_path, max_readers=4, journal_mode=None)
+        self.responses = ResponseCache()
+        # Passage index over the notes and records (see retrieval.py),
+        # brought up to date on first use; only rebuilt when the database was
+        self.retrieval = PassageIndex(db_path, pool=self.pool)
+        self._retrieval_checked = False
+
+    def _read_sql(self, query, params=None):
+        with self.pool.reader() as conn:
+            return pd.read_sql_query(query, conn, params=params)
     
     def get_patient_list(self):
         """Get list of all patients"""
@@ -397,13 +573,13 @@ class CompleteClinicalAssistant:
         FROM patients 
         ORDER BY last_name
         '''
-        df = pd.read_sql_query(query, self.conn)
+        df = self._read_sql(query)
         return df.to_dict('records')
     
     def get_patient_info(self, patient_id):
         """Get basic patient information"""
         query = "SELECT * FROM patients WHERE patient_id = ?"
-        df = pd.read_sql_query(query, self.conn, params=[patient_id])
+        df = self._read_sql(query, [patient_id])
         return df.to_dict('records')[0] if not df.empty else None
     
     def get_blood_pressure_data(self, patient_id):
@@ -414,7 +590,7 @@ class CompleteClinicalAssistant:
         WHERE patient_id = ?
         ORDER BY measurement_date
         '''
-        df = pd.read_sql_query(query, self.conn, params=[patient_id])
+        df = self._read_sql(query, [patient_id])
         return df
     
     def get_hba1c_data(self, patient_id):
@@ -425,7 +601,7 @@ class CompleteClinicalAssistant:
         WHERE patient_id = ? AND test_name = 'HbA1c'
         ORDER BY result_date
         '''
-        df = pd.read_sql_query(query, self.conn, params=[patient_id])
+        df = self._read_sql(query, [patient_id])
         return df
     
     def get_medications(self, patient_id):
@@ -436,7 +612,7 @@ class CompleteClinicalAssistant:
         WHERE patient_id = ?
         ORDER BY status DESC, start_date DESC
         '''
-        df = pd.read_sql_query(query, self.conn, params=[patient_id])
+        df = self._read_sql(query, [patient_id])
         return df
     
     def get_recent_labs(self, patient_id, limit=10):
@@ -448,21 +624,45 @@ class CompleteClinicalAssistant:
         ORDER BY result_date DESC
         LIMIT {limit}
         '''
-        df = pd.read_sql_query(query, self.conn, params=[patient_id])
+        df = self._read_sql(query, [patient_id])
         return df
     
+    def get_clinical_notes(self, patient_id):
+        """Get clinical note headers"""
+        query = "SELECT note_date, title, physician FROM clinical_notes WHERE patient_id = ? ORDER BY note_date DESC"
+        return self._read_sql(query, [patient_id])
+    
+    def search_notes(self, query, patient_id=None, offset=0, limit=NOTES_PER_PAGE):
+        """Full-text search of note titles and bodies, best match first.
+
+        Returns (page, next_offset); page has the note header plus a
+        highlighted snippet, next_offset is None on the last page.
+        """
+        match = fts_query(query, patient_id)
+        if match is None:
+            return pd.DataFrame(), None
+        page = self._read_sql(NOTE_SEARCH_SQL, [match, limit + 1, offset])
+        if len(page) > limit:
+            return page.iloc[:limit], offset + limit
+        return page, None
+
+    def search_records(self, query, patient_id=None, k=5):
+        """Top-k passages from notes and records matching `query` (BM25), as a DataFrame"""
+        if not self._retrieval_checked:
+            self.retrieval.refresh()
+            self._retrieval_checked = True
+        hits = self.retrieval.search(query, patient_id, k)
+        return pd.DataFrame(hits, columns=PASSAGE_COLUMNS)
+
     def get_clinical_summary(self, patient_id):
-        """Generate comprehensive clinical summary"""
-        patient = self.get_patient_info(patient_id)
-        if not patient:
+        """Generate comprehensive clinical summary from the patient's snapshot"""
+        with self.pool.reader() as conn:
+            row = conn.execute("SELECT snapshot FROM patient_summary WHERE patient_id = ?", [patient_id]).fetchone()
+        if row is None:
             return "Patient not found."
-        
-        # Gather all data
-        bp_data = self.get_blood_pressure_data(patient_id)
-        hba1c_data = self.get_hba1c_data(patient_id)
-        medications = self.get_medications(patient_id)
-        recent_labs = self.get_recent_labs(patient_id, 5)
-        
+        snapshot = json.loads(row[0])
+        patient = snapshot['patient']
+
         # Build summary
         summary = f"""# 📋 COMPREHENSIVE CLINICAL SUMMARY
 **Patient:** {patient['first_name']} {patient['last_name']}
@@ -474,81 +674,95 @@ class CompleteClinicalAssistant:
 **Next Appointment:** {patient['next_appointment']}
 
 ## 🔍 Key Clinical Data"""
-        
+        control = snapshot['control']
+
         # Blood Pressure
-        if not bp_data.empty:
-            latest_bp = bp_data.iloc[-1]
-            summary += f"\n**Blood Pressure:** {latest_bp['systolic_bp']}/{latest_bp['diastolic_bp']} mmHg"
-            if len(bp_data) > 1:
-                first_bp = bp_data.iloc[0]
-                change = latest_bp['systolic_bp'] - first_bp['systolic_bp']
-                summary += f" ({'Improved' if change < 0 else 'Worsened'} by {abs(change)} mmHg over {len(bp_data)} readings)"
-        
+        bp = snapshot['bp']
+        if bp:
+            summary += f"\n**Blood Pressure:** {bp['systolic']}/{bp['diastolic']} mmHg"
+            if bp['readings'] > 1:
+                change = bp['change']
+                summary += f" ({'Improved' if change < 0 else 'Worsened'} by {abs(change)} mmHg over {bp['readings']} readings)"
+
         # HbA1c
-        if not hba1c_data.empty:
-            latest_hba1c = hba1c_data.iloc[-1]
-            summary += f"\n**HbA1c:** {latest_hba1c['value']}% ({latest_hba1c['interpretation']})"
-            if latest_hba1c['value'] < 7.0:
+        hba1c = snapshot['hba1c']
+        if hba1c:
+            summary += f"\n**HbA1c:** {hba1c['value']}% ({hba1c['interpretation']})"
+            if control['hba1c'] == 'well-controlled':
                 summary += " ✅ Well-controlled"
             else:
                 summary += " ⚠️ Needs improvement"
-        
+
         # Medications
-        active_meds = medications[medications['status'] == 'Active']
-        if not active_meds.empty:
-            summary += f"\n**Active Medications:** {len(active_meds)} prescriptions"
-        
+        if snapshot['active_medications']:
+            summary += f"\n**Active Medications:** {snapshot['active_medications']} prescriptions"
+
         # Recent Labs
-        abnormal_labs = recent_labs[recent_labs['interpretation'] != 'Normal']
-        if not abnormal_labs.empty:
+        abnormal_labs = snapshot['abnormal']
+        if abnormal_labs:
             summary += f"\n**Alerts:** {len(abnormal_labs)} abnormal lab results"
-            for _, lab in abnormal_labs.iterrows():
-                summary += f"\n  - {lab['test_name']}: {lab['value']} {lab['unit']} ({lab['interpretation']})"
-        
+            summary += "\n" + "\n".join("  - {test_name}: {value} {unit} ({interpretation})".format(**lab)
+                                        for lab in abnormal_labs)
+
         # Clinical Assessment
         summary += "\n\n## 🩺 Clinical Assessment"
-        
+
         assessments = []
-        
+
         # Diabetes assessment
-        if not hba1c_data.empty:
-            latest = hba1c_data.iloc[-1]
-            if latest['value'] < 7.0:
-                assessments.append("Diabetes well-controlled per ADA guidelines")
-            else:
-                assessments.append("Diabetes control needs optimization")
-        
+        if control['hba1c'] == 'well-controlled':
+            assessments.append("Diabetes well-controlled per ADA guidelines")
+        elif control['hba1c']:
+            assessments.append("Diabetes control needs optimization")
+
         # Hypertension assessment
-        if not bp_data.empty:
-            latest = bp_data.iloc[-1]
-            if latest['systolic_bp'] < 130 and latest['diastolic_bp'] < 80:
-                assessments.append("Blood pressure at goal")
-            else:
-                assessments.append("Blood pressure above target")
-        
+        if control['bp'] == 'at goal':
+            assessments.append("Blood pressure at goal")
+        elif control['bp']:
+            assessments.append("Blood pressure above target")
+
         # Medication assessment
-        if len(active_meds) > 5:
+        if snapshot['active_medications'] > 5:
             assessments.append("Polypharmacy - consider medication review")
-        
+
         if assessments:
             for assess in assessments:
                 summary += f"\n- {assess}"
         else:
             summary += "\n- Overall stable condition"
-        
+
         # Recommendations
         summary += "\n\n## 📋 Recommendations"
         summary += "\n1. Continue current management plan"
         summary += "\n2. Monitor key parameters regularly"
         summary += "\n3. Follow up as scheduled"
         summary += "\n4. Address any abnormal lab results"
-        
+
         return summary
     
-    def process_query(self, patient_id, query):
-        """Process natural language query"""
-        query_lower = query.lower()
-        
+    def process_query(self, patient_id, query, build_chart=True):
+        """Process natural language query (build_chart=False skips the figure).
+
+        Answers are cached by patient and parsed intent, so the example and
+        quick-action questions and their rephrasings are computed once.
+        """
+        with tracing.span('process_query', patient_id=patient_id) as trace:
+            with tracing.span('parse'):
+                parsed = ASSISTANT_ROUTER.parse(query)
+            trace.set(intent=parsed.intent)
+            key = (patient_id, parsed.intent, parsed.tags, build_chart)
+            if parsed.intent in (None, 'notes'):
+                # Answered by passage search, which depends on the words themselves
+                key += (tuple(sorted(set(query_terms(parsed.text)))),)
+
+            def answer():
+                # No 'answer' child in the trace means a cache hit
+                with tracing.span('answer'):
+                    return self._answer(patient_id, parsed, build_chart)
+
+            return self.responses.get_or_compute(key, answer)
+
+    def _answer(self, patient_id, parsed, build_chart):
         response = {
             'answer': '',
             'data': None,
@@ -564,7 +778,7 @@ class CompleteClinicalAssistant:
         patient_name = f"{patient['first_name']} {patient['last_name']}"
         
         # Blood pressure queries
-        if any(word in query_lower for word in ['blood pressure', 'bp', 'pressure', 'hypertension']):
+        if parsed.intent == 'bp':
             bp_data = self.get_blood_pressure_data(patient_id)
             
             if bp_data.empty:
@@ -573,38 +787,43 @@ class CompleteClinicalAssistant:
             
             latest = bp_data.iloc[-1]
             
-            if 'trend' in query_lower or 'over time' in query_lower or 'history' in query_lower:
+            if parsed.has('trend', 'history'):
                 # Show trend
                 response['answer'] = f"""**Blood Pressure Trend for {patient_name}:**
                 
 Latest: {latest['systolic_bp']}/{latest['diastolic_bp']} mmHg
 {len(bp_data)} readings over {len(bp_data['measurement_date'].unique())} months"""
                 
-                # Create visualization
-                fig = go.Figure()
-                fig.add_trace(go.Scatter(
-                    x=bp_data['measurement_date'], y=bp_data['systolic_bp'],
-                    mode='lines+markers',
-                    name='Systolic',
-                    line=dict(color='red', width=2)
-                ))
-                fig.add_trace(go.Scatter(
-                    x=bp_data['measurement_date'], y=bp_data['diastolic_bp'],
-                    mode='lines+markers',
-                    name='Diastolic',
-                    line=dict(color='blue', width=2)
-                ))
-                fig.add_hrect(y0=0, y1=120, line_width=0, fillcolor="green", opacity=0.1)
-                fig.add_hrect(y0=120, y1=130, line_width=0, fillcolor="yellow", opacity=0.1)
-                fig.add_hrect(y0=130, y1=180, line_width=0, fillcolor="red", opacity=0.1)
+                # Create visualization (thinned to a point budget, cached per data version)
+                def build_bp_figure():
+                    points = downsample(bp_data, 'measurement_date', ['systolic_bp', 'diastolic_bp'])
+                    fig = go.Figure()
+                    fig.add_trace(go.Scatter(
+                        x=points['measurement_date'], y=points['systolic_bp'],
+                        mode='lines+markers',
+                        name='Systolic',
+                        line=dict(color='red', width=2)
+                    ))
+                    fig.add_trace(go.Scatter(
+                        x=points['measurement_date'], y=points['diastolic_bp'],
+                        mode='lines+markers',
+                        name='Diastolic',
+                        line=dict(color='blue', width=2)
+                    ))
+                    fig.add_hrect(y0=0, y1=120, line_width=0, fillcolor="green", opacity=0.1)
+                    fig.add_hrect(y0=120, y1=130, line_width=0, fillcolor="yellow", opacity=0.1)
+                    fig.add_hrect(y0=130, y1=180, line_width=0, fillcolor="red", opacity=0.1)
                 
-                fig.update_layout(
-                    title='Blood Pressure Trend',
-                    xaxis_title='Date',
-                    yaxis_title='BP (mmHg)',
-                    hovermode='x unified'
-                )
-                response['visualization'] = fig
+                    fig.update_layout(
+                        title='Blood Pressure Trend',
+                        xaxis_title='Date',
+                        yaxis_title='BP (mmHg)',
+                        hovermode='x unified'
+                    )
+                    return fig
+                if build_chart:
+                    version = (len(bp_data), latest['measurement_date'], float(bp_data['systolic_bp'].sum()))
+                    response['visualization'] = cached_figure(patient_id, 'bp', None, version, build_bp_figure)
                 response['data'] = bp_data
                 
             else:
@@ -628,7 +847,7 @@ Latest: {latest['systolic_bp']}/{latest['diastolic_bp']} mmHg
                 response['data'] = bp_data.tail(5)
         
         # HbA1c queries
-        elif any(word in query_lower for word in ['hba1c', 'a1c', 'diabetes', 'sugar']):
+        elif parsed.intent == 'hba1c':
             hba1c_data = self.get_hba1c_data(patient_id)
             
             if hba1c_data.empty:
@@ -637,34 +856,39 @@ Latest: {latest['systolic_bp']}/{latest['diastolic_bp']} mmHg
             
             latest = hba1c_data.iloc[-1]
             
-            if 'trend' in query_lower or 'over time' in query_lower:
+            if parsed.has('trend'):
                 # Show trend
                 response['answer'] = f"""**HbA1c Trend for {patient_name}:**
                 
 Latest: {latest['value']}% ({latest['result_date']})
 {len(hba1c_data)} readings over {len(hba1c_data['result_date'].unique())} months"""
                 
-                # Create visualization
-                fig = go.Figure()
-                fig.add_trace(go.Scatter(
-                    x=hba1c_data['result_date'], y=hba1c_data['value'],
-                    mode='lines+markers',
-                    name='HbA1c',
-                    line=dict(color='red', width=3)
-                ))
-                fig.add_hline(y=5.7, line_dash="dash", line_color="green", 
-                             annotation_text="Normal", annotation_position="bottom right")
-                fig.add_hline(y=6.5, line_dash="dash", line_color="orange",
-                             annotation_text="Diabetes Threshold")
-                fig.add_hline(y=7.0, line_dash="dash", line_color="red",
-                             annotation_text="Control Target")
+                # Create visualization (thinned to a point budget, cached per data version)
+                def build_hba1c_figure():
+                    points = downsample(hba1c_data, 'result_date', 'value')
+                    fig = go.Figure()
+                    fig.add_trace(go.Scatter(
+                        x=points['result_date'], y=points['value'],
+                        mode='lines+markers',
+                        name='HbA1c',
+                        line=dict(color='red', width=3)
+                    ))
+                    fig.add_hline(y=5.7, line_dash="dash", line_color="green", 
+                                 annotation_text="Normal", annotation_position="bottom right")
+                    fig.add_hline(y=6.5, line_dash="dash", line_color="orange",
+                                 annotation_text="Diabetes Threshold")
+                    fig.add_hline(y=7.0, line_dash="dash", line_color="red",
+                                 annotation_text="Control Target")
                 
-                fig.update_layout(
-                    title='HbA1c Trend Over Time',
-                    xaxis_title='Date',
-                    yaxis_title='HbA1c (%)'
-                )
-                response['visualization'] = fig
+                    fig.update_layout(
+                        title='HbA1c Trend Over Time',
+                        xaxis_title='Date',
+                        yaxis_title='HbA1c (%)'
+                    )
+                    return fig
+                if build_chart:
+                    version = (len(hba1c_data), latest['result_date'], float(hba1c_data['value'].sum()))
+                    response['visualization'] = cached_figure(patient_id, 'hba1c', None, version, build_hba1c_figure)
                 response['data'] = hba1c_data
                 
             else:
@@ -688,7 +912,7 @@ Latest: {latest['value']}% ({latest['result_date']})
                 response['data'] = hba1c_data.tail(3)
         
         # Medication queries
-        elif any(word in query_lower for word in ['medication', 'medications', 'drug', 'prescription', 'meds']):
+        elif parsed.intent == 'medication':
             medications = self.get_medications(patient_id)
             
             if medications.empty:
@@ -701,8 +925,9 @@ Latest: {latest['value']}% ({latest['result_date']})
             
 **Active Medications ({len(active_meds)}):**"""
             
-            for idx, med in active_meds.iterrows():
-                response['answer'] += f"\n{idx+1}. **{med['medication_name']}** - {med['dosage']} {med['frequency']} (since {med['start_date']})"
+            if not active_meds.empty:
+                numbered = active_meds.assign(n=active_meds.index + 1)
+                response['answer'] += "\n" + render_rows(numbered, "{n}. **{medication_name}** - {dosage} {frequency} (since {start_date})")
             
             if len(active_meds) > 5:
                 response['answer'] += "\n\n⚠️ **Note:** Patient is on multiple medications. Consider medication review."
@@ -710,7 +935,7 @@ Latest: {latest['value']}% ({latest['result_date']})
             response['data'] = medications
         
         # Lab results queries
-        elif any(word in query_lower for word in ['lab', 'test', 'result', 'labs']):
+        elif parsed.intent == 'lab':
             recent_labs = self.get_recent_labs(patient_id, 10)
             
             if recent_labs.empty:
@@ -724,9 +949,8 @@ Latest: {latest['value']}% ({latest['result_date']})
             
 **Most Recent Tests ({latest_date}):**"""
             
-            for _, lab in today_labs.iterrows():
-                icon = "✅" if lab['interpretation'] == 'Normal' else "⚠️"
-                response['answer'] += f"\n{icon} **{lab['test_name']}:** {lab['value']} {lab['unit']} ({lab['interpretation']})"
+            today_labs = today_labs.assign(icon=np.where(today_labs['interpretation'] == 'Normal', "✅", "⚠️"))
+            response['answer'] += "\n" + render_rows(today_labs, "{icon} **{test_name}:** {value} {unit} ({interpretation})")
             
             # Abnormal labs
             abnormal_labs = recent_labs[recent_labs['interpretation'] != 'Normal']
@@ -736,13 +960,27 @@ Latest: {latest['value']}% ({latest['result_date']})
             response['data'] = recent_labs
         
         # Summary queries
-        elif any(word in query_lower for word in ['summary', 'overview', 'report', 'status']):
+        elif parsed.intent == 'summary':
             summary = self.get_clinical_summary(patient_id)
             response['answer'] = summary
             response['type'] = 'summary'
         
-        # General queries
+        # Notes and free-text questions: passage search over notes and
+        # records, falling back to the help text
         else:
+            passages = self.search_records(parsed.text, patient_id)
+            if not passages.empty:
+                response['answer'] = f"**From {patient_name}'s notes and records:**\n"
+                for n, hit in enumerate(passages.itertuples(), 1):
+                    text = hit.text
+                    if len(text) > PASSAGE_CHARS:
+                        text = text[:PASSAGE_CHARS].rsplit(' ', 1)[0] + ' …'
+                    response['answer'] += f"\n{n}. {PASSAGE_ICONS.get(hit.source, '')} {text}"
+                response['data'] = passages
+                return response
+            if parsed.intent == 'notes':
+                response['answer'] = f"No notes or records for {patient_name} match that question."
+                return response
             response['answer'] = f"""I can help you with {patient_name}'s clinical data. Try asking about:
 
 • Blood pressure readings or trends
@@ -763,6 +1001,49 @@ Examples:
 # ============================================
 # 3. STREAMLIT INTERFACE
 # ============================================
+def render_message(message, assistant):
+    """Render one chat history message (see chat_history.py)"""
+    if message["role"] == "user":
+        st.markdown(f"""
+        <div class="chat-user">
+        <strong>👨‍⚕️ Physician:</strong> {message["content"]}
+        </div>
+        """, unsafe_allow_html=True)
+
+    elif message["role"] == "assistant":
+        st.markdown(f"""
+        <div class="chat-assistant">
+        <strong>🤖 Assistant:</strong>
+        """, unsafe_allow_html=True)
+
+        # Display the response content
+        lines = message["content"].split('\n')
+        for line in lines:
+            if line.strip():
+                if line.startswith('# '):
+                    st.markdown(f"**{line[2:]}**")
+                elif line.startswith('## '):
+                    st.markdown(f"### {line[3:]}")
+                elif line.startswith('**'):
+                    st.markdown(line)
+                else:
+                    st.write(line)
+
+        st.markdown("</div>", unsafe_allow_html=True)
+
+        # Data and charts are not kept in the history; recompute them from
+        # the message's spec only when asked for
+        spec = message["spec"]
+        if spec and st.toggle("📊 View Detailed Data", key=f"detail_{message['id']}"):
+            response = assistant.process_query(spec["patient_id"], spec["query"])
+            if isinstance(response["data"], pd.DataFrame):
+                st.dataframe(response["data"], use_container_width=True)
+            if response["visualization"] is not None:
+                st.plotly_chart(response["visualization"], use_container_width=True)
+
+    elif message["role"] == "system":
+        st.info(f"🔔 {message['content']}")
+
 def main():
     # Page configuration
     st.set_page_config(
@@ -813,19 +1094,22 @@ def main():
     </style>
     """, unsafe_allow_html=True)
     
-    # Initialize database
+    # Initialize database: built once per seed definition, later sessions
+    # (and processes) just find the fingerprint current
     if 'db_created' not in st.session_state:
-        with st.spinner("🔄 Creating comprehensive clinical database..."):
+        with st.spinner("🔄 Preparing comprehensive clinical database..."):
             create_complete_database()
         st.session_state.db_created = True
     
-    # Initialize assistant
-    if 'assistant' not in st.session_state:
-        st.session_state.assistant = CompleteClinicalAssistant()
+    # One assistant (and connection pool) per process, shared by all
+    # sessions; fetched on every rerun in case it was reopened
+    service = get_assistant_service(COMPLETE_DB, CompleteClinicalAssistant)
+    ctx = get_script_run_ctx()
+    st.session_state.assistant = service.touch(ctx.session_id if ctx else 'local')
     
     # Initialize chat history
     if 'chat_history' not in st.session_state:
-        st.session_state.chat_history = []
+        st.session_state.chat_history = ChatHistory()
     
     # Initialize selected patient
     if 'selected_patient' not in st.session_state:
@@ -853,10 +1137,7 @@ def main():
                 ):
                     st.session_state.selected_patient = patient['patient_id']
                     # Add system message
-                    st.session_state.chat_history.append({
-                        "role": "system",
-                        "content": f"Selected patient: {patient['name']}"
-                    })
+                    st.session_state.chat_history.append("system", f"Selected patient: {patient['name']}")
                     st.rerun()
             with col2:
                 st.caption(f"{patient['age']}{patient['gender'][0]}")
@@ -878,29 +1159,40 @@ def main():
             if st.button(f"{emoji} {query.split()[0]}", 
                         key=f"quick_{query}",
                         use_container_width=True):
-                st.session_state.chat_history.append({
-                    "role": "user",
-                    "content": query
-                })
+                st.session_state.chat_history.append("user", query)
                 st.rerun()
         
         st.markdown("---")
         
         # System controls
         if st.button("🗑️ Clear Chat", use_container_width=True):
-            st.session_state.chat_history = []
+            st.session_state.chat_history.clear()
             st.rerun()
         
         if st.button("🔄 Refresh Data", use_container_width=True):
-            create_complete_database()
-            st.success("Database refreshed!")
-            st.rerun()
+            try:
+                # Pooled connections are closed before the file is replaced
+                # (Windows refuses otherwise) and reopened on the new one
+                if create_complete_database(release=service.pool.close):
+                    service.reopen()
+            except PermissionError:
+                # Still open in another process; the old database stays
+                service.reopen()
+                st.error("The database is in use elsewhere; try refreshing again shortly.")
+            else:
+                st.success("Database refreshed!")
+                st.rerun()
         
         # Stats
         st.markdown("---")
         st.subheader("📊 Statistics")
         st.metric("Total Patients", len(patients))
         st.metric("Chat Messages", len(st.session_state.chat_history))
+        service_stats = service.stats()
+        answer_stats = st.session_state.assistant.responses.stats()
+        st.caption(f"Active sessions: {service_stats['active_sessions']} · "
+                   f"DB connections: {service_stats['open_connections']}/{service_stats['max_connections']} · "
+                   f"Answer cache hits: {answer_stats['hit_rate']:.0%}")
     
     # ============================================
     # MAIN INTERFACE
@@ -974,47 +1266,12 @@ def main():
     chat_container = st.container()
     
     with chat_container:
-        for message in st.session_state.chat_history:
-            if message["role"] == "user":
-                st.markdown(f"""
-                <div class="chat-user">
-                <strong>👨‍⚕️ Physician:</strong> {message["content"]}
-                </div>
-                """, unsafe_allow_html=True)
-            
-            elif message["role"] == "assistant":
-                st.markdown(f"""
-                <div class="chat-assistant">
-                <strong>🤖 Assistant:</strong>
-                """, unsafe_allow_html=True)
-                
-                # Display the response content
-                lines = message["content"].split('\n')
-                for line in lines:
-                    if line.strip():
-                        if line.startswith('# '):
-                            st.markdown(f"**{line[2:]}**")
-                        elif line.startswith('## '):
-                            st.markdown(f"### {line[3:]}")
-                        elif line.startswith('**'):
-                            st.markdown(line)
-                        else:
-                            st.write(line)
-                
-                st.markdown("</div>", unsafe_allow_html=True)
-                
-                # Show data if available
-                if "data" in message and message["data"] is not None:
-                    with st.expander("📊 View Detailed Data"):
-                        if isinstance(message["data"], pd.DataFrame):
-                            st.dataframe(message["data"], use_container_width=True)
-                
-                # Show visualization if available
-                if "visualization" in message and message["visualization"] is not None:
-                    st.plotly_chart(message["visualization"], use_container_width=True)
-            
-            elif message["role"] == "system":
-                st.info(f"🔔 {message['content']}")
+        history = st.session_state.chat_history
+        if history.spilled and st.toggle(f"Show {history.spilled} earlier messages", key="show_older"):
+            for message in history.older():
+                render_message(message, st.session_state.assistant)
+        for message in history.recent():
+            render_message(message, st.session_state.assistant)
     
     # ============================================
     # QUERY INPUT
@@ -1039,25 +1296,22 @@ def main():
     # Process query
     if submit and user_query:
         # Add user message
-        st.session_state.chat_history.append({
-            "role": "user",
-            "content": user_query
-        })
+        st.session_state.chat_history.append("user", user_query)
         
         # Get response
         with st.spinner("🔍 Analyzing clinical data..."):
+            # The chart is only built when the message's details are opened
             response = st.session_state.assistant.process_query(
                 st.session_state.selected_patient,
-                user_query
+                user_query,
+                build_chart=False
             )
         
-        # Add assistant response
-        st.session_state.chat_history.append({
-            "role": "assistant",
-            "content": response['answer'],
-            "data": response.get('data'),
-            "visualization": response.get('visualization')
-        })
+        # Add assistant response: text plus what it takes to recompute the
+        # data and chart, not the objects themselves
+        has_detail = response.get('data') is not None
+        spec = {"patient_id": st.session_state.selected_patient, "query": user_query} if has_detail else None
+        st.session_state.chat_history.append("assistant", response['answer'], spec)
         
         st.rerun()
     
@@ -1084,10 +1338,7 @@ def main():
     for idx, example in enumerate(examples):
         with cols[idx % 5]:
             if st.button(example, key=f"ex_{idx}", use_container_width=True):
-                st.session_state.chat_history.append({
-                    "role": "user",
-                    "content": example
-                })
+                st.session_state.chat_history.append("user", example)
                 st.rerun()
     
     # ============================================
@@ -1118,19 +1369,38 @@ def main():
                 st.info("No medications available")
         
         with tab4:
-            # Get clinical notes
-            conn = sqlite3.connect('complete_clinical.db', check_same_thread=False)
-            notes_df = pd.read_sql_query(
-                "SELECT note_date, title, physician FROM clinical_notes WHERE patient_id = ? ORDER BY note_date DESC",
-                conn,
-                params=[st.session_state.selected_patient]
-            )
-            conn.close()
-            
-            if not notes_df.empty:
-                st.dataframe(notes_df, use_container_width=True)
+            note_query = st.text_input("Search notes", key="note_query",
+                                       placeholder="e.g. neuropathy, chest pain, referral")
+            if note_query:
+                all_patients = st.checkbox("All patients", key="note_all_patients")
+                # Back to the first page whenever the search changes
+                search = (note_query, all_patients, st.session_state.selected_patient)
+                if st.session_state.get('note_search') != search:
+                    st.session_state.note_search = search
+                    st.session_state.note_offset = 0
+                offset = st.session_state.note_offset
+                hits, next_offset = st.session_state.assistant.search_notes(
+                    note_query, None if all_patients else st.session_state.selected_patient, offset, NOTES_PER_PAGE)
+                if hits.empty:
+                    st.info("No notes match your search")
+                for hit in hits.itertuples():
+                    st.markdown(f"**{hit.note_date}** · {hit.title} · {hit.physician}"
+                                + (f" · {hit.patient_id}" if all_patients else "")
+                                + f"\n\n{' '.join(hit.snippet.split())}")
+                prev_col, next_col = st.columns(2)
+                if offset and prev_col.button("◀ Previous", key="note_prev"):
+                    st.session_state.note_offset = max(offset - NOTES_PER_PAGE, 0)
+                    st.rerun()
+                if next_offset is not None and next_col.button("Next ▶", key="note_next"):
+                    st.session_state.note_offset = next_offset
+                    st.rerun()
             else:
-                st.info("No clinical notes available")
+                notes_df = st.session_state.assistant.get_clinical_notes(st.session_state.selected_patient)
+
+                if not notes_df.empty:
+                    st.dataframe(notes_df, use_container_width=True)
+                else:
+                    st.info("No clinical notes available")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
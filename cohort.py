@@ -0,0 +1,416 @@
+import re
+
+import pandas as pd
+
+from intent_router import clinical_router, resolve_tests, unaliased_words
+
+# Cohort queries over patients and lab_results.
+#
+# A cohort is an AND of conditions; a stat aggregates one test's readings
+# over a cohort, grouped by diagnosis/gender/year/month. Both are built from
+# small declarative objects - or parsed from text - and compiled into one
+# set-based SQL statement:
+#
+#     diagnosis = Hypertension AND latest BP Systolic > 140
+#     at least 3 High LDL in 2024
+#     median HbA1c by diagnosis by year where gender = F
+#     count of patients with at least 3 High LDL in 2024
+#
+# Each lab condition becomes a `patient_id IN (subquery)` that SQLite
+# materializes once; patients are then probed through their primary key.
+# The planner picks each subquery's source:
+#
+# - latest <test> (no window): lab_trend_summary, which already holds every
+#   patient's latest reading, via idx_lab_trend_test_latest
+# - latest <test> in a window: ROW_NUMBER() over that test's readings in
+#   the window, read from idx_lab_results_test_date
+# - count of readings: GROUP BY ... HAVING over the same index range
+#
+# and orders the subqueries so the most selective (narrowest index range)
+# is materialized first. Rows are streamed by the caller in chunks.
+
+PATIENT_COLUMNS = ['patient_id', 'first_name', 'last_name', 'age', 'gender', 'primary_diagnosis']
+
+# DSL field -> patients column
+DEMOGRAPHIC_FIELDS = {
+    'diagnosis': 'primary_diagnosis',
+    'gender': 'gender',
+    'age': 'age',
+    'allergies': 'allergies',
+}
+# Stat grouping keys -> SQL over patients p / lab_results l
+GROUP_FIELDS = {
+    'diagnosis': 'p.primary_diagnosis',
+    'gender': 'p.gender',
+    'year': 'substr(l.result_date, 1, 4)',
+    'month': 'substr(l.result_date, 1, 7)',
+}
+STATS = {
+    'median': None,     # window functions, see LabStat.compile
+    'mean': 'AVG(l.value)',
+    'avg': 'AVG(l.value)',
+    'min': 'MIN(l.value)',
+    'max': 'MAX(l.value)',
+    'count': 'COUNT(*)',
+    'patients': 'COUNT(DISTINCT l.patient_id)',
+}
+# Stat grouping keys / stats -> pandas, for LabStat.aggregate over exported readings
+FRAME_GROUPS = {
+    'diagnosis': lambda df: df['primary_diagnosis'],
+    'gender': lambda df: df['gender'],
+    'year': lambda df: df['result_date'].str[:4],
+    'month': lambda df: df['result_date'].str[:7],
+}
+FRAME_STATS = {'median': 'median', 'mean': 'mean', 'avg': 'mean', 'min': 'min', 'max': 'max',
+               'count': 'size', 'patients': 'nunique'}
+OPERATORS = {'=': '=', '==': '=', '!=': '!=', '<>': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>=',
+             '≥': '>=', '≤': '<=', 'like': 'LIKE', 'contains': 'LIKE'}
+INTERPRETATIONS = {'high': 'High', 'low': 'Low', 'normal': 'Normal'}
+
+
+class CohortError(ValueError):
+    pass
+
+
+def _operator(op):
+    sql_op = OPERATORS.get(op.lower())
+    if sql_op is None:
+        raise CohortError(f"Unknown operator {op!r}")
+    return sql_op
+
+
+def _window_sql(window, column='result_date'):
+    """(sql, params) restricting `column` to window = (start inclusive, end exclusive)"""
+    sql, params = '', []
+    if window is not None:
+        start, end = window
+        if start is not None:
+            sql += f" AND {column} >= ?"
+            params.append(start)
+        if end is not None:
+            sql += f" AND {column} < ?"
+            params.append(end)
+    return sql, params
+
+
+def _window_label(window):
+    if window is None:
+        return ''
+    start, end = window
+    return f" in [{start or '...'}, {end or '...'})"
+
+
+# --- Conditions ---
+
+class Demographic:
+    """patients.<field> <op> value"""
+
+    def __init__(self, field, op, value):
+        if field not in DEMOGRAPHIC_FIELDS:
+            raise CohortError(f"Unknown field {field!r}; expected one of {sorted(DEMOGRAPHIC_FIELDS)}")
+        self.field, self.op, self.value = field, _operator(op), value
+        if field == 'age' and self.op != 'LIKE':
+            try:
+                self.value = float(value)
+            except (TypeError, ValueError):
+                raise CohortError(f"age needs a number, got {value!r}") from None
+
+    def where(self):
+        column = f"p.{DEMOGRAPHIC_FIELDS[self.field]}"
+        if self.op == 'LIKE':
+            return f"{column} LIKE ?", [f"%{self.value}%"]
+        if self.field == 'age':
+            return f"{column} {self.op} ?", [self.value]
+        # Text fields compare case-insensitively ("hypertension" finds "Hypertension")
+        return f"{column} {self.op} ? COLLATE NOCASE", [self.value]
+
+    def __repr__(self):
+        return f"{self.field} {self.op} {self.value!r}"
+
+
+class LatestLab:
+    """The patient's latest <test> reading (in `window`, if given) <op> value"""
+
+    def __init__(self, test, op, value, window=None):
+        self.test, self.op, self.value, self.window = test, _operator(op), float(value), window
+        if self.op == 'LIKE':
+            raise CohortError("latest needs a numeric comparison")
+
+    def subquery(self):
+        """(sql, params, access path description)"""
+        if self.window is None:
+            sql = f"SELECT patient_id FROM lab_trend_summary WHERE test_name = ? AND latest_value {self.op} ?"
+            return sql, [self.test, self.value], "lab_trend_summary (idx_lab_trend_test_latest)"
+        window_sql, window_params = _window_sql(self.window)
+        # The index carries rowid, so the id tie-break is free
+        sql = f"""SELECT patient_id FROM (
+                SELECT patient_id, value,
+                       ROW_NUMBER() OVER (PARTITION BY patient_id ORDER BY result_date DESC, id DESC) AS rn
+                FROM lab_results
+                WHERE test_name = ? AND value IS NOT NULL{window_sql})
+            WHERE rn = 1 AND value {self.op} ?"""
+        return sql, [self.test, *window_params, self.value], "ROW_NUMBER() over lab_results (idx_lab_results_test_date)"
+
+    def __repr__(self):
+        return f"latest {self.test}{_window_label(self.window)} {self.op} {self.value:g}"
+
+
+class LabCount:
+    """At least `min_count` <test> readings (optionally of one interpretation) in `window`"""
+
+    def __init__(self, test, min_count, interpretation=None, window=None):
+        if int(min_count) < 1:
+            raise CohortError("count conditions need a minimum of at least 1")
+        self.test, self.min_count, self.window = test, int(min_count), window
+        self.interpretation = INTERPRETATIONS[interpretation.lower()] if interpretation else None
+
+    def subquery(self):
+        window_sql, window_params = _window_sql(self.window)
+        sql = "SELECT patient_id FROM lab_results WHERE test_name = ?"
+        params = [self.test]
+        if self.interpretation:
+            sql += " AND interpretation = ?"
+            params.append(self.interpretation)
+        sql += window_sql + " GROUP BY patient_id HAVING COUNT(*) >= ?"
+        return sql, params + window_params + [self.min_count], "GROUP BY over lab_results (idx_lab_results_test_date)"
+
+    def __repr__(self):
+        kind = f"{self.interpretation} " if self.interpretation else ''
+        return f"at least {self.min_count} {kind}{self.test}{_window_label(self.window)}"
+
+
+def _selectivity(condition):
+    """Rough rank for ordering lab subqueries: smaller reads first"""
+    if isinstance(condition, LatestLab) and condition.window is None:
+        return 0            # one index range over the summary table
+    window = condition.window
+    bounded = window is not None and window[0] is not None and window[1] is not None
+    return 1 if bounded else 2
+
+
+class Cohort:
+    def __init__(self, *conditions):
+        self.conditions = list(conditions)
+
+    def plan(self):
+        """(demographic conditions, lab conditions in execution order)"""
+        demographics = [c for c in self.conditions if isinstance(c, Demographic)]
+        labs = sorted((c for c in self.conditions if not isinstance(c, Demographic)), key=_selectivity)
+        return demographics, labs
+
+    def compile(self, columns=PATIENT_COLUMNS):
+        """(sql, params) selecting `columns` of the matching patients, by patient_id"""
+        demographics, labs = self.plan()
+        where, params = [], []
+        for condition in labs:
+            sql, sub_params, _ = condition.subquery()
+            where.append(f"p.patient_id IN ({sql})")
+            params += sub_params
+        for condition in demographics:
+            sql, sub_params = condition.where()
+            where.append(sql)
+            params += sub_params
+        sql = f"SELECT {', '.join('p.' + c for c in columns)} FROM patients p"
+        if where:
+            sql += " WHERE " + "\n  AND ".join(where)
+        return sql + " ORDER BY p.patient_id", params
+
+    def describe(self):
+        """Human-readable plan, one line per step"""
+        demographics, labs = self.plan()
+        steps = [f"{i}. {c!r}: {c.subquery()[2]}" for i, c in enumerate(labs, 1)]
+        if demographics:
+            steps.append(f"{len(steps) + 1}. filter patients: " + ' AND '.join(map(repr, demographics)))
+        return steps
+
+    def __repr__(self):
+        return ' AND '.join(map(repr, self.conditions)) or 'all patients'
+
+
+class LabStat:
+    """<stat> of one test's readings over a cohort, grouped by `by`"""
+
+    def __init__(self, stat, test, by=(), cohort=None, window=None):
+        if stat not in STATS:
+            raise CohortError(f"Unknown statistic {stat!r}; expected one of {sorted(STATS)}")
+        unknown = [b for b in by if b not in GROUP_FIELDS]
+        if unknown:
+            raise CohortError(f"Cannot group by {unknown}; expected any of {sorted(GROUP_FIELDS)}")
+        self.stat, self.test, self.by, self.window = stat, test, list(by), window
+        self.cohort = cohort or Cohort()
+
+    def compile(self):
+        groups = [f"{GROUP_FIELDS[b]} AS {b}" for b in self.by]
+        window_sql, params = _window_sql(self.window, 'l.result_date')
+        # CROSS JOIN keeps lab_results as the outer loop: one covering-index
+        # range for the test, then a primary-key probe per reading
+        source = f"""FROM lab_results l CROSS JOIN patients p ON p.patient_id = l.patient_id
+            WHERE l.test_name = ? AND l.value IS NOT NULL{window_sql}"""
+        params = [self.test] + params
+        if self.cohort.conditions:
+            cohort_sql, cohort_params = self.cohort.compile(columns=['patient_id'])
+            source += f" AND l.patient_id IN ({cohort_sql})"
+            params += cohort_params
+        keys = ', '.join(self.by)
+
+        if self.stat == 'median':
+            # Middle row(s) of each group by ROW_NUMBER / COUNT windows;
+            # SQLite has no MEDIAN aggregate
+            partition = f"PARTITION BY {', '.join(GROUP_FIELDS[b] for b in self.by)} " if keys else ''
+            sql = f"""SELECT {keys + ', ' if keys else ''}AVG(value) AS median, COALESCE(MAX(cnt), 0) AS n FROM (
+                SELECT {', '.join(groups) + ', ' if groups else ''}l.value AS value,
+                       ROW_NUMBER() OVER w AS rn,
+                       COUNT(*) OVER (w ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) AS cnt
+                {source}
+                WINDOW w AS ({partition}ORDER BY l.value))
+            WHERE rn IN ((cnt + 1) / 2, (cnt + 2) / 2)"""
+        else:
+            sql = f"SELECT {', '.join(groups) + ', ' if groups else ''}{STATS[self.stat]} AS {self.stat}"
+            if self.stat != 'count':
+                sql += ", COUNT(*) AS n"
+            sql += f" {source}"
+        if keys:
+            sql += f" GROUP BY {keys} ORDER BY {keys}"
+        return sql, params
+
+    def aggregate(self, readings):
+        """Same result as compile() computed in pandas from this test's readings.
+
+        `readings` holds the readings already restricted to the test, window
+        and cohort: patient_id, result_date and value, plus primary_diagnosis
+        and gender when grouping by them.
+        """
+        column = 'patient_id' if self.stat == 'patients' else 'value'
+        if not self.by:
+            values = readings[column]
+            row = {self.stat: values.nunique() if self.stat == 'patients' else values.agg(FRAME_STATS[self.stat])}
+            if self.stat != 'count':
+                row['n'] = len(readings)
+            return pd.DataFrame([row])
+        keys = {b: FRAME_GROUPS[b](readings) for b in self.by}
+        grouped = readings.groupby(list(keys.values()), sort=True)[column]
+        result = grouped.agg(FRAME_STATS[self.stat]).rename(self.stat).to_frame()
+        if self.stat != 'count':
+            result['n'] = grouped.size()
+        result.index.names = self.by
+        return result.reset_index()
+
+    def typed(self, result):
+        """A compile() or aggregate() result with the same dtypes either way:
+        string group keys, float statistics (NaN over no readings), int counts"""
+        dtypes = {b: 'str' for b in self.by}
+        dtypes[self.stat] = 'int64' if self.stat in ('count', 'patients') else 'float64'
+        if self.stat != 'count':
+            dtypes['n'] = 'int64'
+        return result.astype(dtypes)
+
+    def __repr__(self):
+        by = ''.join(f" by {b}" for b in self.by)
+        where = f" where {self.cohort!r}" if self.cohort.conditions else ''
+        return f"{self.stat} {self.test}{_window_label(self.window)}{by}{where}"
+
+
+class CohortCount:
+    """Number of patients in a cohort"""
+
+    def __init__(self, cohort):
+        self.cohort = cohort
+
+    def compile(self):
+        sql, params = self.cohort.compile(columns=['patient_id'])
+        return f"SELECT COUNT(*) AS patients FROM ({sql})", params
+
+    def __repr__(self):
+        return f"count of patients with {self.cohort!r}"
+
+
+# --- Text syntax ---
+
+_OP = r'(<=|>=|!=|<>|==|=|<|>|≥|≤)'
+_WINDOW = r'(?:\s+(?P<window>in\s+\d{4}|since\s+\d{4}-\d{2}-\d{2}|before\s+\d{4}-\d{2}-\d{2}|last\s+\d+\s+(?:year|month)s?))?'
+_DEMOGRAPHIC_RE = re.compile(r'^(?P<field>\w+)\s*(?P<op>' + _OP[1:-1] + r'|\blike\b|\bcontains\b)\s*(?P<value>.+)$', re.I)
+_LATEST_RE = re.compile(r'^latest\s+(?P<test>.+?)' + _WINDOW + r'\s*(?P<op>' + _OP[1:-1] + r')\s*(?P<value>-?[\d.]+)$', re.I)
+_COUNT_RE = re.compile(
+    r'^(?:at\s+least\s+|>=\s*|≥\s*)(?P<n>\d+)\s+(?:(?P<interp>high|low|normal)\s+)?(?P<test>.+?)' + _WINDOW + r'$', re.I)
+_COUNT_SUFFIX_RE = re.compile(
+    r'^count\s+(?:(?P<interp>high|low|normal)\s+)?(?P<test>.+?)' + _WINDOW + r'\s*(?:>=|≥)\s*(?P<n>\d+)$', re.I)
+_COHORT_COUNT_RE = re.compile(r'^(?:count|number)\s+of\s+patients\s+(?:with|where)\s+(?P<where>.+)$', re.I)
+_STAT_RE = re.compile(r'^(?P<stat>' + '|'.join(STATS) + r')\s+(?P<test>.+?)' + _WINDOW
+                      + r'(?P<by>(?:\s+by\s+\w+)*)(?:\s+where\s+(?P<where>.+))?$', re.I)
+
+
+def parse_window(text, now):
+    """'in 2024' / 'since 2024-03-01' / 'before 2025-01-01' / 'last 6 months' -> (start, end)"""
+    if not text:
+        return None
+    words = text.lower().split()
+    if words[0] == 'in':
+        year = int(words[1])
+        return (f"{year}-01-01", f"{year + 1}-01-01")
+    if words[0] == 'since':
+        return (words[1], None)
+    if words[0] == 'before':
+        return (None, words[1])
+    unit = words[2] if words[2].endswith('s') else words[2] + 's'
+    start = (pd.Timestamp(now) - pd.DateOffset(**{unit: int(words[1])})).strftime('%Y-%m-%d')
+    return (start, None)
+
+
+def resolve_test(name, test_names):
+    """Exact (case-insensitive) test name, else a single alias match ("LDL" -> "LDL Cholesterol").
+
+    A name with words besides aliases ("of patients with 3 High LDL") is
+    rejected rather than resolved by the alias it contains.
+    """
+    by_lower = {t.lower(): t for t in test_names}
+    if name.lower() in by_lower:
+        return by_lower[name.lower()]
+    extra = unaliased_words(name, test_names)
+    if extra:
+        raise CohortError(f"Unknown lab test {name!r} (not a test name or alias: {' '.join(extra)})")
+    matches = resolve_tests(clinical_router.parse(name), test_names)
+    if len(matches) == 1:
+        return matches[0]
+    if matches:
+        raise CohortError(f"{name!r} is ambiguous: {', '.join(matches)}")
+    raise CohortError(f"Unknown lab test {name!r}")
+
+
+def _split_and(text):
+    return [part.strip() for part in re.split(r'\s+and\s+', text.strip(), flags=re.I) if part.strip()]
+
+
+def parse_condition(text, test_names, now):
+    m = _LATEST_RE.match(text)
+    if m:
+        return LatestLab(resolve_test(m['test'], test_names), m['op'], m['value'], parse_window(m['window'], now))
+    m = _COUNT_RE.match(text) or _COUNT_SUFFIX_RE.match(text)
+    if m:
+        return LabCount(resolve_test(m['test'], test_names), m['n'], m['interp'], parse_window(m['window'], now))
+    m = _DEMOGRAPHIC_RE.match(text)
+    if m and m['field'].lower() in DEMOGRAPHIC_FIELDS:
+        return Demographic(m['field'].lower(), m['op'], m['value'].strip().strip('\'"'))
+    raise CohortError(f"Cannot parse condition {text!r}")
+
+
+def parse(text, test_names, now):
+    """Parse cohort or stat text into a Cohort, LabStat or CohortCount.
+
+    test_names: the lab test catalog, for resolving names and aliases;
+    now: reference date for "last N years/months".
+    """
+    text = text.strip()
+    m = _COHORT_COUNT_RE.match(text)
+    if m:
+        return CohortCount(parse_cohort(m['where'], test_names, now))
+    m = None if _COUNT_SUFFIX_RE.match(text) else _STAT_RE.match(text)
+    if m:
+        by = [b.lower() for b in m['by'].split()[1::2]]
+        cohort = parse_cohort(m['where'], test_names, now) if m['where'] else None
+        return LabStat(m['stat'].lower(), resolve_test(m['test'], test_names), by, cohort,
+                       parse_window(m['window'], now))
+    return parse_cohort(text, test_names, now)
+
+
+def parse_cohort(text, test_names, now):
+    return Cohort(*(parse_condition(part, test_names, now) for part in _split_and(text)))
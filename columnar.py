@@ -0,0 +1,215 @@
+import glob
+import json
+import os
+import re
+import shutil
+import threading
+
+from bootstrap import file_lock
+from database import DB_NAME
+from db_pool import get_pool
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.fs as pafs
+except ImportError:     # the mirror is optional; callers fall back to SQLite
+    pa = None
+
+# Columnar (Arrow IPC) mirror of the event tables for analytical reads.
+#
+# lab_results, appointments, medications and vital_signs are exported to
+# `<db>.columnar/<table>/year=YYYY[/test_name=...]/part-*.arrow`, a hive-
+# partitioned Arrow IPC dataset that is memory-mapped on read: filtering by
+# test and year only opens the matching files, and values go straight into
+# Arrow/pandas columns without a Python object per cell.
+#
+# The mirror is refreshed incrementally. _manifest.json records, per table,
+# the highest rowid exported (the tables use AUTOINCREMENT, so rowids only
+# grow) and the row count; refresh() appends the rows above that mark as new
+# part files. If the count no longer adds up (rows were deleted), or a table
+# has accumulated MAX_PARTS appends, the table is rebuilt from scratch into
+# a side directory and swapped in. Updates in place are not detected;
+# refresh(full=True) rebuilds everything.
+
+# table -> (date column the year partition comes from, extra partition columns)
+TABLES = {
+    'lab_results': ('result_date', ['test_name']),
+    'appointments': ('appointment_date', []),
+    'medications': ('start_date', []),
+    'vital_signs': ('measurement_date', []),
+}
+BATCH_ROWS = 100_000
+MAX_PARTS = 16
+MANIFEST = '_manifest.json'
+_PART_RE = re.compile(r'part-(\d+)-(\d+)-\d+\.arrow$')
+
+
+def available():
+    return pa is not None
+
+
+def _arrow_type(declared):
+    declared = (declared or '').upper()
+    if 'INT' in declared:
+        return 'INTEGER', pa.int64()
+    if any(t in declared for t in ('REAL', 'FLOA', 'DOUB', 'NUMERIC')):
+        return 'REAL', pa.float64()
+    return 'TEXT', pa.string()
+
+
+class ColumnarMirror:
+    def __init__(self, db_path=DB_NAME, root=None):
+        if pa is None:
+            raise RuntimeError("The columnar mirror needs pyarrow (pip install pyarrow)")
+        self.db_path = db_path
+        self.root = root or os.path.splitext(db_path)[0] + '.columnar'
+        self.pool = get_pool(db_path)
+        self._fs = pafs.LocalFileSystem(use_mmap=True)
+        self._datasets = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    # --- Manifest ---
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.root, MANIFEST), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self, manifest):
+        path = os.path.join(self.root, MANIFEST)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(path + '.tmp', path)
+
+    def status(self):
+        """Per-table {'hwm', 'rows', 'parts'} as of the last refresh"""
+        return self._read_manifest()
+
+    # --- Export ---
+
+    def _columns(self, conn, table):
+        return [(row[1], *_arrow_type(row[2])) for row in conn.execute(f"PRAGMA table_info({table})")]
+
+    def _partitioning(self, table):
+        fields = [('year', pa.string())] + [(c, pa.string()) for c in TABLES[table][1]]
+        return ds.partitioning(pa.schema(fields), flavor='hive')
+
+    def _batches(self, conn, table, columns, after, upto):
+        """Record batches of the rows with after < rowid <= upto, plus the `year` partition column"""
+        date_column = TABLES[table][0]
+        select = ', '.join(f"CAST({name} AS {affinity})" for name, affinity, _ in columns)
+        cursor = conn.execute(f"SELECT {select} FROM {table} WHERE rowid > ? AND rowid <= ? ORDER BY rowid",
+                              [after, upto])
+        names = [name for name, _, _ in columns]
+        types = [arrow_type for _, _, arrow_type in columns]
+        while True:
+            rows = cursor.fetchmany(BATCH_ROWS)
+            if not rows:
+                return
+            arrays = [pa.array(values, type=t) for values, t in zip(zip(*rows), types)]
+            arrays.append(pc.utf8_slice_codeunits(arrays[names.index(date_column)], 0, 4))
+            yield pa.RecordBatch.from_arrays(arrays, names=names + ['year'])
+
+    def _write(self, conn, table, target, after, upto):
+        columns = self._columns(conn, table)
+        schema = pa.schema([(name, t) for name, _, t in columns] + [('year', pa.string())])
+        ds.write_dataset(
+            ds.Scanner.from_batches(self._batches(conn, table, columns, after, upto), schema=schema),
+            target, format='ipc', partitioning=self._partitioning(table),
+            basename_template=f"part-{after + 1}-{upto}-{{i}}.arrow",
+            existing_data_behavior='overwrite_or_ignore', max_partitions=100_000)
+
+    def _drop_parts_after(self, table_dir, hwm):
+        """Remove part files of an append that never made it into the manifest"""
+        for path in glob.glob(os.path.join(table_dir, '**', 'part-*.arrow'), recursive=True):
+            match = _PART_RE.search(path)
+            if match and int(match.group(1)) > hwm:
+                os.remove(path)
+
+    def _rebuild(self, conn, table, upto):
+        table_dir = os.path.join(self.root, table)
+        fresh, stale = table_dir + '.new', table_dir + '.old'
+        shutil.rmtree(fresh, ignore_errors=True)
+        self._write(conn, table, fresh, 0, upto)
+        if os.path.exists(table_dir):
+            os.replace(table_dir, stale)
+        os.replace(fresh, table_dir)
+        # Readers may still have the old files mapped (Windows refuses to delete them)
+        shutil.rmtree(stale, ignore_errors=True)
+
+    def refresh(self, tables=None, full=False):
+        """Export new rows of `tables` (default: all present); returns {table: rows exported}"""
+        exported = {}
+        with file_lock(os.path.join(self.root, '.lock')), self.pool.reader() as conn:
+            manifest = self._read_manifest()
+            present = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for table in tables or TABLES:
+                if table not in present:
+                    continue
+                upto = conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}").fetchone()[0]
+                entry = manifest.get(table)
+                if entry and not full and upto == entry['hwm']:
+                    continue
+                # Everything is bounded by `upto`: rows inserted while this runs
+                # are left for the next refresh instead of being exported twice
+                count = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE rowid <= ?", [upto]).fetchone()[0]
+                if entry and not full and entry['parts'] < MAX_PARTS and upto > entry['hwm']:
+                    new_rows = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE rowid > ? AND rowid <= ?",
+                                            [entry['hwm'], upto]).fetchone()[0]
+                    if entry['rows'] + new_rows == count:
+                        table_dir = os.path.join(self.root, table)
+                        self._drop_parts_after(table_dir, entry['hwm'])
+                        self._write(conn, table, table_dir, entry['hwm'], upto)
+                        manifest[table] = {'hwm': upto, 'rows': count, 'parts': entry['parts'] + 1}
+                        self._write_manifest(manifest)
+                        exported[table] = new_rows
+                        continue
+                self._rebuild(conn, table, upto)
+                manifest[table] = {'hwm': upto, 'rows': count, 'parts': 1}
+                self._write_manifest(manifest)
+                exported[table] = count
+        with self._lock:
+            for table in exported:
+                self._datasets.pop(table, None)
+        return exported
+
+    # --- Reads ---
+
+    def dataset(self, table):
+        """Memory-mapped pyarrow Dataset for `table` (None before its first export)"""
+        with self._lock:
+            dataset = self._datasets.get(table)
+            if dataset is None:
+                table_dir = os.path.join(self.root, table)
+                if not os.path.isdir(table_dir):
+                    return None
+                dataset = ds.dataset(table_dir, format='ipc', partitioning=self._partitioning(table),
+                                     filesystem=self._fs)
+                self._datasets[table] = dataset
+            return dataset
+
+    def read(self, table, columns=None, filter=None):
+        """pyarrow Table of `columns` matching the dataset expression `filter`"""
+        dataset = self.dataset(table)
+        if dataset is None:
+            raise KeyError(f"{table} has not been exported; call refresh() first")
+        return dataset.to_table(columns=columns, filter=filter)
+
+
+_mirrors = {}
+_mirrors_lock = threading.Lock()
+
+
+def get_mirror(db_path=DB_NAME):
+    """Process-wide columnar mirror of `db_path`, created on first use"""
+    with _mirrors_lock:
+        mirror = _mirrors.get(db_path)
+        if mirror is None:
+            mirror = ColumnarMirror(db_path)
+            _mirrors[db_path] = mirror
+        return mirror
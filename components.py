@@ -0,0 +1,37 @@
+import streamlit as st
+
+PAGE_SIZE = 50
+
+
+def patient_selector(backend, container=st.sidebar, key="patient"):
+    """Search box + paginated selectbox over the patient directory.
+
+    Only one page of ID/name rows is fetched per rerun (see
+    ClinicalBackend.search_patients). Returns the selected patient_id, or
+    None if no patient matches.
+    """
+    search = container.text_input("Search Patients", key=f"{key}_search",
+                                  placeholder="ID or name prefix, e.g. P012 or Smith")
+
+    # Stack of keyset cursors for the pages visited, reset when the search changes
+    cursors_key = f"{key}_cursors"
+    if st.session_state.get(f"{key}_last_search") != search or cursors_key not in st.session_state:
+        st.session_state[cursors_key] = [None]
+        st.session_state[f"{key}_last_search"] = search
+    cursors = st.session_state[cursors_key]
+
+    page, next_after_id = backend.search_patients(search, after_id=cursors[-1], limit=PAGE_SIZE)
+    if page.empty:
+        return None
+
+    selected_option = container.selectbox("Select Patient", page['label'], key=f"{key}_select")
+
+    col_prev, col_next = container.columns(2)
+    if col_prev.button("◀ Prev", key=f"{key}_prev", disabled=len(cursors) == 1, use_container_width=True):
+        cursors.pop()
+        st.rerun()
+    if col_next.button("Next ▶", key=f"{key}_next", disabled=next_after_id is None, use_container_width=True):
+        cursors.append(next_after_id)
+        st.rerun()
+
+    return selected_option.split(" - ")[0]
@@ -2,21 +2,52 @@ import sqlite3
 import os
 import random
 from datetime import datetime, timedelta
+from migrations import apply_migrations
 
 DB_NAME = 'clinical_system.db'
 
-def get_db_connection():
+# Vocabularies for the synthetic data (also used by synthetic.py)
+FIRST_NAMES = ['James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda', 'William', 'Elizabeth', 
+               'David', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen',
+               'Christopher', 'Nancy', 'Daniel', 'Lisa', 'Matthew', 'Betty', 'Anthony', 'Margaret', 'Mark', 'Sandra']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+              'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin']
+
+DIAGNOSES = ['Type 2 Diabetes', 'Hypertension', 'Coronary Artery Disease', 'Asthma', 'Hyperlipidemia', 
+             'Migraine', 'Osteoarthritis', 'Anxiety Disorder', 'Depression', 'GERD', 'Hypothyroidism', 'None']
+
+ALLERGIES = ['Penicillin', 'Sulfa', 'Peanuts', 'Latex', 'Dust Mites', 'None', 'None', 'None', 'Adhesive', 'Shellfish']
+
+DOCTORS = ['Dr. Sarah Chen', 'Dr. Amanda Lee', 'Dr. Michael Rodriguez', 'Dr. James Wilson', 'Dr. Emily White']
+
+def get_db_connection(db_name=DB_NAME):
     """Get a connection to the database"""
-    conn = sqlite3.connect(DB_NAME, check_same_thread=False)
+    conn = sqlite3.connect(db_name, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     return conn
 
-def init_database():
+def init_database(db_name=DB_NAME):
     """Initialize the database with tables and synthetic data if empty"""
-    # Check if we need to recreate (optional: for now we'll just create if not exists)
-    # in a real app better to migrations, but here we just ensure tables exist
+    # Base tables are created if missing; indexes and later schema changes
+    # are applied by the versioned migrations in migrations.py
     
-    conn = get_db_connection()
+    conn = get_db_connection(db_name)
+    create_tables(conn)
+    c = conn.cursor()
+    
+    # Check if empty, if so, populate synthetic data
+    c.execute('SELECT count(*) FROM patients')
+    if c.fetchone()[0] == 0:
+        print("Empty database detected. Populating synthetic data...")
+        populate_synthetic_data(conn)
+    
+    # Upgrade schema in place (indexes are built after the bulk insert above)
+    apply_migrations(conn, verbose=True)
+        
+    conn.close()
+
+def create_tables(conn):
+    """Create the base tables if they don't exist"""
     c = conn.cursor()
     
     # Reset for demo purposes to ensure we get the large dataset
@@ -89,32 +120,11 @@ def init_database():
     ''')
     
     conn.commit()
-    
-    # Check if empty, if so, populate synthetic data
-    c.execute('SELECT count(*) FROM patients')
-    if c.fetchone()[0] == 0:
-        print("Empty database detected. Populating synthetic data...")
-        populate_synthetic_data(conn)
-        
-    conn.close()
 
 def populate_synthetic_data(conn):
     """Populate database with large synthetic dataset"""
     print("Generating large synthetic dataset...")
     
-    first_names = ['James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda', 'William', 'Elizabeth', 
-                   'David', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen',
-                   'Christopher', 'Nancy', 'Daniel', 'Lisa', 'Matthew', 'Betty', 'Anthony', 'Margaret', 'Mark', 'Sandra']
-    last_names = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
-                  'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin']
-    
-    diagnoses = ['Type 2 Diabetes', 'Hypertension', 'Coronary Artery Disease', 'Asthma', 'Hyperlipidemia', 
-                 'Migraine', 'Osteoarthritis', 'Anxiety Disorder', 'Depression', 'GERD', 'Hypothyroidism', 'None']
-    
-    allergies_list = ['Penicillin', 'Sulfa', 'Peanuts', 'Latex', 'Dust Mites', 'None', 'None', 'None', 'Adhesive', 'Shellfish']
-    
-    doctors = ['Dr. Sarah Chen', 'Dr. Amanda Lee', 'Dr. Michael Rodriguez', 'Dr. James Wilson', 'Dr. Emily White']
-
     patients = []
     appointments = []
     lab_results = []
@@ -126,17 +136,19 @@ def populate_synthetic_data(conn):
     
     for i in range(1, 101):
         p_id = f'P{i:03d}'
-        f_name = random.choice(first_names)
-        l_name = random.choice(last_names)
+        # Seed per patient before any draw so the whole record (names
+        # included) is reproducible
+        random.seed(p_id)
         
-        random.seed(p_id) 
+        f_name = random.choice(FIRST_NAMES)
+        l_name = random.choice(LAST_NAMES)
         
         year = random.randint(1950, 2000)
         dob = f"{year}-{random.randint(1,12):02d}-{random.randint(1,28):02d}"
         age = 2024 - year
         gender = random.choice(['M', 'F'])
-        diagnosis = random.choice(diagnoses)
-        allergy = random.choice(allergies_list)
+        diagnosis = random.choice(DIAGNOSES)
+        allergy = random.choice(ALLERGIES)
         
         # Helper to generate date
         def get_date(start_year, end_year):
@@ -263,7 +275,7 @@ def populate_synthetic_data(conn):
                 
                 appointments.append((
                     p_id, appt_date_str, f"{random.randint(9,16)}:00",
-                    random.choice(doctors), reason, status, "Routine notes"
+                    random.choice(DOCTORS), reason, status, "Routine notes"
                 ))
                 
                 # Generate Labs for this visit (if Completed)
@@ -0,0 +1,165 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from database import DB_NAME
+from tracing import TracedConnection
+
+# Connection pool for clinical_system.db.
+#
+# SQLite in WAL mode lets many readers run concurrently with one writer, so
+# the pool hands each thread its own read connection (checked out for the
+# duration of a `with pool.reader()` block) and funnels every write through
+# a single connection guarded by a lock. Connections are TracedConnections,
+# so statements show up in traces when tracing.py is enabled.
+
+DEFAULT_PRAGMAS = {
+    'synchronous': 'NORMAL',      # safe with WAL, avoids an fsync per commit
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64000,         # negative = KiB, i.e. ~64 MB page cache
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+}
+
+
+class ConnectionPool:
+    def __init__(self, db_name=DB_NAME, max_readers=16, pragmas=None, journal_mode='WAL'):
+        self.db_name = db_name
+        self.max_readers = max_readers
+        self.pragmas = dict(DEFAULT_PRAGMAS, **(pragmas or {}))
+
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        self._idle = []
+        self._readers = []
+        self._in_use = 0
+        self._waits = 0
+
+        self._write_lock = threading.RLock()
+        self._writer = None
+        self._write_depth = 0
+        self._closed = False
+
+        # journal_mode is persistent in the database file, so set it once
+        # (None leaves the file's mode alone, e.g. for read-only databases)
+        if journal_mode:
+            with self.writer() as conn:
+                conn.execute(f"PRAGMA journal_mode={journal_mode}")
+
+    def _connect(self, readonly):
+        conn = sqlite3.connect(self.db_name, check_same_thread=False, timeout=30, factory=TracedConnection)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def _acquire_reader(self):
+        with self._cond:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Connection pool is closed")
+            while not self._idle and len(self._readers) >= self.max_readers:
+                self._waits += 1
+                self._cond.wait()
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                conn = self._connect(readonly=True)
+                self._readers.append(conn)
+            self._in_use += 1
+            return conn
+
+    def _release_reader(self, conn):
+        with self._cond:
+            self._in_use -= 1
+            if self._closed:
+                conn.close()
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def reader(self):
+        """Borrow a read-only connection for the current thread.
+
+        Nested reader() blocks on the same thread reuse the same connection.
+        """
+        conn = getattr(self._local, 'reader', None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self._acquire_reader()
+        self._local.reader = conn
+        try:
+            yield conn
+        finally:
+            self._local.reader = None
+            self._release_reader(conn)
+
+    @contextmanager
+    def writer(self):
+        """Borrow the single writer connection inside a transaction.
+
+        Writes are serialized; the outermost block commits on success and
+        rolls back on error.
+        """
+        with self._write_lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Connection pool is closed")
+            if self._writer is None:
+                self._writer = self._connect(readonly=False)
+            conn = self._writer
+
+            if self._write_depth:
+                self._write_depth += 1
+                try:
+                    yield conn
+                finally:
+                    self._write_depth -= 1
+                return
+
+            self._write_depth = 1
+            try:
+                with conn:
+                    yield conn
+            finally:
+                self._write_depth = 0
+
+    def stats(self):
+        """Snapshot of pool usage"""
+        with self._cond:
+            return {
+                'open_readers': len(self._readers),
+                'idle_readers': len(self._idle),
+                'readers_in_use': self._in_use,
+                'reader_waits': self._waits,
+                'writer_open': self._writer is not None,
+                'max_readers': self.max_readers,
+            }
+
+    def close(self):
+        """Close idle connections; in-use readers are closed when returned"""
+        with self._write_lock, self._cond:
+            self._closed = True
+            for conn in self._idle:
+                conn.close()
+            self._readers = [c for c in self._readers if c not in self._idle]
+            self._idle = []
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_name=DB_NAME):
+    """Process-wide pool for `db_name`, created on first use"""
+    with _pools_lock:
+        pool = _pools.get(db_name)
+        if pool is None or pool._closed:
+            pool = ConnectionPool(db_name)
+            _pools[db_name] = pool
+        return pool
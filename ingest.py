@@ -0,0 +1,327 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from datetime import date, time as dtime
+from itertools import islice
+
+from database import DB_NAME
+from db_pool import get_pool
+from cache import get_data_cache
+from migrations import (managed_indexes, managed_triggers, fold_lab_trends, touch_summaries,
+                        mark_suspended, clear_suspended)
+
+# Bulk, streaming ingestion for lab_results, medications and appointments.
+#
+# Rows are read lazily from CSV or NDJSON (one JSON object per line), checked
+# against the table schema below, and inserted with executemany in large
+# transactions through the pool's writer connection. Only one chunk of rows
+# is held in memory at a time, so file size is not a concern.
+#
+# Rows are inserted with the per-row insert triggers switched off inside
+# each transaction; before commit, lab batches are folded into
+# lab_trend_summary with one grouped statement and the patients touched get
+# their summary snapshot marked stale with another, so other connections
+# never see either out of date. With defer_indexes=True the table's
+# secondary indexes (and the triggers) are dropped for the duration of the
+# load and rebuilt - and the whole load folded - once at the end: faster for
+# loads that are large relative to the table, slower for small top-ups. The
+# load is recorded in suspended_loads meanwhile, so if the process dies
+# before the end, the next apply_migrations restores and folds it.
+#
+#     python ingest.py lab_results results.csv [--defer-indexes]
+
+
+class IngestError(ValueError):
+    pass
+
+
+def _text(value):
+    return str(value)
+
+
+def _real(value):
+    return float(value)
+
+
+def _date(value):
+    # Stored as ISO text; normalizes e.g. "20250105" to "2025-01-05"
+    return date.fromisoformat(str(value).strip()).isoformat()
+
+
+def _time(value):
+    value = str(value).strip()
+    dtime.fromisoformat(value)
+    return value
+
+
+# table -> [(column, converter, required)], in insert order
+SCHEMAS = {
+    'lab_results': [
+        ('patient_id', _text, True),
+        ('result_date', _date, True),
+        ('test_name', _text, True),
+        ('value', _real, True),
+        ('unit', _text, False),
+        ('reference_low', _real, False),
+        ('reference_high', _real, False),
+        ('interpretation', _text, False),
+    ],
+    'medications': [
+        ('patient_id', _text, True),
+        ('medication_name', _text, True),
+        ('dosage', _text, False),
+        ('frequency', _text, False),
+        ('start_date', _date, True),
+        ('end_date', _date, False),
+        ('status', _text, True),
+    ],
+    'appointments': [
+        ('patient_id', _text, True),
+        ('appointment_date', _date, True),
+        ('appointment_time', _time, False),
+        ('doctor_name', _text, False),
+        ('reason', _text, False),
+        ('status', _text, False),
+        ('notes', _text, False),
+    ],
+}
+
+# Allowed values for enumerated columns
+CHOICES = {
+    ('medications', 'status'): {'Active', 'Discontinued'},
+    ('lab_results', 'interpretation'): {'Normal', 'High', 'Low'},
+}
+
+
+def _interpret(row):
+    # Labs without an interpretation get one from the reference range
+    value, low, high = row['value'], row['reference_low'], row['reference_high']
+    if high is not None and value > high:
+        return 'High'
+    if low is not None and value < low:
+        return 'Low'
+    return 'Normal'
+
+
+def validate_row(table, record):
+    """Convert a raw record (dict of strings/JSON values) to an insert tuple.
+
+    Empty strings count as missing. Raises IngestError on a missing
+    required column, an unparseable value or a value outside CHOICES.
+    """
+    if not isinstance(record, dict):
+        raise IngestError("expected a JSON object")
+    row = {}
+    for column, convert, required in SCHEMAS[table]:
+        value = record.get(column)
+        if value is None or value == '':
+            if required:
+                raise IngestError(f"missing {column}")
+            row[column] = None
+            continue
+        try:
+            value = convert(value)
+        except (TypeError, ValueError):
+            raise IngestError(f"invalid {column}: {value!r}")
+        allowed = CHOICES.get((table, column))
+        if allowed is not None and value not in allowed:
+            raise IngestError(f"invalid {column}: {value!r} (expected one of {sorted(allowed)})")
+        row[column] = value
+
+    if table == 'lab_results' and row['interpretation'] is None:
+        row['interpretation'] = _interpret(row)
+    return tuple(row.values())
+
+
+def read_records(source, fmt=None):
+    """Lazily yield (line_number, dict) from a CSV or NDJSON path or text stream"""
+    if isinstance(source, (str, os.PathLike)):
+        fmt = fmt or ('ndjson' if str(source).endswith(('.ndjson', '.jsonl', '.json')) else 'csv')
+        with open(source, newline='', encoding='utf-8') as f:
+            yield from read_records(f, fmt)
+        return
+
+    if isinstance(source, (io.RawIOBase, io.BufferedIOBase)):
+        # Binary streams (e.g. Streamlit's UploadedFile)
+        source = io.TextIOWrapper(source, encoding='utf-8', newline='')
+
+    if fmt == 'ndjson':
+        for line_no, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_no, IngestError(f"invalid JSON: {e.msg}")
+    else:
+        reader = csv.DictReader(source)
+        for record in reader:
+            # Header is line 1
+            yield reader.line_num, record
+
+
+class IngestReport:
+    def __init__(self, table):
+        self.table = table
+        self.read = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.errors = []      # (line_number, message), first max_errors only
+        self.seconds = 0.0
+
+    @property
+    def rows_per_sec(self):
+        return self.inserted / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"{self.table}: {self.inserted:,} rows inserted, {self.rejected:,} rejected "
+                f"in {self.seconds:.2f}s ({self.rows_per_sec:,.0f} rows/sec)")
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def ingest(table, source, fmt=None, db_name=DB_NAME, batch_size=5000, commit_rows=100_000,
+           defer_indexes=False, strict=False, max_errors=100):
+    """Stream `source` (path or text stream, CSV or NDJSON) into `table`.
+
+    Rows are inserted `batch_size` at a time and committed every
+    `commit_rows` rows. Invalid rows are skipped and reported, or abort the
+    load with IngestError when strict=True (earlier transactions stay
+    committed). Returns an IngestReport.
+    """
+    if table not in SCHEMAS:
+        raise IngestError(f"Unknown table {table!r}; expected one of {sorted(SCHEMAS)}")
+
+    columns = [c for c, _, _ in SCHEMAS[table]]
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    pool = get_pool(db_name)
+    report = IngestReport(table)
+    start = time.perf_counter()
+
+    # Per-row insert triggers (lab trend summary, summary versions) are
+    # switched off during the load and replaced by grouped statements over
+    # the new rows
+    fold = fold_lab_trends if table == 'lab_results' else None
+    triggers = [(name, ddl) for name, tbl, ddl in managed_triggers()
+                if tbl == table and 'AFTER INSERT' in ddl]
+    indexes = [(name, ddl) for name, tbl, ddl in managed_indexes() if defer_indexes and tbl == table]
+
+    def suspend(conn, objects):
+        for name, ddl in objects:
+            kind = 'TRIGGER' if ddl.startswith('CREATE TRIGGER') else 'INDEX'
+            conn.execute(f"DROP {kind} IF EXISTS {name}")
+        return conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+
+    def restore(conn, objects, after_id):
+        # The fold looks rows up through the lab indexes, so they come back first
+        for _, ddl in objects:
+            if ddl.startswith('CREATE INDEX'):
+                conn.execute(ddl)
+        if fold:
+            fold(conn, after_id)
+        touch_summaries(conn, table, after_id)
+        for _, ddl in objects:
+            if ddl.startswith('CREATE TRIGGER'):
+                conn.execute(ddl)
+
+    if indexes:
+        # Dropped for the whole load, restored (and folded) once at the end;
+        # the record lets apply_migrations repair a load that never finishes
+        with pool.writer() as conn:
+            mark_suspended(conn, table, suspend(conn, indexes + triggers))
+
+    def batches():
+        for chunk in _chunks(read_records(source, fmt), batch_size):
+            rows = []
+            for line_no, record in chunk:
+                report.read += 1
+                try:
+                    if isinstance(record, IngestError):
+                        raise record
+                    rows.append(validate_row(table, record))
+                except IngestError as e:
+                    if strict:
+                        raise IngestError(f"line {line_no}: {e}")
+                    report.rejected += 1
+                    if len(report.errors) < max_errors:
+                        report.errors.append((line_no, str(e)))
+            yield rows
+
+    try:
+        pending_batches = batches()
+        done = False
+        while not done:
+            # One transaction per commit_rows rows; an error rolls back only
+            # the current transaction
+            with pool.writer() as conn:
+                if not indexes:
+                    # Suspended and folded within each transaction, so other
+                    # connections never see the summary out of date
+                    after_id = suspend(conn, triggers)
+                pending = 0
+                for rows in pending_batches:
+                    conn.executemany(sql, rows)
+                    pending += len(rows)
+                    if pending >= commit_rows:
+                        break
+                else:
+                    done = True
+                if not indexes:
+                    restore(conn, triggers, after_id)
+            report.inserted += pending
+    finally:
+        if indexes:
+            with pool.writer() as conn:
+                load_start_id = clear_suspended(conn, table)
+                if load_start_id is None:
+                    # Already restored (and folded) by repair_managed_objects
+                    for _, ddl in indexes + triggers:
+                        conn.execute(ddl)
+                else:
+                    restore(conn, indexes + triggers, load_start_id)
+        # Whole-table invalidation: a batch touches too many patients to list
+        cache = get_data_cache(db_name)
+        cache.invalidate(table)
+        if table == 'lab_results':
+            cache.invalidate('lab_trend_summary')
+        report.seconds = time.perf_counter() - start
+
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-load CSV or NDJSON into the clinical database")
+    parser.add_argument('table', choices=sorted(SCHEMAS))
+    parser.add_argument('path', help="CSV or NDJSON file ('-' for stdin)")
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help="default: from the file extension")
+    parser.add_argument('--db', default=DB_NAME)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--commit-rows', type=int, default=100_000)
+    parser.add_argument('--defer-indexes', action='store_true',
+                        help="drop and rebuild the table's indexes around the load")
+    parser.add_argument('--strict', action='store_true', help="abort on the first invalid row")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.path == '-' else args.path
+    report = ingest(args.table, source, fmt=args.format or ('csv' if args.path == '-' else None),
+                    db_name=args.db, batch_size=args.batch_size, commit_rows=args.commit_rows,
+                    defer_indexes=args.defer_indexes, strict=args.strict)
+    print(report)
+    for line_no, message in report.errors:
+        print(f"  line {line_no}: {message}")
+    return 1 if report.rejected else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
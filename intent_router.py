@@ -0,0 +1,188 @@
+import re
+from functools import lru_cache
+
+# Compiled query-intent router.
+#
+# All keyword vocabularies (intents, lab aliases, status words, ...) are
+# compiled into one regular expression, so a query is lowercased once and
+# scanned once. The terms are laid out as a character trie inside the
+# pattern (shared prefixes are factored out, so the engine dispatches on the
+# next character instead of trying every keyword in turn) and anchored on
+# word boundaries: "bp" does not match inside other words and "test" does
+# not match "latest". Each hit maps to one or more tags, e.g.
+# "bp" -> {"intent:lab", "lab:BP"}. Time windows ("last 2 years",
+# "last 18 months", "last year") are captured by the same pass.
+
+
+def _trie_pattern(terms):
+    """Regex alternation for `terms` factored into a character trie"""
+    trie = {}
+    for term in terms:
+        node = trie
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node[''] = True
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # Greedy optional tail: the longest term wins ("blood pressure" over "blood")
+        return f'(?:{body})?' if '' in node else body
+
+    return build(trie).replace(r'\ ', r'\s+')
+
+
+class ParsedQuery:
+    def __init__(self, text, tags, intent, window):
+        self.text = text          # lowercased query
+        self.tags = tags          # frozenset of matched tags
+        self.intent = intent      # highest-priority intent, or None
+        self.window = window      # ('years' | 'months', n) or None
+
+    def has(self, *tags):
+        """True if any of `tags` matched"""
+        return any(t in self.tags for t in tags)
+
+    def values(self, prefix):
+        """Tag suffixes for a namespace, e.g. values('lab') -> {'BP', 'LDL'}"""
+        prefix += ':'
+        return {t[len(prefix):] for t in self.tags if t.startswith(prefix)}
+
+    def __repr__(self):
+        return f"ParsedQuery(intent={self.intent!r}, tags={sorted(self.tags)}, window={self.window})"
+
+
+class IntentRouter:
+    def __init__(self, vocabulary, priority=()):
+        """
+        vocabulary: {tag: [terms]}; a term may appear under several tags.
+        priority: intent names in order of precedence, matched against
+        "intent:<name>" tags to pick ParsedQuery.intent.
+        """
+        self.priority = list(priority)
+        self._intent_tags = [(name, f'intent:{name}') for name in self.priority]
+        self._term_tags = {}
+        for tag, terms in vocabulary.items():
+            for term in terms:
+                self._term_tags.setdefault(' '.join(term.lower().split()), set()).add(tag)
+
+        # findall() yields (n, unit, last_year, term) tuples; the optional
+        # suffix lets plurals ("labs", "medications") match their term
+        self._regex = re.compile(
+            r'\blast\s+(\d+)\s+(year|month)s?\b'
+            r'|\b(last\s+year)\b'
+            r'|\b(' + _trie_pattern(self._term_tags) + r')(?:e?s)?\b'
+        )
+
+    def parse(self, query):
+        text = query.lower()
+        tags = set()
+        windows = {}
+
+        for n, unit, last_year, term in self._regex.findall(text):
+            if term:
+                tags |= self._term_tags.get(term) or self._term_tags[' '.join(term.split())]
+            elif n:
+                windows.setdefault(unit + 's', int(n))
+            else:
+                windows.setdefault('last_year', 1)
+
+        # A month window takes precedence over a year window
+        window = None
+        if 'months' in windows:
+            window = ('months', windows['months'])
+        elif 'years' in windows:
+            window = ('years', windows['years'])
+        elif 'last_year' in windows:
+            window = ('years', 1)
+
+        intent = None
+        for name, tag in self._intent_tags:
+            if tag in tags:
+                intent = name
+                break
+        return ParsedQuery(text, frozenset(tags), intent, window)
+
+    def unmatched(self, query):
+        """Words of `query` not covered by any term or time window"""
+        return self._regex.sub(' ', query.lower()).split()
+
+
+# Vocabulary for ClinicalBackend.run_analysis_query
+CLINICAL_VOCABULARY = {
+    'intent:medication': ['medication', 'medicine', 'meds', 'drug', 'prescription', 'taking'],
+    'intent:lab': ['lab', 'result', 'test', 'blood', 'blood pressure', 'glucose', 'a1c', 'hba1c', 'bp',
+                   'pressure', 'cholesterol', 'hemoglobin', 'bun', 'ldl', 'hdl', 'triglyceride',
+                   'creatinine', 'lipid'],
+    'intent:appointment': ['appointment', 'visit', 'scheduled', 'checkup'],
+    'intent:summary': ['summary', 'overview', 'report', 'status'],
+
+    'med:active': ['active', 'current', 'taking', 'now'],
+    'med:discontinued': ['discontinued', 'past', 'history', 'stopped', 'old'],
+
+    'date:today': ['today'],
+    'date:tomorrow': ['tomorrow'],
+    'date:yesterday': ['yesterday'],
+    'upcoming': ['upcoming', 'next'],
+    'trend': ['trend', 'over time'],
+
+    # Lab aliases, resolved to concrete test names by resolve_tests()
+    'lab:BP': ['bp', 'blood pressure', 'pressure'],
+    'lab:lipid': ['lipid'],
+    'lab:cholesterol': ['cholesterol'],
+    'lab:Triglycerides': ['triglyceride'],
+    'lab:LDL': ['ldl'],
+    'lab:HDL': ['hdl'],
+    'lab:A1c': ['a1c', 'hba1c'],
+    'lab:Glucose': ['glucose'],
+    'lab:Hemoglobin': ['hemoglobin'],
+    'lab:BUN': ['bun'],
+    'lab:Creatinine': ['creatinine'],
+}
+CLINICAL_PRIORITY = ['medication', 'lab', 'appointment', 'summary']
+
+# Which test names each lab alias selects
+_LAB_MATCHERS = {
+    'BP': lambda t: 'BP' in t,
+    # Lipid panel usually includes everything
+    'lipid': lambda t: any(l in t for l in ['Cholesterol', 'LDL', 'HDL', 'Triglycerides']),
+    # Cholesterol specifically (excluding triglycerides)
+    'cholesterol': lambda t: 'Cholesterol' in t or 'LDL' in t or 'HDL' in t,
+}
+
+
+@lru_cache(maxsize=64)
+def _test_name_router(test_names):
+    # Patients share the same test catalog, so this compiles once in practice
+    return IntentRouter({name: [name] for name in test_names})
+
+
+@lru_cache(maxsize=1024)
+def _concept_tests(concept, test_names):
+    matcher = _LAB_MATCHERS.get(concept, lambda t: concept in t)
+    return frozenset(t for t in test_names if matcher(t))
+
+
+def unaliased_words(name, test_names):
+    """Words of `name` that are neither a lab alias nor part of a test name"""
+    words = _test_name_router(tuple(sorted(test_names))).unmatched(name)
+    return lab_alias_router.unmatched(' '.join(words))
+
+
+def resolve_tests(parsed, test_names):
+    """Map the lab aliases in `parsed` onto the available `test_names`"""
+    test_names = tuple(sorted(test_names))
+    requested = set()
+    for concept in parsed.values('lab'):
+        requested |= _concept_tests(concept, test_names)
+
+    # Direct match for any other test named verbatim in the query
+    requested |= _test_name_router(test_names).parse(parsed.text).tags
+    return sorted(requested)
+
+
+clinical_router = IntentRouter(CLINICAL_VOCABULARY, CLINICAL_PRIORITY)
+# Just the lab aliases, for telling a test name from a sentence that mentions one
+lab_alias_router = IntentRouter({tag: terms for tag, terms in CLINICAL_VOCABULARY.items() if tag.startswith('lab:')})
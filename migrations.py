@@ -0,0 +1,389 @@
+import sqlite3
+
+# Versioned schema migrations for clinical_system.db.
+#
+# Each entry is (version, description, statements). The current version is
+# recorded in the database itself via PRAGMA user_version, so existing
+# databases are upgraded in place by applying only the migrations they have
+# not seen yet. Never edit a migration that has shipped - append a new one.
+
+# Per-(patient, test) aggregate over lab_results, used both to backfill
+# lab_trend_summary and to recompute one pair after an update or delete.
+# x is the result date as days since 2000-01-01, so the running sums stay
+# small enough for an exact-enough least-squares slope.
+_LAB_TREND_AGGREGATE = """
+    INSERT OR REPLACE INTO lab_trend_summary
+        (patient_id, test_name, unit, n, first_date, first_value, latest_date, latest_value,
+         min_value, max_value, sum_x, sum_y, sum_xx, sum_xy)
+    SELECT patient_id, test_name,
+           MAX(CASE WHEN last_rank = 1 THEN unit END), COUNT(*),
+           MAX(CASE WHEN first_rank = 1 THEN result_date END), MAX(CASE WHEN first_rank = 1 THEN value END),
+           MAX(CASE WHEN last_rank = 1 THEN result_date END), MAX(CASE WHEN last_rank = 1 THEN value END),
+           MIN(value), MAX(value), SUM(x), SUM(value), SUM(x * x), SUM(x * value)
+    FROM (
+        SELECT patient_id, test_name, unit, result_date, value,
+               julianday(result_date) - 2451545.0 AS x,
+               ROW_NUMBER() OVER (PARTITION BY patient_id, test_name ORDER BY result_date, id) AS first_rank,
+               ROW_NUMBER() OVER (PARTITION BY patient_id, test_name ORDER BY result_date DESC, id DESC) AS last_rank
+        FROM lab_results
+        WHERE value IS NOT NULL {where}
+    )
+    GROUP BY patient_id, test_name
+"""
+
+# Folds one new aggregate row (`excluded`) into an existing summary row.
+# Ties on date: the row already counted stays "first", the new one becomes "latest".
+_LAB_TREND_MERGE = """
+    ON CONFLICT (patient_id, test_name) DO UPDATE SET
+        n = n + excluded.n,
+        first_date = CASE WHEN excluded.first_date < first_date THEN excluded.first_date ELSE first_date END,
+        first_value = CASE WHEN excluded.first_date < first_date THEN excluded.first_value ELSE first_value END,
+        latest_date = CASE WHEN excluded.latest_date >= latest_date THEN excluded.latest_date ELSE latest_date END,
+        latest_value = CASE WHEN excluded.latest_date >= latest_date THEN excluded.latest_value ELSE latest_value END,
+        unit = CASE WHEN excluded.latest_date >= latest_date THEN excluded.unit ELSE unit END,
+        min_value = MIN(min_value, excluded.min_value),
+        max_value = MAX(max_value, excluded.max_value),
+        sum_x = sum_x + excluded.sum_x,
+        sum_y = sum_y + excluded.sum_y,
+        sum_xx = sum_xx + excluded.sum_xx,
+        sum_xy = sum_xy + excluded.sum_xy
+"""
+
+# Marks a patient's summary snapshot out of date: the snapshot is current
+# while snapshot_version = version (see summaries.py)
+_SUMMARY_BUMP = """
+    INSERT INTO patient_summary (patient_id) VALUES ({row}.patient_id)
+    ON CONFLICT (patient_id) DO UPDATE SET version = version + 1"""
+
+# Tables whose rows feed the summary snapshot
+_SUMMARY_SOURCES = ['patients', 'lab_results', 'appointments', 'medications']
+
+MIGRATIONS = [
+    (1, "Covering indexes for per-patient lab, appointment and medication reads", [
+        # get_patient_labs: WHERE patient_id = ? ORDER BY result_date DESC
+        "CREATE INDEX IF NOT EXISTS idx_lab_results_patient_date ON lab_results (patient_id, result_date DESC)",
+        # Trend lookups for a single test
+        "CREATE INDEX IF NOT EXISTS idx_lab_results_patient_test_date ON lab_results (patient_id, test_name, result_date)",
+        # get_patient_appointments: WHERE patient_id = ? ORDER BY appointment_date DESC
+        "CREATE INDEX IF NOT EXISTS idx_appointments_patient_date ON appointments (patient_id, appointment_date)",
+        # get_patient_medications: WHERE patient_id = ? ORDER BY status ASC, start_date DESC
+        "CREATE INDEX IF NOT EXISTS idx_medications_patient_status_start ON medications (patient_id, status, start_date DESC)",
+    ]),
+    (2, "Case-insensitive name and ID indexes for the patient directory search", [
+        # NOCASE collation lets SQLite serve `LIKE 'prefix%'` from the index
+        "CREATE INDEX IF NOT EXISTS idx_patients_id_nocase ON patients (patient_id COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_patients_last_first ON patients (last_name COLLATE NOCASE, first_name COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_patients_first ON patients (first_name COLLATE NOCASE)",
+    ]),
+    (3, "Pre-aggregated per-patient lab trends kept current by triggers", [
+        # One row per (patient_id, test_name); slope is the least-squares fit
+        # in value units per day, derived from the running sums
+        """CREATE TABLE IF NOT EXISTS lab_trend_summary (
+            patient_id TEXT NOT NULL,
+            test_name TEXT NOT NULL,
+            unit TEXT,
+            n INTEGER NOT NULL,
+            first_date DATE,
+            first_value REAL,
+            latest_date DATE,
+            latest_value REAL,
+            min_value REAL,
+            max_value REAL,
+            sum_x REAL NOT NULL,
+            sum_y REAL NOT NULL,
+            sum_xx REAL NOT NULL,
+            sum_xy REAL NOT NULL,
+            slope REAL GENERATED ALWAYS AS (
+                CASE WHEN n > 1 AND n * sum_xx - sum_x * sum_x > 0
+                     THEN (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x * sum_x) END
+            ) VIRTUAL,
+            PRIMARY KEY (patient_id, test_name)
+        ) WITHOUT ROWID""",
+        _LAB_TREND_AGGREGATE.format(where=""),
+        # Appending a result folds it into the running aggregate (O(1) per row)
+        """CREATE TRIGGER IF NOT EXISTS trg_lab_results_trend_insert
+        AFTER INSERT ON lab_results WHEN NEW.value IS NOT NULL
+        BEGIN
+            INSERT INTO lab_trend_summary
+                (patient_id, test_name, unit, n, first_date, first_value, latest_date, latest_value,
+                 min_value, max_value, sum_x, sum_y, sum_xx, sum_xy)
+            VALUES (NEW.patient_id, NEW.test_name, NEW.unit, 1, NEW.result_date, NEW.value,
+                    NEW.result_date, NEW.value, NEW.value, NEW.value,
+                    julianday(NEW.result_date) - 2451545.0, NEW.value,
+                    (julianday(NEW.result_date) - 2451545.0) * (julianday(NEW.result_date) - 2451545.0),
+                    (julianday(NEW.result_date) - 2451545.0) * NEW.value)
+            """ + _LAB_TREND_MERGE + """;
+        END""",
+        # Updates and deletes are rare; recompute the affected pairs from scratch
+        """CREATE TRIGGER IF NOT EXISTS trg_lab_results_trend_delete
+        AFTER DELETE ON lab_results
+        BEGIN
+            DELETE FROM lab_trend_summary WHERE patient_id = OLD.patient_id AND test_name = OLD.test_name;
+            """ + _LAB_TREND_AGGREGATE.format(where="AND patient_id = OLD.patient_id AND test_name = OLD.test_name") + """;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_lab_results_trend_update
+        AFTER UPDATE OF patient_id, test_name, result_date, value, unit ON lab_results
+        BEGIN
+            DELETE FROM lab_trend_summary WHERE patient_id IN (OLD.patient_id, NEW.patient_id)
+                AND test_name IN (OLD.test_name, NEW.test_name);
+            """ + _LAB_TREND_AGGREGATE.format(
+                where="AND patient_id IN (OLD.patient_id, NEW.patient_id) AND test_name IN (OLD.test_name, NEW.test_name)") + """;
+        END""",
+    ]),
+    (4, "Cross-patient indexes for cohort queries", [
+        # Readings of one test in a date range, across patients; covering, so
+        # counts and window functions never touch the table
+        "CREATE INDEX IF NOT EXISTS idx_lab_results_test_date ON lab_results (test_name, result_date, patient_id, value, interpretation)",
+        # "latest <test> > x" as an index range
+        "CREATE INDEX IF NOT EXISTS idx_lab_trend_test_latest ON lab_trend_summary (test_name, latest_value)",
+        "CREATE INDEX IF NOT EXISTS idx_patients_diagnosis ON patients (primary_diagnosis COLLATE NOCASE)",
+    ]),
+    (5, "Per-patient summary snapshots with trigger-maintained versions", [
+        # snapshot is JSON built by summaries.build_snapshot; every write to
+        # a source table bumps version, which leaves the snapshot stale until
+        # it is rebuilt (on read, after a backend write, or by the refresher)
+        """CREATE TABLE IF NOT EXISTS patient_summary (
+            patient_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 1,
+            snapshot_version INTEGER NOT NULL DEFAULT 0,
+            built_at TEXT,
+            snapshot TEXT
+        ) WITHOUT ROWID""",
+        "INSERT OR IGNORE INTO patient_summary (patient_id) SELECT patient_id FROM patients",
+        # The refresher's "which snapshots are stale" scan
+        "CREATE INDEX IF NOT EXISTS idx_patient_summary_stale ON patient_summary (patient_id) WHERE snapshot_version < version",
+        *[f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_summary_insert
+        AFTER INSERT ON {table}
+        BEGIN{_SUMMARY_BUMP.format(row='NEW')};
+        END""" for table in _SUMMARY_SOURCES],
+        *[f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_summary_update
+        AFTER UPDATE ON {table}
+        BEGIN{_SUMMARY_BUMP.format(row='OLD')};{_SUMMARY_BUMP.format(row='NEW')};
+        END""" for table in _SUMMARY_SOURCES],
+        *[f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_summary_delete
+        AFTER DELETE ON {table}
+        BEGIN{_SUMMARY_BUMP.format(row='OLD')};
+        END""" for table in _SUMMARY_SOURCES],
+    ]),
+    (6, "Record of bulk loads running with indexes and triggers dropped", [
+        # One row per table while ingest.py has its managed indexes and insert
+        # triggers dropped; after_id is the highest id before the load, so a
+        # load that never finished can be folded in by repair_managed_objects
+        """CREATE TABLE IF NOT EXISTS suspended_loads (
+            table_name TEXT PRIMARY KEY,
+            after_id INTEGER NOT NULL,
+            started_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )""",
+    ]),
+]
+
+
+def managed_indexes(upto=None):
+    """Secondary indexes created by the migrations (up to version `upto`), as (name, table, sql).
+
+    Bulk loaders use this to drop and rebuild indexes around large inserts.
+    """
+    indexes = []
+    for version, _, statements in MIGRATIONS:
+        if upto is not None and version > upto:
+            continue
+        for sql in statements:
+            if sql.startswith("CREATE INDEX"):
+                # CREATE INDEX IF NOT EXISTS <name> ON <table> (...)
+                tokens = sql.split()
+                indexes.append((tokens[5], tokens[7], sql))
+    return indexes
+
+
+def managed_triggers(upto=None):
+    """Triggers created by the migrations (up to version `upto`), as (name, table, sql)"""
+    triggers = []
+    for version, _, statements in MIGRATIONS:
+        if upto is not None and version > upto:
+            continue
+        for sql in statements:
+            if sql.startswith("CREATE TRIGGER"):
+                # CREATE TRIGGER IF NOT EXISTS <name> AFTER <event> [OF ...] ON <table>
+                tokens = sql.split()
+                triggers.append((tokens[5], tokens[tokens.index('ON') + 1], sql))
+    return triggers
+
+
+def rebuild_lab_trend_summary(conn):
+    """Recompute lab_trend_summary from lab_results in one pass.
+
+    For bulk loaders that insert with the insert trigger dropped.
+    """
+    conn.execute("DELETE FROM lab_trend_summary")
+    conn.execute(_LAB_TREND_AGGREGATE.format(where=""))
+
+
+def fold_lab_trends(conn, after_id):
+    """Fold lab_results rows with id > after_id into lab_trend_summary.
+
+    Bulk loaders insert with the per-row insert trigger dropped and fold
+    each batch in with one grouped statement instead. The batch is read by
+    rowid range (NOT INDEXED keeps the planner from walking the whole table
+    in index order) and grouped once; first/latest values are then picked
+    per group through the (patient_id, test_name, result_date) index, which
+    must exist, rather than by sorting the batch twice as the backfill does.
+    """
+    conn.execute("""
+        INSERT INTO lab_trend_summary
+            (patient_id, test_name, unit, n, first_date, first_value, latest_date, latest_value,
+             min_value, max_value, sum_x, sum_y, sum_xx, sum_xy)
+        SELECT g.patient_id, g.test_name, latest.unit, g.n, g.first_date, first.value,
+               g.latest_date, latest.value, g.min_value, g.max_value, g.sum_x, g.sum_y, g.sum_xx, g.sum_xy
+        FROM (
+            SELECT patient_id, test_name, COUNT(*) AS n, MIN(result_date) AS first_date,
+                   MAX(result_date) AS latest_date, MIN(value) AS min_value, MAX(value) AS max_value,
+                   SUM(x) AS sum_x, SUM(value) AS sum_y, SUM(x * x) AS sum_xx, SUM(x * value) AS sum_xy
+            FROM (
+                SELECT patient_id, test_name, result_date, value, julianday(result_date) - 2451545.0 AS x
+                FROM lab_results NOT INDEXED WHERE value IS NOT NULL AND id > :after_id
+            )
+            GROUP BY patient_id, test_name
+        ) g
+        JOIN lab_results first ON first.id = (
+            SELECT id FROM lab_results
+            WHERE patient_id = g.patient_id AND test_name = g.test_name AND result_date = g.first_date
+              AND value IS NOT NULL AND id > :after_id
+            ORDER BY id LIMIT 1)
+        JOIN lab_results latest ON latest.id = (
+            SELECT id FROM lab_results
+            WHERE patient_id = g.patient_id AND test_name = g.test_name AND result_date = g.latest_date
+              AND value IS NOT NULL AND id > :after_id
+            ORDER BY id DESC LIMIT 1)
+        WHERE true
+    """ + _LAB_TREND_MERGE, {'after_id': after_id})
+
+
+def touch_summaries(conn, table, after_rowid=0):
+    """Mark the summaries of every patient with `table` rows past `after_rowid` stale.
+
+    For bulk loaders that insert with the summary triggers dropped.
+    """
+    conn.execute(f"""
+        INSERT INTO patient_summary (patient_id)
+        SELECT DISTINCT patient_id FROM {table} WHERE rowid > ? AND patient_id IS NOT NULL
+        ON CONFLICT (patient_id) DO UPDATE SET version = version + 1""", [after_rowid])
+
+
+def mark_suspended(conn, table, after_id):
+    """Record that `table`'s managed indexes / insert triggers are dropped for a load of ids past `after_id`.
+
+    An older record (a load that never finished) is kept, so its rows are
+    folded in too when the objects come back.
+    """
+    conn.execute("INSERT INTO suspended_loads (table_name, after_id) VALUES (?, ?) "
+                 "ON CONFLICT (table_name) DO NOTHING", [table, after_id])
+
+
+def clear_suspended(conn, table):
+    """Remove `table`'s suspended-load record; returns its after_id, or None if
+    repair_managed_objects already restored the table meanwhile"""
+    row = conn.execute("SELECT after_id FROM suspended_loads WHERE table_name = ?", [table]).fetchone()
+    if row is None:
+        return None
+    conn.execute("DELETE FROM suspended_loads WHERE table_name = ?", [table])
+    return row[0]
+
+
+def repair_managed_objects(conn, verbose=False):
+    """Recreate managed indexes and triggers missing from the database.
+
+    A bulk load with deferred indexes that was killed, or failed while
+    restoring, leaves them dropped; user_version does not change, so the
+    migrations alone would never bring them back. Rows of a recorded load
+    are folded into lab_trend_summary and their patients' summaries marked
+    stale; a trigger missing without a record rebuilds the trend table or
+    marks every summary fed by its table stale. Returns the names recreated.
+    """
+    version = get_schema_version(conn)
+    present = {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger', 'table')")}
+    missing = [obj for obj in managed_indexes(version) + managed_triggers(version) if obj[0] not in present]
+    loads = {}
+    if 'suspended_loads' in present:
+        loads = {row[0]: row[1] for row in conn.execute("SELECT table_name, after_id FROM suspended_loads")}
+    if not missing and not loads:
+        return []
+    if verbose:
+        print(f"Restoring {len(missing)} missing indexes / triggers")
+
+    if conn.in_transaction:
+        conn.commit()
+    try:
+        conn.execute("BEGIN")
+        # The fold looks rows up through the lab indexes, so they come back first
+        for _, _, sql in missing:
+            if sql.startswith("CREATE INDEX"):
+                conn.execute(sql)
+        lost = {name: table for name, table, sql in missing if sql.startswith("CREATE TRIGGER")}
+        for table in sorted(set(lost.values()) | set(loads)):
+            if table in loads:
+                if table == 'lab_results':
+                    fold_lab_trends(conn, loads[table])
+                touch_summaries(conn, table, loads[table])
+                continue
+            if table == 'lab_results' and any(name.startswith('trg_lab_results_trend') for name in lost):
+                rebuild_lab_trend_summary(conn)
+            if any(t == table and '_summary_' in name for name, t in lost.items()):
+                touch_summaries(conn, table)
+        for _, _, sql in missing:
+            if sql.startswith("CREATE TRIGGER"):
+                conn.execute(sql)
+        if loads:
+            conn.execute("DELETE FROM suspended_loads")
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+    return [name for name, _, _ in missing]
+
+
+def latest_version():
+    """Highest schema version known to this code"""
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def get_schema_version(conn):
+    """Schema version recorded in the database"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(conn, target=None, verbose=False):
+    """Upgrade the database in place to `target` (default: latest).
+
+    Each migration runs in its own transaction together with the version
+    bump, so an interrupted upgrade never leaves a half-applied version.
+    Managed indexes and triggers left dropped by an unfinished bulk load are
+    then restored (repair_managed_objects). Returns the list of versions
+    that were applied.
+    """
+    target = latest_version() if target is None else target
+    current = get_schema_version(conn)
+    applied = []
+
+    if conn.in_transaction:
+        conn.commit()
+
+    for version, description, statements in MIGRATIONS:
+        if version <= current or version > target:
+            continue
+        if verbose:
+            print(f"Applying migration {version}: {description}")
+        try:
+            conn.execute("BEGIN")
+            for sql in statements:
+                conn.execute(sql)
+            # PRAGMA does not accept bound parameters; version is an int we control
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        applied.append(version)
+
+    repair_managed_objects(conn, verbose=verbose)
+    return applied
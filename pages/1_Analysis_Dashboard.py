@@ -2,31 +2,34 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 from backend import ClinicalBackend
+from components import patient_selector
+from charts import cached_figure, downsample
+from schemas import format_date
+from summaries import start_refresher
+import tracing
 
 st.set_page_config(page_title="Doctor Dashboard", page_icon="🩺", layout="wide")
 
+# Backend dates are datetime64; show them without a time of day
+DATE_COLUMNS = {name: st.column_config.DateColumn(format="YYYY-MM-DD")
+                for name in ('result_date', 'appointment_date', 'start_date', 'end_date')}
+
 def main():
     backend = ClinicalBackend()
+    # Keeps patient summary snapshots current in the background (once per process)
+    start_refresher(backend.pool.db_name)
     st.markdown('<h1 class="main-header">Clinical Interpretation & Analysis</h1>', unsafe_allow_html=True)
     
     # Sidebar Patient Selection
     st.sidebar.header("Patient Selection")
-    all_patients = backend.get_all_patients()
+    patient_id = patient_selector(backend, st.sidebar)
     
-    if all_patients.empty:
-        st.warning("No patients found in database.")
+    if patient_id is None:
+        st.warning("No matching patients found in database.")
         st.stop()
-        
-    patient_options = all_patients.apply(
-        lambda x: f"{x['patient_id']} - {x['first_name']} {x['last_name']}", axis=1
-    )
-    selected_option = st.sidebar.selectbox("Select Patient", patient_options)
-    patient_id = selected_option.split(" - ")[0]
     
-    # Get Data
+    # Get Data (tab contents are loaded by the tab that shows them)
     patient = backend.get_patient_details(patient_id)
-    labs = backend.get_patient_labs(patient_id)
-    meds = backend.get_patient_medications(patient_id)
     
     # Display Patient Header
     if patient:
@@ -35,7 +38,7 @@ def main():
             col1.metric("Patient", f"{patient['first_name']} {patient['last_name']}")
             col2.metric("Age/Gender", f"{patient['age']} / {patient['gender']}")
             col3.metric("Diagnosis", patient['primary_diagnosis'])
-            col4.metric("Last Visit", patient['last_visit'])
+            col4.metric("Last Visit", format_date(patient['last_visit']))
             
         st.divider()
         
@@ -54,71 +57,138 @@ def main():
                  submit = st.form_submit_button("Analyze", type="primary")
 
             if submit and query:
-                with st.spinner("Analyzing..."):
-                    response = backend.run_analysis_query(query, patient_id)
-                    st.markdown(response)
+                # Rendered as it is produced: the heading first, then rows as they are read
+                st.write_stream(backend.stream_analysis_query(query, patient_id))
 
         st.markdown("---")
 
-        # Tabs for Data
-        tab1, tab2, tab3 = st.tabs(["📊 Lab Results", "📅 Appointments", "💊 Medications"])
+        # Tabs for Data: rerun on switch so only the open tab is built
+        # (.open is None on Streamlit versions without tab state - build all)
+        tab1, tab2, tab3, tab4 = st.tabs(["📊 Lab Results", "📅 Appointments", "💊 Medications", "👥 Similar Patients"],
+                                   key="dashboard_tabs", on_change="rerun")
         
-        with tab1:
-            st.subheader("Lab Results History")
-            labs_df = backend.get_patient_labs(patient_id)
+        if tab1.open is not False:
+            with tab1:
+                st.subheader("Lab Results History")
+                labs_df = backend.get_patient_labs(patient_id)
             
-            if not labs_df.empty:
-                # Dropdown for test selection
-                test_types = labs_df['test_name'].unique()
-                selected_test = st.selectbox("Select Lab Test", test_types)
+                if not labs_df.empty:
+                    # One pre-aggregated row per test - no scan of the lab history
+                    trends = backend.get_lab_trends(patient_id)
+                
+                    # Dropdown for test selection
+                    selected_test = st.selectbox("Select Lab Test", trends['test_name'])
+                    trend = backend.get_lab_trend(patient_id, selected_test)
                 
-                # Filter Data
-                filtered_labs = labs_df[labs_df['test_name'] == selected_test].sort_values('result_date')
+                    # Summary cards
+                    if trend:
+                        unit = trend['unit'] or ''
+                        c1, c2, c3, c4 = st.columns(4)
+                        c1.metric("Latest", f"{trend['latest_value']} {unit}", f"{trend['change']:+.1f} since first", delta_color="off")
+                        c2.metric("Range", f"{trend['min_value']} - {trend['max_value']}")
+                        c3.metric("Readings", trend['n'], f"since {format_date(trend['first_date'])}", delta_color="off")
+                        slope = trend['slope_per_year']
+                        c4.metric("Trend / year", f"{slope:+.2f} {unit}" if pd.notna(slope) else "n/a")
                 
-                # Plot
-                fig = px.line(filtered_labs, x='result_date', y='value', markers=True, title=f"{selected_test} Over Time")
-                # Add reference lines if available
-                if not filtered_labs.empty:
-                    low = filtered_labs.iloc[0]['reference_low']
-                    high = filtered_labs.iloc[0]['reference_high']
-                    if low > 0 or high > 0:
-                        fig.add_hline(y=low, line_dash="dash", line_color="green", annotation_text="Low Ref")
-                        fig.add_hline(y=high, line_dash="dash", line_color="red", annotation_text="High Ref")
+                    def build_lab_figure():
+                        # Only the selected test's rows are read (indexed), oldest first for plotting
+                        filtered_labs = backend.query_labs(patient_id, tests=[selected_test]).iloc[::-1]
+                        points = downsample(filtered_labs, 'result_date', 'value')
+                        fig = px.line(points, x='result_date', y='value', markers=True, title=f"{selected_test} Over Time")
+                        # Add reference lines if available
+                        if not filtered_labs.empty:
+                            low = filtered_labs.iloc[0]['reference_low']
+                            high = filtered_labs.iloc[0]['reference_high']
+                            # Either bound may be unset (NULL); draw the ones that are
+                            if pd.notna(low):
+                                fig.add_hline(y=low, line_dash="dash", line_color="green", annotation_text="Low Ref")
+                            if pd.notna(high):
+                                fig.add_hline(y=high, line_dash="dash", line_color="red", annotation_text="High Ref")
+                        return fig
                 
-                st.plotly_chart(fig, use_container_width=True)
+                    # Plot: rebuilt only when the test's trend summary changes
+                    version = tuple(trend[k] for k in ('n', 'latest_date', 'latest_value', 'min_value', 'max_value')) if trend else None
+                    fig = cached_figure(patient_id, f"lab:{selected_test}", None, version, build_lab_figure)
+                    st.plotly_chart(fig, use_container_width=True)
                 
-                st.subheader("📋 Laboratory History")
-                st.dataframe(labs_df.sort_values('result_date', ascending=False), use_container_width=True)
-            else:
-                st.info("No lab results found.")
+                    st.subheader("📋 Laboratory History")
+                    # Already newest first from the database
+                    st.dataframe(labs_df, use_container_width=True, column_config=DATE_COLUMNS)
+                else:
+                    st.info("No lab results found.")
 
-        with tab2:
-            st.subheader("Appointment History")
-            appt_df = backend.get_patient_appointments(patient_id)
-            if not appt_df.empty:
-                st.dataframe(appt_df[['appointment_date', 'appointment_time', 'doctor_name', 'reason', 'status', 'notes']])
-            else:
-                st.info("No appointments found.")
+        if tab2.open is not False:
+            with tab2:
+                st.subheader("Appointment History")
+                appt_df = backend.get_patient_appointments(patient_id)
+                if not appt_df.empty:
+                    st.dataframe(appt_df[['appointment_date', 'appointment_time', 'doctor_name', 'reason', 'status', 'notes']],
+                                 column_config=DATE_COLUMNS)
+                else:
+                    st.info("No appointments found.")
                 
-        with tab3:
-            st.header(f"Medications for {patient['first_name']}")
+        if tab3.open is not False:
+            with tab3:
+                st.header(f"Medications for {patient['first_name']}")
             
-            meds_df = backend.get_patient_medications(patient_id)
+                meds_df = backend.get_patient_medications(patient_id)
             
-            if not meds_df.empty:
-                # Active
-                active_meds = meds_df[meds_df['status'] == 'Active']
-                if not active_meds.empty:
-                    st.subheader(f"✅ Active Prescriptions ({len(active_meds)})")
-                    st.dataframe(active_meds[['medication_name', 'dosage', 'frequency', 'start_date']], use_container_width=True, hide_index=True)
+                if not meds_df.empty:
+                    # Active
+                    active_meds = meds_df[meds_df['status'] == 'Active']
+                    if not active_meds.empty:
+                        st.subheader(f"✅ Active Prescriptions ({len(active_meds)})")
+                        st.dataframe(active_meds[['medication_name', 'dosage', 'frequency', 'start_date']], use_container_width=True, hide_index=True,
+                                     column_config=DATE_COLUMNS)
                 
-                # Discontinued
-                discontinued_meds = meds_df[meds_df['status'] == 'Discontinued']
-                if not discontinued_meds.empty:
-                    st.subheader(f"🛑 Discontinued / Past Medications ({len(discontinued_meds)})")
-                    st.dataframe(discontinued_meds[['medication_name', 'dosage', 'frequency', 'start_date', 'end_date', 'status']], use_container_width=True, hide_index=True)
-            else:
-                st.info("No medication records found.")
+                    # Discontinued
+                    discontinued_meds = meds_df[meds_df['status'] == 'Discontinued']
+                    if not discontinued_meds.empty:
+                        st.subheader(f"🛑 Discontinued / Past Medications ({len(discontinued_meds)})")
+                        st.dataframe(discontinued_meds[['medication_name', 'dosage', 'frequency', 'start_date', 'end_date', 'status']], use_container_width=True, hide_index=True,
+                                     column_config=DATE_COLUMNS)
+                else:
+                    st.info("No medication records found.")
+
+        if tab4.open is not False:
+            with tab4:
+                st.subheader("Similar Patients")
+                st.caption("Nearest patients by latest value, mean and yearly trend of each lab test, plus age.")
+                same_diagnosis = st.checkbox(f"Same diagnosis only ({patient['primary_diagnosis']})", value=True)
+                similar_df = backend.similar_patients(patient_id, k=10, same_diagnosis=same_diagnosis)
+                if not similar_df.empty:
+                    st.dataframe(similar_df, use_container_width=True, hide_index=True)
+                else:
+                    st.info("No comparable patients found.")
+
+    pipeline_timings()
+
+
+def set_tracing():
+    if st.session_state.trace_pipeline:
+        tracing.enable()
+    else:
+        tracing.disable()
+
+
+def pipeline_timings():
+    """Developer panel: p50 / p95 per query-pipeline stage (see tracing.py)"""
+    with st.expander("🛠️ Pipeline timings (developer)"):
+        st.checkbox("Trace queries (process-wide)", value=tracing.enabled(), key="trace_pipeline",
+                    on_change=set_tracing)
+        stats = tracing.stats()
+        if not stats:
+            st.caption("No traced queries yet - enable tracing and ask the assistant a question.")
+            return
+        st.dataframe(pd.DataFrame(stats), use_container_width=True, hide_index=True)
+        traces = tracing.recent_traces()
+        if traces:
+            st.markdown("**Latest trace**")
+            st.code('\n'.join(tracing.format_trace(traces[0])), language=None)
+        c1, c2 = st.columns(2)
+        c1.download_button("Prometheus metrics", tracing.prometheus_text(), "clinical_metrics.prom", mime="text/plain")
+        c2.download_button("Recent traces (JSON lines)", tracing.jsonl_text(), "clinical_traces.jsonl",
+                           mime="application/x-ndjson")
 
 if __name__ == "__main__":
     main()
@@ -2,6 +2,7 @@ import streamlit as st
 import pandas as pd
 from datetime import date
 from backend import ClinicalBackend
+from components import patient_selector
 
 st.set_page_config(page_title="Add Records", page_icon="➕", layout="wide")
 
@@ -9,7 +10,7 @@ def main():
     backend = ClinicalBackend()
     st.markdown('<h1 class="main-header">Clinical Records Management</h1>', unsafe_allow_html=True)
     
-    tab1, tab2 = st.tabs(["Add New Patient", "Schedule Appointment"])
+    tab1, tab2, tab3 = st.tabs(["Add New Patient", "Schedule Appointment", "Record Lab Result"])
     
     # --- Add Patient Tab ---
     with tab1:
@@ -62,14 +63,10 @@ def main():
         st.subheader("Schedule Appointment")
         
         # Select existing patient
-        all_patients = backend.get_all_patients()
-        if all_patients.empty:
-            st.error("No patients in database. Please add a patient first.")
+        pt_id = patient_selector(backend, st, key="appt_patient")
+        if pt_id is None:
+            st.error("No matching patients. Adjust the search or add a patient first.")
         else:
-            patient_list = all_patients.apply(lambda x: f"{x['patient_id']} - {x['first_name']} {x['last_name']}", axis=1)
-            selected_pt = st.selectbox("Select Patient", patient_list)
-            pt_id = selected_pt.split(" - ")[0]
-            
             with st.form("appointment_form"):
                 col1, col2 = st.columns(2)
                 with col1:
@@ -97,5 +94,54 @@ def main():
                     else:
                         st.error(f"Error: {msg}")
 
+    # --- Add Lab Result Tab ---
+    with tab3:
+        st.subheader("Record Lab Result")
+        
+        lab_pt_id = patient_selector(backend, st, key="lab_patient")
+        if lab_pt_id is None:
+            st.error("No matching patients. Adjust the search or add a patient first.")
+        else:
+            with st.form("lab_result_form"):
+                col1, col2 = st.columns(2)
+                with col1:
+                    result_date = st.date_input("Result Date", max_value=date.today())
+                    test_name = st.text_input("Test Name", placeholder="e.g., Glucose")
+                    value = st.number_input("Value", format="%.2f")
+                    unit = st.text_input("Unit", placeholder="e.g., mg/dL")
+                with col2:
+                    ref_low = st.number_input("Reference Low", value=None, format="%.2f", placeholder="optional")
+                    ref_high = st.number_input("Reference High", value=None, format="%.2f", placeholder="optional")
+                    
+                submitted_lab = st.form_submit_button("Save Lab Result")
+                
+                if submitted_lab:
+                    if test_name:
+                        # Empty or 0 means the bound wasn't given; compare only against those that were
+                        ref_low = ref_low or None
+                        ref_high = ref_high or None
+                        interpretation = 'Normal'
+                        if ref_high is not None and value > ref_high:
+                            interpretation = 'High'
+                        elif ref_low is not None and value < ref_low:
+                            interpretation = 'Low'
+                        lab_data = {
+                            'patient_id': lab_pt_id,
+                            'result_date': str(result_date),
+                            'test_name': test_name,
+                            'value': value,
+                            'unit': unit,
+                            'reference_low': ref_low,
+                            'reference_high': ref_high,
+                            'interpretation': interpretation
+                        }
+                        success, msg = backend.add_lab_result(lab_data)
+                        if success:
+                            st.success(f"Success: {msg}")
+                        else:
+                            st.error(f"Error: {msg}")
+                    else:
+                        st.warning("Please enter the test name")
+
 if __name__ == "__main__":
     main()
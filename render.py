@@ -0,0 +1,90 @@
+import string
+import pandas as pd
+
+import tracing
+
+# Vectorized markdown rendering for DataFrames.
+#
+# Templates use str.format syntax with column names as fields, e.g.
+# "{test_name}: {value} {unit}". Rather than building a Series per row with
+# iterrows and growing a string with +=, each referenced column is pulled
+# out once (datetime columns are strftime-formatted as a whole column), the
+# template is compiled to a single positional format string, and the lines
+# are joined a single time at the end. Values print exactly as they would in
+# an f-string; datetime columns accept strftime specs ("{result_date:%Y-%m-%d}").
+
+_formatter = string.Formatter()
+
+
+def _escape(literal):
+    return literal.replace('{', '{{').replace('}', '}}')
+
+
+def format_rows(df, template):
+    """Format every row of `df` with `template`; returns a list of strings"""
+    if df.empty:
+        return []
+    with tracing.span('render', rows=len(df)):
+        return _format_rows(df, template)
+
+
+def _format_rows(df, template):
+    pieces, columns = [], []
+    for literal, field, spec, conversion in _formatter.parse(template):
+        pieces.append(_escape(literal))
+        if field is None:
+            continue
+        if conversion:
+            raise ValueError(f"Conversions are not supported in templates: {template!r}")
+
+        values = df[field]
+        if spec and pd.api.types.is_datetime64_any_dtype(values):
+            text = values.dt.strftime(spec)
+            if values.hasnans:
+                text = text.where(values.notna(), 'NaT')
+            columns.append(text.tolist())
+            spec = ''
+        else:
+            columns.append(values.tolist())
+        pieces.append('{%d%s}' % (len(columns) - 1, ':' + spec if spec else ''))
+
+    fmt = ''.join(pieces).format
+    if not columns:
+        # Template without fields - same text for every row
+        return [fmt()] * len(df)
+    return [fmt(*row) for row in zip(*columns)]
+
+
+def render_rows(df, template, sep='\n'):
+    """Render `df` as lines of `template` joined by `sep`"""
+    return sep.join(format_rows(df, template))
+
+
+def render_bullets(df, template, bullet='- '):
+    """Render `df` as a markdown bullet list, one line per row (trailing newline)"""
+    if df.empty:
+        return ''
+    return render_rows(df, bullet + template) + '\n'
+
+
+def render_table(df, columns):
+    """Render `df` as a markdown table.
+
+    `columns` maps header text to a cell template, e.g.
+    {'Date': '{result_date:%Y-%m-%d}', 'Value': '{value} {unit}'}.
+    """
+    return render_table_header(columns) + render_table_rows(df, columns)
+
+
+def render_table_header(columns):
+    """Header and separator lines of a render_table table"""
+    headers = list(columns)
+    return '| ' + ' | '.join(headers) + ' |\n' + '|' + '---|' * len(headers) + '\n'
+
+
+def render_table_rows(df, columns):
+    """Body lines of a render_table table; chunks of rows concatenate into one table"""
+    if df.empty:
+        return ''
+    row_template = '| ' + ' | '.join(columns[h] for h in columns) + ' |'
+    return render_rows(df, row_template) + '\n'
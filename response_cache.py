@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from cache import _sizeof
+from database import DB_NAME
+
+# Cache of finished answers to free-text questions.
+#
+# Keys are built from the *parsed* question - patient, intent, matched
+# tags, resolved test set and time window - not from the raw text, so
+# "show glucose trend last 2 years" and "glucose last 2 years trend" share
+# one entry. Callers include the patient's data version (DataCache.version)
+# in the key: a write bumps it, and the patient's older answers are simply
+# never looked up again and age out of the LRU. Entries also expire after
+# `ttl` seconds, which bounds how stale an answer can get when the data
+# changes behind the cache's back (e.g. another process writing).
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_TTL = 10 * 60     # seconds
+
+
+def _copy(value):
+    # Answers may carry DataFrames (chatbot responses); hand out copies
+    if isinstance(value, dict):
+        return {k: v.copy() if isinstance(v, pd.DataFrame) else v for k, v in value.items()}
+    return value
+
+
+class ResponseCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()     # key -> (value, size, expires)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get_or_compute(self, key, compute):
+        """Cached answer for `key` (hashable), computing and storing it on a miss"""
+        found, value = self.lookup(key)
+        if found:
+            return value
+        return self.put(key, compute())
+
+    def lookup(self, key):
+        """(True, answer) on a hit, (False, None) on a miss; counts either way"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[2] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, _copy(entry[0])
+                self._drop(key)
+                self.expired += 1
+            self.misses += 1
+        return False, None
+
+    def put(self, key, value):
+        """Store an answer computed after a missed lookup; returns a copy of it"""
+        size = _sizeof(value)
+        with self._lock:
+            if size <= self.max_bytes:
+                if key in self._entries:
+                    self._drop(key)
+                self._entries[key] = (value, size, time.monotonic() + self.ttl)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    self._drop(next(iter(self._entries)))
+                    self.evictions += 1
+        return _copy(value)
+
+    def _drop(self, key):
+        self._bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache(db_name=DB_NAME):
+    """Process-wide response cache for `db_name`, created on first use"""
+    with _caches_lock:
+        cache = _caches.get(db_name)
+        if cache is None:
+            cache = ResponseCache()
+            _caches[db_name] = cache
+        return cache
@@ -0,0 +1,373 @@
+import json
+import math
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import zlib
+
+import numpy as np
+
+from bootstrap import file_lock, stored_fingerprint
+from database import DB_NAME
+from db_pool import get_pool
+
+# Passage retrieval over clinical notes and per-patient records.
+#
+# Notes are cut into overlapping word windows (prefixed with the note's
+# title, type and date) and every lab result, medication, vital sign and
+# appointment becomes a one-line passage. Passages are indexed for BM25
+# under hashed term ids (crc32 of the lower-cased token), so there is no
+# vocabulary to keep in step between segments.
+#
+# The index lives in `<db>.retrieval/` as segments of .npy arrays plus the
+# passage text, all memory-mapped on load, so opening it costs nothing and
+# nothing is rebuilt at startup. Per segment:
+#   terms / offsets / docs / tfs - postings grouped by term (CSR)
+#   length / patient / source / row_id - one entry per passage
+#   text.bin / text_offsets - the passage text
+# refresh() follows the columnar mirror's scheme: _manifest.json keeps the
+# highest rowid indexed and the row count per source table; rows past the
+# mark become a new segment, and a count mismatch (rows deleted), a rebuilt
+# database (bootstrap fingerprint changed) or MAX_SEGMENTS appends trigger a
+# full rebuild into a side directory. Updates in place are not detected;
+# refresh(full=True) rebuilds everything.
+
+# source -> (SQL over after < rowid <= upto, text template); sources whose table or
+# columns are missing from the database are skipped
+SOURCES = {
+    'note': ("""SELECT rowid AS row_id, patient_id, note_date, note_type, title, content FROM clinical_notes
+        WHERE rowid > ? AND rowid <= ? ORDER BY rowid""", None),
+    'lab': ("""SELECT rowid AS row_id, patient_id, test_name, value, unit, interpretation, result_date FROM lab_results
+        WHERE rowid > ? AND rowid <= ? ORDER BY rowid""", "{test_name} {value} {unit} ({interpretation}) on {result_date}"),
+    'medication': ("""SELECT rowid AS row_id, patient_id, medication_name, dosage, frequency, status, start_date FROM medications
+        WHERE rowid > ? AND rowid <= ? ORDER BY rowid""", "{medication_name} {dosage} {frequency} - {status} since {start_date}"),
+    'vitals': ("""SELECT rowid AS row_id, patient_id, measurement_date, systolic_bp, diastolic_bp, heart_rate, weight_kg, bmi
+        FROM vital_signs WHERE rowid > ? AND rowid <= ? ORDER BY rowid""",
+               "Vitals on {measurement_date}: BP {systolic_bp}/{diastolic_bp} mmHg, HR {heart_rate} bpm, "
+               "weight {weight_kg} kg, BMI {bmi}"),
+    'appointment': ("""SELECT rowid AS row_id, patient_id, appointment_date, doctor_name, reason, status, notes FROM appointments
+        WHERE rowid > ? AND rowid <= ? ORDER BY rowid""", "Appointment {appointment_date} with {doctor_name}: {reason} ({status}). {notes}"),
+}
+SOURCE_NAMES = list(SOURCES)
+PASSAGE_COLUMNS = ['score', 'patient_id', 'source', 'row_id', 'text']
+SOURCE_TABLES = {'note': 'clinical_notes', 'lab': 'lab_results', 'medication': 'medications',
+                 'vitals': 'vital_signs', 'appointment': 'appointments'}
+
+CHUNK_WORDS = 50
+CHUNK_OVERLAP = 15
+BATCH_ROWS = 50_000
+MAX_SEGMENTS = 8
+K1, B = 1.2, 0.75
+MANIFEST = '_manifest.json'
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+# Dropped from queries only ("what do the notes say about neuropathy")
+STOPWORDS = frozenset("""a about an and any are as at be by did do does for from had has have he her his in
+    is it me mention mentioned note notes of on or say says she show tell that the their them there this to
+    was were what when where which who with""".split())
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def query_terms(query):
+    """Tokens of a query, minus stopwords"""
+    return [t for t in tokenize(query) if t not in STOPWORDS]
+
+
+def term_ids(tokens):
+    return np.array([zlib.crc32(t.encode()) for t in tokens], dtype=np.uint32)
+
+
+def chunk_note(row):
+    """Overlapping word windows of a note, each prefixed with its header"""
+    header = f"{row['title']} ({row['note_type']}, {row['note_date']}): "
+    words = (row['content'] or '').split()
+    step = CHUNK_WORDS - CHUNK_OVERLAP
+    return [header + ' '.join(words[start:start + CHUNK_WORDS])
+            for start in range(0, max(len(words) - CHUNK_OVERLAP, 1), step)]
+
+
+def _passages(row, source):
+    template = SOURCES[source][1]
+    if template is None:
+        return chunk_note(row)
+    return [template.format(**{k: row[k] for k in row.keys()})]
+
+
+class _Segment:
+    """One memory-mapped segment of the index"""
+
+    ARRAYS = ('terms', 'offsets', 'docs', 'tfs', 'length', 'patient', 'source', 'row_id', 'text_offsets')
+
+    def __init__(self, path):
+        for name in self.ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+        self.text = np.memmap(os.path.join(path, 'text.bin'), dtype=np.uint8, mode='r') \
+            if os.path.getsize(os.path.join(path, 'text.bin')) else np.zeros(0, dtype=np.uint8)
+
+    def postings(self, term):
+        i = np.searchsorted(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            return None, None
+        return self.docs[self.offsets[i]:self.offsets[i + 1]], self.tfs[self.offsets[i]:self.offsets[i + 1]]
+
+    def passage(self, doc):
+        return bytes(self.text[self.text_offsets[doc]:self.text_offsets[doc + 1]]).decode('utf-8')
+
+
+def _write_segment(path, passages):
+    """passages: list of (patient code, source code, row_id, text)"""
+    os.makedirs(path)
+    term_lists, lengths = [], []
+    for _, _, _, text in passages:
+        ids = term_ids(tokenize(text))
+        term_lists.append(ids)
+        lengths.append(len(ids))
+    n_tokens = sum(lengths)
+    all_terms = np.concatenate(term_lists) if n_tokens else np.zeros(0, dtype=np.uint32)
+    all_docs = np.repeat(np.arange(len(passages), dtype=np.int32), lengths)
+    # (term, doc) pairs -> term frequencies, grouped by term
+    pairs, tfs = np.unique(np.stack([all_terms.astype(np.int64), all_docs]), axis=1, return_counts=True)
+    terms, starts = np.unique(pairs[0], return_index=True)
+    encoded = [text.encode('utf-8') for _, _, _, text in passages]
+    arrays = {
+        'terms': terms.astype(np.uint32),
+        'offsets': np.append(starts, pairs.shape[1]).astype(np.int64),
+        'docs': pairs[1].astype(np.int32),
+        'tfs': np.minimum(tfs, np.iinfo(np.uint16).max).astype(np.uint16),
+        'length': np.array(lengths, dtype=np.int32),
+        'patient': np.array([p[0] for p in passages], dtype=np.int32),
+        'source': np.array([p[1] for p in passages], dtype=np.int8),
+        'row_id': np.array([p[2] for p in passages], dtype=np.int64),
+        'text_offsets': np.concatenate([[0], np.cumsum([len(t) for t in encoded])]).astype(np.int64),
+    }
+    for name, values in arrays.items():
+        np.save(os.path.join(path, name + '.npy'), values)
+    with open(os.path.join(path, 'text.bin'), 'wb') as f:
+        f.write(b''.join(encoded))
+    return n_tokens
+
+
+class PassageIndex:
+    def __init__(self, db_path=DB_NAME, root=None, pool=None):
+        self.db_path = db_path
+        self.root = root or os.path.splitext(db_path)[0] + '.retrieval'
+        self.pool = pool or get_pool(db_path)
+        self._lock = threading.Lock()
+        self._manifest = None
+        self._segments = []
+        os.makedirs(self.root, exist_ok=True)
+
+    # --- Manifest ---
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.root, MANIFEST), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self, manifest):
+        path = os.path.join(self.root, MANIFEST)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(path + '.tmp', path)
+
+    def _load(self, manifest):
+        segments = [_Segment(os.path.join(self.root, name)) for name in manifest.get('segments', [])]
+        with self._lock:
+            self._manifest = manifest
+            self._segments = segments
+            self._patient_codes = {p: i for i, p in enumerate(manifest.get('patients', []))}
+
+    # --- Build ---
+
+    def _sources(self, conn):
+        """Sources whose query runs on this database"""
+        usable = []
+        for source, (sql, _) in SOURCES.items():
+            try:
+                conn.execute(sql + " LIMIT 0", [0, 0])
+            except sqlite3.OperationalError:
+                continue
+            usable.append(source)
+        return usable
+
+    def _collect(self, conn, marks, upto, patients, codes):
+        """Passages of every source row past `marks[source]` up to `upto[source]`"""
+        passages = []
+        for source, after in marks.items():
+            cursor = conn.execute(SOURCES[source][0], [after, upto[source]])
+            cursor.row_factory = sqlite3.Row
+            while True:
+                rows = cursor.fetchmany(BATCH_ROWS)
+                if not rows:
+                    break
+                for row in rows:
+                    patient_id = row['patient_id']
+                    code = codes.get(patient_id)
+                    if code is None:
+                        code = codes[patient_id] = len(patients)
+                        patients.append(patient_id)
+                    for text in _passages(row, source):
+                        passages.append((code, SOURCE_NAMES.index(source), row['row_id'], text))
+        return passages
+
+    def refresh(self, full=False):
+        """Index rows added since the last refresh; returns the number of new passages"""
+        with file_lock(os.path.join(self.root, '.lock')), self.pool.reader() as conn:
+            manifest = self._read_manifest()
+            identity = stored_fingerprint(self.db_path)
+            sources = self._sources(conn)
+            state = {s: conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {SOURCE_TABLES[s]}").fetchone()[0]
+                     for s in sources}
+            entries = manifest.get('sources', {})
+            current = (not full and manifest.get('identity') == identity
+                       and set(entries) == set(sources))
+            if current and all(entries[s]['hwm'] == state[s] for s in sources):
+                if self._manifest != manifest:
+                    self._load(manifest)
+                return 0
+
+            # Reads are bounded by `state`: rows inserted while this runs are
+            # left for the next refresh instead of being indexed twice
+            counts = {s: conn.execute(f"SELECT COUNT(*) FROM {SOURCE_TABLES[s]} WHERE rowid <= ?",
+                                      [state[s]]).fetchone()[0] for s in sources}
+            append = current and len(manifest['segments']) < MAX_SEGMENTS and all(
+                entries[s]['rows'] + conn.execute(f"SELECT COUNT(*) FROM {SOURCE_TABLES[s]} WHERE rowid > ? AND rowid <= ?",
+                                                  [entries[s]['hwm'], state[s]]).fetchone()[0] == counts[s]
+                for s in sources)
+            if append:
+                marks = {s: entries[s]['hwm'] for s in sources}
+                patients = list(manifest['patients'])
+            else:
+                marks = dict.fromkeys(sources, 0)
+                patients = []
+            codes = {p: i for i, p in enumerate(patients)}
+            passages = self._collect(conn, marks, state, patients, codes)
+
+            # A rebuild is written beside the live segments, which are retired after
+            name = f"seg-{manifest.get('next_segment', 0):05d}"
+            n_tokens = _write_segment(os.path.join(self.root, name), passages)
+            if append:
+                segments = manifest['segments'] + [name]
+                n_docs, n_tokens = manifest['n_docs'] + len(passages), manifest['n_tokens'] + n_tokens
+                old = []
+            else:
+                segments = [name]
+                n_docs = len(passages)
+                old = manifest.get('segments', [])
+            manifest = {
+                'identity': identity,
+                'sources': {s: {'hwm': state[s], 'rows': counts[s]} for s in sources},
+                'segments': segments,
+                'next_segment': manifest.get('next_segment', 0) + 1,
+                'patients': patients,
+                'n_docs': n_docs,
+                'n_tokens': n_tokens,
+            }
+            self._write_manifest(manifest)
+            for stale in old:
+                # Readers may still have the old files mapped (Windows refuses to delete them)
+                shutil.rmtree(os.path.join(self.root, stale), ignore_errors=True)
+        self._load(manifest)
+        return len(passages)
+
+    # --- Search ---
+
+    def _current(self):
+        with self._lock:
+            if self._manifest is not None:
+                return self._manifest, self._segments, self._patient_codes
+        manifest = self._read_manifest()
+        if not manifest:
+            return None, [], {}
+        self._load(manifest)
+        with self._lock:
+            return self._manifest, self._segments, self._patient_codes
+
+    def search(self, query, patient_id=None, k=5, sources=None):
+        """Top-k passages for `query` by BM25, for one patient or the whole clinic.
+
+        Returns a list of {'score', 'patient_id', 'source', 'row_id', 'text'}
+        dicts, best first; empty when nothing matches.
+        """
+        manifest, segments, codes = self._current()
+        if not manifest or not manifest['n_docs']:
+            return []
+        patient_code = None
+        if patient_id is not None:
+            patient_code = codes.get(patient_id)
+            if patient_code is None:
+                return []
+        source_codes = None if sources is None else [SOURCE_NAMES.index(s) for s in sources]
+        terms = np.unique(term_ids(query_terms(query)))
+        if not len(terms):
+            return []
+
+        n_docs = manifest['n_docs']
+        avgdl = manifest['n_tokens'] / n_docs
+        hits = []
+        # Document frequencies are global, across segments
+        postings = [[seg.postings(t) for seg in segments] for t in terms]
+        for s, seg in enumerate(segments):
+            matched, contributions = [], []
+            for per_segment in postings:
+                docs, tfs = per_segment[s]
+                if docs is None:
+                    continue
+                keep = np.ones(len(docs), dtype=bool)
+                if patient_code is not None:
+                    keep &= seg.patient[docs] == patient_code
+                if source_codes is not None:
+                    keep &= np.isin(seg.source[docs], source_codes)
+                docs, tf = docs[keep], tfs[keep].astype(np.float32)
+                df = sum(len(p[0]) for p in per_segment if p[0] is not None)
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                norm = K1 * (1 - B + B * seg.length[docs] / avgdl)
+                matched.append(docs)
+                contributions.append(idf * tf * (K1 + 1) / (tf + norm))
+            if not matched:
+                continue
+            docs, inverse = np.unique(np.concatenate(matched), return_inverse=True)
+            if not len(docs):
+                continue
+            scores = np.bincount(inverse, weights=np.concatenate(contributions))
+            best = np.arange(len(docs))
+            if len(best) > k:
+                best = np.argpartition(-scores, k - 1)[:k]
+            hits.extend((float(scores[i]), s, int(docs[i])) for i in best)
+
+        # Ties go to the most recently added passage
+        hits.sort(key=lambda h: (-h[0], -h[1], -h[2]))
+        patients = manifest['patients']
+        return [{
+            'score': score,
+            'patient_id': patients[segments[s].patient[d]],
+            'source': SOURCE_NAMES[segments[s].source[d]],
+            'row_id': int(segments[s].row_id[d]),
+            'text': segments[s].passage(d),
+        } for score, s, d in hits[:k]]
+
+    def stats(self):
+        manifest, segments, _ = self._current()
+        if not manifest:
+            return {'passages': 0, 'segments': 0, 'patients': 0}
+        return {'passages': manifest['n_docs'], 'segments': len(segments), 'patients': len(manifest['patients'])}
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(db_path=DB_NAME):
+    """Process-wide passage index of `db_path`, created on first use"""
+    with _indexes_lock:
+        index = _indexes.get(db_path)
+        if index is None:
+            index = PassageIndex(db_path)
+            _indexes[db_path] = index
+        return index
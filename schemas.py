@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+
+import tracing
+
+# Declared dtypes for the DataFrames ClinicalBackend returns.
+#
+# sqlite3 hands back every TEXT cell as a Python string, and the date
+# columns would otherwise stay strings that callers re-parse. Reads are
+# typed once at load instead:
+#
+# - 'date': datetime64, parsed from the stored 'YYYY-MM-DD' text (anything
+#   unparseable becomes NaT)
+# - 'category': low-cardinality text (test names, units, statuses, doctors)
+# - int16 / int32: narrower integers, applied only when the column has no
+#   NULLs and every value fits
+#
+# Measured values (value, reference ranges, trend figures) stay float64:
+# they are printed through Python's float repr, where a float32 5.7 would
+# show as 5.699999809265137. Columns not listed keep the dtype pandas gave
+# them. See benchmarks/dtypes.py for the memory footprint before and after.
+
+TABLE_SCHEMAS = {
+    'patients': {
+        'date_of_birth': 'date',
+        'age': 'int16',
+        'gender': 'category',
+        'primary_diagnosis': 'category',
+        'allergies': 'category',
+        'last_visit': 'date',
+    },
+    'appointments': {
+        'id': 'int32',
+        'patient_id': 'category',
+        'appointment_date': 'date',
+        'doctor_name': 'category',
+        'reason': 'category',
+        'status': 'category',
+    },
+    'medications': {
+        'id': 'int32',
+        'patient_id': 'category',
+        'medication_name': 'category',
+        'dosage': 'category',
+        'frequency': 'category',
+        'start_date': 'date',
+        'end_date': 'date',
+        'status': 'category',
+    },
+    'lab_results': {
+        'id': 'int32',
+        'patient_id': 'category',
+        'result_date': 'date',
+        'test_name': 'category',
+        'unit': 'category',
+        'interpretation': 'category',
+    },
+    'lab_trend_summary': {
+        'patient_id': 'category',
+        'test_name': 'category',
+        'unit': 'category',
+        'n': 'int32',
+        'first_date': 'date',
+        'latest_date': 'date',
+    },
+}
+
+
+def _fits(values, dtype):
+    if values.hasnans or not pd.api.types.is_integer_dtype(values):
+        return False
+    info = np.iinfo(dtype)
+    return values.empty or (info.min <= values.min() and values.max() <= info.max)
+
+
+def apply_schema(df, table):
+    """Convert the columns of `df` declared for `table` in place; returns `df`"""
+    with tracing.span('apply_schema', table=table, rows=len(df)):
+        for column, dtype in TABLE_SCHEMAS.get(table, {}).items():
+            if column not in df:
+                continue
+            values = df[column]
+            if dtype == 'date':
+                if not pd.api.types.is_datetime64_any_dtype(values):
+                    df[column] = pd.to_datetime(values, format='ISO8601', errors='coerce')
+            elif dtype == 'category':
+                df[column] = values.astype('category')
+            elif _fits(values, dtype):
+                df[column] = values.astype(dtype)
+    return df
+
+
+def format_date(value, spec='%Y-%m-%d', missing='N/A'):
+    """A single date from a typed row as text (`missing` for NULL / NaT)"""
+    if value is None or pd.isna(value):
+        return missing
+    return format(pd.Timestamp(value), spec)
@@ -0,0 +1,266 @@
+import threading
+import warnings
+
+import numpy as np
+
+from bootstrap import stored_fingerprint
+from database import DB_NAME
+from db_pool import get_pool
+
+# "Similar patients": nearest neighbours over per-patient lab feature vectors.
+#
+# The feature matrix is pivoted from lab_trend_summary (kept current by
+# triggers, one row per patient and test) rather than from lab_results, so
+# building it never scans the lab history. Per test it holds the latest
+# value, the mean and the least-squares slope per year (the trajectory);
+# age is the last column. Each column is z-scored and missing values are
+# imputed with the column mean (0 after scaling), so a patient who never
+# had a test is neither near nor far on it.
+#
+# Search is brute force and vectorized: squared distances to every row from
+# one matrix-vector product against the precomputed row norms, then an
+# argpartition for the top k - about 10-20 ms at 500k patients (see
+# `python -m benchmarks.similarity`). `same_diagnosis` masks candidates by
+# primary diagnosis code.
+#
+# The index lives in memory, one per database (get_index). refresh() takes
+# the columnar mirror's approach: it remembers the highest lab_results and
+# patients rowid seen, and re-pivots only the patients with rows past the
+# marks - on copies of the arrays, swapped in whole, since searches don't
+# take the lock. A count mismatch (rows deleted), a new test name or a
+# rebuilt database (bootstrap fingerprint changed) triggers a full rebuild;
+# updates in place are not detected, refresh(full=True) rebuilds everything.
+# Scaling stats are fixed at the full build; re-pivoted rows are scaled
+# with them, which a few new labs don't move measurably.
+
+FEATURES = ('latest', 'mean', 'slope')
+BATCH_PATIENTS = 500
+BATCH_ROWS = 100_000
+TABLES = ('lab_results', 'patients')
+# value units per day -> per year, as in get_lab_trends
+_SLOPE_SQL = """CASE WHEN n > 1 AND n * sum_xx - sum_x * sum_x > 0
+    THEN (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x * sum_x) * 365.25 END"""
+_TRENDS_SQL = f"""SELECT patient_id, test_name, latest_value, sum_y / n, {_SLOPE_SQL}
+    FROM lab_trend_summary"""
+_PATIENTS_SQL = "SELECT patient_id, age, primary_diagnosis FROM patients"
+
+
+def _ids_sql(sql, n):
+    return sql + f" WHERE patient_id IN ({', '.join('?' * n)})"
+
+
+class SimilarityIndex:
+    def __init__(self, db_path=DB_NAME, pool=None):
+        self.db_path = db_path
+        self.pool = pool or get_pool(db_path)
+        self._lock = threading.Lock()
+        self._state = None
+        self._marks = None
+        self._counts = None
+
+    # --- Build ---
+
+    def _marks_now(self, conn):
+        return {table: conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}").fetchone()[0] for table in TABLES}
+
+    def _fill(self, rows, tests, ids, raw):
+        """Scatter lab_trend_summary rows into `raw`, skipping unknown patients; False on an unknown test"""
+        if not rows:
+            return True
+        patient_ids, test_names, *values = zip(*rows)
+        columns = {test: i * len(FEATURES) for i, test in enumerate(tests)}
+        try:
+            column = np.array([columns[test] for test in test_names], dtype=np.intp)
+        except KeyError:
+            return False
+        row = np.array([ids.get(p, -1) for p in patient_ids], dtype=np.intp)
+        keep = row >= 0
+        row, column = row[keep], column[keep]
+        values = np.array(values, dtype=np.float32)[:, keep]     # NULL -> NaN
+        for i in range(len(FEATURES)):
+            raw[row, column + i] = values[i]
+        return True
+
+    def _build(self, conn):
+        tests = [row[0] for row in conn.execute("SELECT DISTINCT test_name FROM lab_trend_summary ORDER BY test_name")]
+        people = conn.execute(_PATIENTS_SQL + " ORDER BY patient_id").fetchall()
+        patients = [row[0] for row in people]
+        ids = {p: i for i, p in enumerate(patients)}
+        raw = np.full((len(patients), len(tests) * len(FEATURES) + 1), np.nan, dtype=np.float32)
+        raw[:, -1] = np.array([row[1] for row in people], dtype=np.float32)
+        cursor = conn.execute(_TRENDS_SQL)
+        while True:
+            rows = cursor.fetchmany(BATCH_ROWS)
+            if not rows:
+                break
+            self._fill(rows, tests, ids, raw)
+        diagnoses = sorted({str(row[2]) for row in people})
+        codes = {d: i for i, d in enumerate(diagnoses)}
+        diagnosis = np.array([codes[str(row[2])] for row in people], dtype=np.int32)
+        return self._scale({'tests': tests, 'patients': patients, 'ids': ids, 'raw': raw,
+                            'diagnoses': diagnoses, 'diagnosis': diagnosis})
+
+    def _update(self, conn, state, marks):
+        """Re-pivot patients with lab or patient rows past the marks.
+
+        Returns (state, patients re-pivoted), or None if a rebuild is needed.
+        Writes go to copies of the arrays (new patients are appended to
+        them), so searches in flight keep consistent arrays until refresh()
+        swaps the new state in.
+        """
+        changed = {row[0] for row in conn.execute(
+            "SELECT patient_id FROM lab_results WHERE rowid > ?", [marks['lab_results']])}
+        changed |= {row[0] for row in conn.execute(
+            "SELECT patient_id FROM patients WHERE rowid > ?", [marks['patients']])}
+        batch = sorted(changed)
+        people = []
+        for i in range(0, len(batch), BATCH_PATIENTS):
+            chunk = batch[i:i + BATCH_PATIENTS]
+            people += conn.execute(_ids_sql(_PATIENTS_SQL, len(chunk)), chunk).fetchall()
+        new = [row[0] for row in people if row[0] not in state['ids']]
+        state = dict(state, diagnoses=list(state['diagnoses']))
+        if not new:
+            for key in ('raw', 'scaled', 'norms', 'diagnosis'):
+                state[key] = state[key].copy()
+        else:
+            state.update(patients=state['patients'] + new, ids=dict(state['ids']))
+            state['ids'].update((p, i) for i, p in enumerate(new, len(state['ids'])))
+            width = state['raw'].shape[1]
+            state['raw'] = np.vstack([state['raw'], np.full((len(new), width), np.nan, dtype=np.float32)])
+            state['scaled'] = np.vstack([state['scaled'], np.zeros((len(new), width), dtype=np.float32)])
+            state['norms'] = np.concatenate([state['norms'], np.zeros(len(new), dtype=np.float32)])
+            state['diagnosis'] = np.concatenate([state['diagnosis'], np.zeros(len(new), dtype=np.int32)])
+        ids, raw, diagnoses = state['ids'], state['raw'], state['diagnoses']
+        rows = np.array([ids[row[0]] for row in people], dtype=np.intp)
+        raw[rows] = np.nan
+        raw[rows, -1] = np.array([row[1] for row in people], dtype=np.float32)
+        codes = {d: i for i, d in enumerate(diagnoses)}
+        for row, (_, _, primary_diagnosis) in zip(rows, people):
+            if str(primary_diagnosis) not in codes:
+                codes[str(primary_diagnosis)] = len(diagnoses)
+                diagnoses.append(str(primary_diagnosis))
+            state['diagnosis'][row] = codes[str(primary_diagnosis)]
+        for i in range(0, len(batch), BATCH_PATIENTS):
+            chunk = batch[i:i + BATCH_PATIENTS]
+            if not self._fill(conn.execute(_ids_sql(_TRENDS_SQL, len(chunk)), chunk).fetchall(),
+                              state['tests'], ids, raw):
+                return None
+        self._rescale(state, rows)
+        return state, len(people)
+
+    @staticmethod
+    def _scale(state):
+        """Per-column stats, z-scored matrix (missing -> 0) and row norms"""
+        raw = state['raw']
+        with warnings.catch_warnings():
+            # all-NaN columns (a test nobody has yet) are fine
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean = np.nanmean(raw, axis=0)
+            std = np.nanstd(raw, axis=0)
+        state['mean'] = np.nan_to_num(mean).astype(np.float32)
+        state['std'] = np.where(np.isfinite(std) & (std > 0), std, 1).astype(np.float32)
+        state['scaled'] = np.nan_to_num((raw - state['mean']) / state['std']).astype(np.float32)
+        state['norms'] = np.einsum('ij,ij->i', state['scaled'], state['scaled'])
+        return state
+
+    @staticmethod
+    def _rescale(state, rows):
+        """Re-scale `rows` with the stats of the last full build"""
+        scaled = np.nan_to_num((state['raw'][rows] - state['mean']) / state['std'])
+        state['scaled'][rows] = scaled
+        state['norms'][rows] = np.einsum('ij,ij->i', scaled, scaled)
+
+    def refresh(self, full=False):
+        """Pick up labs and patients added since the last refresh; returns the number of patients re-pivoted"""
+        with self._lock, self.pool.reader() as conn:
+            identity = stored_fingerprint(self.db_path)
+            marks = self._marks_now(conn)
+            state = self._state
+            current = not full and state is not None and state['identity'] == identity
+            if current and marks == self._marks:
+                return 0
+            counts = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in TABLES}
+            updated = None
+            if current:
+                # Counts only grow by the rows past the marks if nothing was deleted
+                appended = all(self._counts[t] + conn.execute(f"SELECT COUNT(*) FROM {t} WHERE rowid > ?",
+                                                              [self._marks[t]]).fetchone()[0] == counts[t]
+                               for t in TABLES)
+                if appended:
+                    updated = self._update(conn, state, self._marks)
+            if updated is None:
+                updated = self._build(conn)
+                n = len(updated['patients'])
+            else:
+                updated, n = updated
+            updated['identity'] = identity
+            self._state = updated
+            self._marks, self._counts = marks, counts
+        return n
+
+    # --- Search ---
+
+    def similar(self, patient_id, k=10, same_diagnosis=False):
+        """Top-k most similar patients as [{'patient_id', 'distance'}], nearest first.
+
+        Distance is Euclidean over the z-scored features; the patient
+        themselves is excluded. Empty if the patient is not indexed.
+        """
+        state = self._state
+        if state is None:
+            self.refresh()
+            state = self._state
+        row = state['ids'].get(patient_id)
+        if row is None:
+            return []
+        scaled, norms = state['scaled'], state['norms']
+        query = scaled[row]
+        distances = norms - 2 * (scaled @ query) + norms[row]
+        distances[row] = np.inf
+        if same_diagnosis:
+            distances[state['diagnosis'] != state['diagnosis'][row]] = np.inf
+        k = min(k, int(np.isfinite(distances).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+        # nearest first; ties in index order (patient ID, then patients added since the build)
+        top = top[np.lexsort((top, distances[top]))]
+        patients = state['patients']
+        return [{'patient_id': patients[i], 'distance': float(np.sqrt(max(distances[i], 0)))} for i in top]
+
+    def features(self, patient_id):
+        """Unscaled feature vector of a patient as {name: value} (NaN when missing)"""
+        state = self._state
+        if state is None:
+            self.refresh()
+            state = self._state
+        row = state['ids'].get(patient_id)
+        if row is None:
+            return {}
+        return dict(zip(self.feature_names(), state['raw'][row].tolist()))
+
+    def feature_names(self):
+        state = self._state
+        if state is None:
+            return []
+        return [f"{test} {feature}" for test in state['tests'] for feature in FEATURES] + ['age']
+
+    def stats(self):
+        state = self._state
+        if state is None:
+            return {'patients': 0, 'features': 0}
+        return {'patients': len(state['patients']), 'features': state['raw'].shape[1]}
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(db_path=DB_NAME):
+    """Process-wide similarity index of `db_path`, created on first use"""
+    with _indexes_lock:
+        index = _indexes.get(db_path)
+        if index is None:
+            index = SimilarityIndex(db_path)
+            _indexes[db_path] = index
+        return index
@@ -0,0 +1,250 @@
+import argparse
+import json
+import threading
+import time
+from datetime import datetime
+
+from database import DB_NAME
+from db_pool import get_pool
+
+# Per-patient clinical summary snapshots (patient_summary, migration 5).
+#
+# A snapshot is the JSON of everything the patient summary shows or is
+# judged by: demographics, active medications, the most recent labs and
+# appointments, the latest value of every test, abnormal counts and BP /
+# HbA1c control status. Reading a summary is then one primary-key lookup
+# instead of four per-patient queries and the pandas work on top.
+#
+# Triggers bump patient_summary.version on every write to the patient's
+# rows; a snapshot is current while snapshot_version = version. Stale
+# snapshots are rebuilt:
+# - right after ClinicalBackend's own writes,
+# - on read, if still stale, and
+# - in bulk by the background refresher (start_refresher) or the CLI, which
+#   walk the partial index of stale rows.
+# A rebuild reads the data and the version in one transaction and is only
+# stored if the version hasn't moved since, so a concurrent write is never
+# masked by an older snapshot.
+#
+#     python summaries.py [clinical_system.db] [--limit N]
+
+SNAPSHOT_FORMAT = 1           # bump when the snapshot layout changes
+RECENT_LABS = 15
+RECENT_APPOINTMENTS = 3
+REFRESH_INTERVAL = 30         # seconds between refresher passes
+REFRESH_BATCH = 200
+NAN = float('nan')
+
+# Order matches the backend's per-patient reads, so ties render the same.
+# Rows are read straight from sqlite3 (pandas would cost more than the
+# queries); dates come back as 'YYYY-MM-DD' and NULLs as NaN, the way the
+# backend's typed DataFrames print them.
+_PATIENT_SQL = """SELECT first_name, last_name, age, gender, primary_diagnosis,
+        COALESCE(date(last_visit), 'N/A') AS last_visit
+    FROM patients WHERE patient_id = ?"""
+_MEDICATIONS_SQL = """SELECT medication_name, dosage, frequency, status FROM medications
+    WHERE patient_id = ? ORDER BY status ASC, start_date DESC"""
+_LAB_COLUMNS = "test_name, value, unit, interpretation, COALESCE(date(result_date), 'NaT') AS result_date"
+_RECENT_LABS_SQL = f"""SELECT {_LAB_COLUMNS} FROM lab_results
+    WHERE patient_id = ? ORDER BY lab_results.result_date DESC LIMIT {RECENT_LABS}"""
+_LATEST_LABS_SQL = f"""SELECT {_LAB_COLUMNS} FROM (
+        SELECT *, ROW_NUMBER() OVER (PARTITION BY test_name ORDER BY result_date DESC, id DESC) AS rn
+        FROM lab_results WHERE patient_id = ?)
+    WHERE rn = 1 ORDER BY test_name"""
+_LAB_COUNTS_SQL = "SELECT interpretation, COUNT(*) FROM lab_results WHERE patient_id = ? GROUP BY interpretation"
+_APPOINTMENTS_SQL = f"""SELECT COALESCE(date(appointment_date), 'NaT') AS appointment_date, reason, status
+    FROM appointments WHERE patient_id = ? ORDER BY appointments.appointment_date DESC LIMIT {RECENT_APPOINTMENTS}"""
+
+
+def _records(conn, sql, patient_id):
+    cursor = conn.execute(sql, [patient_id])
+    names = [d[0] for d in cursor.description]
+    return [{name: NAN if value is None else value for name, value in zip(names, row)} for row in cursor]
+
+
+def control_status(values):
+    """BP / HbA1c control status from the latest value per test ({test_name: value})"""
+    control = {'bp': None, 'hba1c': None}
+    if 'BP Systolic' in values and 'BP Diastolic' in values:
+        at_goal = values['BP Systolic'] < 130 and values['BP Diastolic'] < 80
+        control['bp'] = 'at goal' if at_goal else 'above target'
+    if 'HbA1c' in values:
+        control['hba1c'] = 'well-controlled' if values['HbA1c'] < 7.0 else 'needs improvement'
+    return control
+
+
+def build_snapshot(conn, patient_id):
+    """(version, snapshot) read in one transaction; snapshot is None for unknown patients"""
+    conn.execute("BEGIN")
+    try:
+        row = conn.execute("SELECT version FROM patient_summary WHERE patient_id = ?", [patient_id]).fetchone()
+        version = row[0] if row else None
+        patient = _records(conn, _PATIENT_SQL, patient_id)
+        if not patient:
+            return version, None
+        medications = _records(conn, _MEDICATIONS_SQL, patient_id)
+        latest = _records(conn, _LATEST_LABS_SQL, patient_id)
+        counts = dict(conn.execute(_LAB_COUNTS_SQL, [patient_id]).fetchall())
+        snapshot = {
+            'format': SNAPSHOT_FORMAT,
+            'patient': patient[0],
+            'medication_count': len(medications),
+            'active_medications': [m for m in medications if m['status'] == 'Active'],
+            'lab_count': sum(counts.values()),
+            'recent_labs': _records(conn, _RECENT_LABS_SQL, patient_id),
+            'latest_labs': latest,
+            'abnormal': {
+                'high': counts.get('High', 0),
+                'low': counts.get('Low', 0),
+                'latest': sum(lab['interpretation'] != 'Normal' for lab in latest),
+            },
+            'control': control_status({lab['test_name']: lab['value'] for lab in latest}),
+            'appointment_count': conn.execute("SELECT COUNT(*) FROM appointments WHERE patient_id = ?",
+                                              [patient_id]).fetchone()[0],
+            'recent_appointments': _records(conn, _APPOINTMENTS_SQL, patient_id),
+        }
+        return version, snapshot
+    finally:
+        conn.execute("COMMIT")
+
+
+def refresh_snapshot(pool, patient_id):
+    """Rebuild and store one patient's snapshot; returns it (None for unknown patients)"""
+    with pool.reader() as conn:
+        version, snapshot = build_snapshot(conn, patient_id)
+    if version is not None and snapshot is not None:
+        with pool.writer() as conn:
+            conn.execute("""UPDATE patient_summary SET snapshot = ?, snapshot_version = version, built_at = ?
+                WHERE patient_id = ? AND version = ?""",
+                         [json.dumps(snapshot), datetime.now().isoformat(timespec='seconds'), patient_id, version])
+    return snapshot
+
+
+def get_snapshot(pool, patient_id):
+    """Current snapshot for a patient, rebuilt first if stale (None for unknown patients)"""
+    with pool.reader() as conn:
+        row = conn.execute("SELECT version, snapshot_version, snapshot FROM patient_summary WHERE patient_id = ?",
+                           [patient_id]).fetchone()
+    if row and row[0] == row[1] and row[2]:
+        snapshot = json.loads(row[2])
+        if snapshot.get('format') == SNAPSHOT_FORMAT:
+            return snapshot
+    return refresh_snapshot(pool, patient_id)
+
+
+def stale_patients(pool, limit=None):
+    """IDs of patients whose snapshot is missing or out of date"""
+    sql = "SELECT patient_id FROM patient_summary WHERE snapshot_version < version"
+    with pool.reader() as conn:
+        if limit is not None:
+            return [row[0] for row in conn.execute(sql + " LIMIT ?", [limit])]
+        return [row[0] for row in conn.execute(sql)]
+
+
+def refresh_stale(pool, limit=None):
+    """Rebuild stale snapshots (up to `limit`); returns how many were rebuilt"""
+    patient_ids = stale_patients(pool, limit)
+    for patient_id in patient_ids:
+        refresh_snapshot(pool, patient_id)
+    return len(patient_ids)
+
+
+def render_summary(snapshot):
+    """Markdown patient summary from a snapshot"""
+    patient = snapshot['patient']
+    summary = f"""### 📋 Patient Summary: {patient['first_name']} {patient['last_name']}
+**Demographics:** {patient['age']}y {patient['gender']}
+**Diagnosis:** {patient['primary_diagnosis']}
+**Last Visit:** {patient['last_visit']}
+
+#### 🔍 Recent Clinical Data
+"""
+    if snapshot['medication_count']:
+        summary += "\n**Current Medications:**"
+        if snapshot['active_medications']:
+            summary += "\n" + "\n".join("- {medication_name} {dosage} ({frequency})".format(**m)
+                                        for m in snapshot['active_medications'])
+        else:
+            summary += "\n*No active medications.*"
+    else:
+        summary += "\n*No medication history.*"
+
+    if snapshot['lab_count']:
+        summary += f"\n\n**Recent Lab Results ({snapshot['lab_count']}):**"
+        summary += "\n" + "\n".join(
+            "- {icon} {test_name}: {value} {unit} ({interpretation}) on {result_date}".format(
+                icon="✅" if lab['interpretation'] == 'Normal' else "⚠️", **lab)
+            for lab in snapshot['recent_labs'])
+        abnormal = snapshot['abnormal']
+        summary += (f"\n\n**Abnormal Results:** {abnormal['high']} high, {abnormal['low']} low; "
+                    f"{abnormal['latest']} of {len(snapshot['latest_labs'])} tests abnormal at their latest reading")
+    else:
+        summary += "\n\n*No lab results found.*"
+
+    control = snapshot['control']
+    status = [f"{label} {control[key]}" for key, label in (('bp', 'BP'), ('hba1c', 'HbA1c')) if control[key]]
+    if status:
+        summary += "\n\n**Control:** " + " · ".join(status)
+
+    if snapshot['appointment_count']:
+        summary += f"\n\n**Recent Appointments ({snapshot['appointment_count']}):**"
+        summary += "\n" + "\n".join("- {appointment_date}: {reason} ({status})".format(**a)
+                                    for a in snapshot['recent_appointments'])
+    else:
+        summary += "\n\n*No appointments found.*"
+    return summary
+
+
+class SummaryRefresher(threading.Thread):
+    """Daemon thread that keeps snapshots current after bulk loads and other writers"""
+
+    def __init__(self, db_name=DB_NAME, interval=REFRESH_INTERVAL, batch=REFRESH_BATCH):
+        super().__init__(name=f"summary-refresher-{db_name}", daemon=True)
+        self.db_name = db_name
+        self.interval = interval
+        self.batch = batch
+        self.rebuilt = 0
+        self._stop = threading.Event()
+
+    def run(self):
+        while not self._stop.is_set():
+            pool = get_pool(self.db_name)
+            # Full batches back to back; sleep once caught up
+            while not self._stop.is_set():
+                n = refresh_stale(pool, self.batch)
+                self.rebuilt += n
+                if n < self.batch:
+                    break
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+
+
+_refreshers = {}
+_refreshers_lock = threading.Lock()
+
+
+def start_refresher(db_name=DB_NAME, interval=REFRESH_INTERVAL):
+    """Process-wide background refresher for `db_name`, started on first use"""
+    with _refreshers_lock:
+        refresher = _refreshers.get(db_name)
+        if refresher is None or not refresher.is_alive():
+            refresher = SummaryRefresher(db_name, interval)
+            refresher.start()
+            _refreshers[db_name] = refresher
+        return refresher
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild stale patient summary snapshots")
+    parser.add_argument('db', nargs='?', default=DB_NAME)
+    parser.add_argument('--limit', type=int, default=None, help='rebuild at most N snapshots')
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    n = refresh_stale(get_pool(args.db), args.limit)
+    print(f"Rebuilt {n:,} summary snapshots in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+import argparse
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from database import (ALLERGIES, DIAGNOSES, DOCTORS, FIRST_NAMES, LAST_NAMES,
+                      create_tables, get_db_connection)
+from migrations import apply_migrations, managed_triggers, touch_summaries
+
+# Scale-test data generator.
+#
+# Same clinical picture as database.populate_synthetic_data (3-5 visits a
+# year, a lab panel per visit, diagnosis-driven medications), but every
+# column is drawn as a NumPy array for a whole block of patients at once.
+# Patients are split into fixed-size shards; each shard has its own RNG
+# seeded from (seed, shard number), so the output depends only on the seed,
+# shard size and year range - not on how many worker processes ran. Workers
+# write each shard to a scratch SQLite file and the parent merges them in
+# shard order with INSERT ... SELECT.
+#
+#     python synthetic.py scale.db --patients 1000000 --years 2016 2025
+
+# (test, unit, ref_low, ref_high, normal range, at-risk range, risk group,
+#  decimals, out-of-range rule) - at-risk patients draw from the second range
+LAB_PANEL = [
+    ('Glucose', 'mg/dL', 70, 100, (70, 110), (100, 250), 'diabetes', 0, ('High', 100)),
+    ('Creatinine', 'mg/dL', 0.6, 1.2, (0.6, 1.2), None, None, 1, None),
+    ('Hemoglobin', 'g/dL', 12.0, 16.0, (12.0, 16.0), None, None, 1, None),
+    ('BP Systolic', 'mmHg', 90, 120, (110, 135), (130, 170), 'hypertension', 0, ('High', 120)),
+    ('BP Diastolic', 'mmHg', 60, 80, (70, 85), (85, 105), 'hypertension', 0, ('High', 80)),
+    ('LDL Cholesterol', 'mg/dL', 0, 100, (70, 129), (130, 190), 'lipids', 0, ('High', 100)),
+    ('HDL Cholesterol', 'mg/dL', 40, 100, (40, 80), (30, 50), 'lipids', 0, ('Low', 40)),
+    ('Triglycerides', 'mg/dL', 0, 150, (50, 149), (150, 350), 'lipids', 0, ('High', 150)),
+    ('BUN', 'mg/dL', 7, 20, (7, 20), None, None, 0, None),
+]
+# Ordered last in each visit; always for diabetics, 30% of other visits
+HBA1C = ('HbA1c', '%', 4.0, 5.7, (4.5, 5.6), (6.0, 9.0), 'diabetes', 1, ('High', 6.5))
+
+# (medication, dosage, frequency, forced status or None for 70% active)
+DIAGNOSIS_MEDICATIONS = {
+    'Type 2 Diabetes': [('Metformin', '1000mg', 'Twice daily', 'Active'),
+                        ('Glipizide', '5mg', 'Daily', 'Discontinued'),
+                        ('Sitagliptin', '100mg', 'Daily', None)],
+    'Hypertension': [('Lisinopril', '10mg', 'Daily', 'Active'),
+                     ('Amlodipine', '5mg', 'Daily', 'Discontinued'),
+                     ('Hydrochlorothiazide', '25mg', 'Daily', None)],
+    'Asthma': [('Albuterol Inhaler', '90mcg', 'As needed', 'Active'),
+               ('Fluticasone', '110mcg', 'Twice daily', 'Discontinued'),
+               ('Montelukast', '10mg', 'Daily', None)],
+    'Hyperlipidemia': [('Atorvastatin', '20mg', 'Daily', 'Active'),
+                       ('Simvastatin', '40mg', 'Daily', 'Discontinued')],
+    'Coronary Artery Disease': [('Aspirin', '81mg', 'Daily', 'Active'),
+                                ('Metoprolol', '25mg', 'Daily', 'Discontinued'),
+                                ('Clopidogrel', '75mg', 'Daily', None)],
+    'Anxiety Disorder': [('Sertraline', '50mg', 'Daily', 'Active'),
+                         ('Lorazepam', '0.5mg', 'As needed', 'Discontinued')],
+    'Depression': [('Fluoxetine', '20mg', 'Daily', 'Active'),
+                   ('Bupropion', '150mg', 'Daily', 'Discontinued')],
+    'Hypothyroidism': [('Levothyroxine', '50mcg', 'Daily', 'Active'),
+                       ('Levothyroxine', '25mcg', 'Daily', 'Discontinued')],
+    'GERD': [('Omeprazole', '20mg', 'Daily', 'Active'),
+             ('Famotidine', '20mg', 'Twice daily', 'Discontinued')],
+    'Migraine': [('Sumatriptan', '50mg', 'As needed', 'Active'),
+                 ('Topiramate', '25mg', 'Daily', 'Discontinued')],
+}
+# (medication, dosage, frequency, probability, course length in days)
+ANTIBIOTICS = [
+    ('Amoxicillin', '500mg', 'Three times daily', 0.5, 7),
+    ('Azithromycin', '250mg', 'Daily', 0.3, 5),
+]
+
+TABLE_COLUMNS = {
+    'patients': ['patient_id', 'first_name', 'last_name', 'date_of_birth', 'age', 'gender', 'contact_number',
+                 'email', 'address', 'primary_diagnosis', 'allergies', 'last_visit'],
+    'appointments': ['patient_id', 'appointment_date', 'appointment_time', 'doctor_name', 'reason', 'status', 'notes'],
+    'lab_results': ['patient_id', 'result_date', 'test_name', 'value', 'unit', 'reference_low', 'reference_high',
+                    'interpretation'],
+    'medications': ['patient_id', 'medication_name', 'dosage', 'frequency', 'start_date', 'end_date', 'status'],
+    'lab_trend_summary': ['patient_id', 'test_name', 'unit', 'n', 'first_date', 'first_value', 'latest_date',
+                          'latest_value', 'min_value', 'max_value', 'sum_x', 'sum_y', 'sum_xx', 'sum_xy'],
+}
+
+
+def _random_dates(rng, year_lo, year_hi, size):
+    """datetime64[D] array of random dates (day 1-28) in [year_lo, year_hi]"""
+    years = rng.integers(year_lo, np.asarray(year_hi) + 1, size)
+    return _to_dates(years, rng.integers(1, 13, size), rng.integers(1, 29, size))
+
+
+def _to_dates(years, months, days):
+    month_index = (np.asarray(years) - 1970) * 12 + np.asarray(months) - 1
+    return month_index.astype('datetime64[M]').astype('datetime64[D]') + (np.asarray(days) - 1)
+
+
+def _strings(dates):
+    return np.datetime_as_string(dates, unit='D')
+
+
+def _draw(rng, value_range, decimals, size):
+    lo, hi = value_range
+    if decimals == 0:
+        return rng.integers(lo, hi + 1, size).astype(float)
+    return np.round(rng.uniform(lo, hi, size), decimals)
+
+
+def _lab_values(rng, test, at_risk, size):
+    """(values, interpretations) for one test over `size` visits"""
+    _, _, _, _, normal, risk, group, decimals, rule = test
+    values = _draw(rng, normal, decimals, size)
+    if risk is not None:
+        values = np.where(at_risk[group], _draw(rng, risk, decimals, size), values)
+    interpretation = np.full(size, 'Normal', dtype=object)
+    if rule is not None:
+        label, threshold = rule
+        out = values > threshold if label == 'High' else values < threshold
+        interpretation[out] = label
+    return values, interpretation
+
+
+def generate_shard(shard, first_patient, n, seed, start_year, end_year, width):
+    """Generate patients first_patient .. first_patient+n-1; returns {table: column lists}"""
+    rng = np.random.default_rng([seed, shard])
+    numbers = np.arange(first_patient, first_patient + n)
+    pids = np.array([f'P{i:0{width}d}' for i in numbers], dtype=object)
+
+    # --- Patients ---
+    first = np.array(FIRST_NAMES, dtype=object)[rng.integers(len(FIRST_NAMES), size=n)]
+    last = np.array(LAST_NAMES, dtype=object)[rng.integers(len(LAST_NAMES), size=n)]
+    birth_year = rng.integers(1950, 2001, n)
+    dob = _strings(_to_dates(birth_year, rng.integers(1, 13, n), rng.integers(1, 29, n)))
+    diag = rng.integers(len(DIAGNOSES), size=n)
+    diag_names = np.array(DIAGNOSES, dtype=object)
+    diagnosis = diag_names[diag]
+    at_risk_patient = {
+        'diabetes': np.char.find(diagnosis.astype(str), 'Diabetes') >= 0,
+        'hypertension': np.isin(diagnosis, ['Hypertension', 'Coronary Artery Disease']),
+    }
+    at_risk_patient['lipids'] = at_risk_patient['diabetes'] | np.isin(diagnosis, ['Hyperlipidemia', 'Coronary Artery Disease'])
+
+    # --- Visits: 3-5 per patient per year, chronological within each patient ---
+    years = np.arange(start_year, end_year + 1)
+    per_year = rng.integers(3, 6, size=(n, len(years)))
+    visit_patient = np.repeat(np.repeat(np.arange(n), len(years)), per_year.ravel())
+    visit_year = np.repeat(np.tile(years, n), per_year.ravel())
+    n_visits = len(visit_patient)
+    visit_dates = _to_dates(visit_year, rng.integers(1, 13, n_visits), rng.integers(1, 29, n_visits))
+    order = np.lexsort((visit_dates, visit_patient))
+    visit_patient, visit_dates = visit_patient[order], visit_dates[order]
+    visit_day = _strings(visit_dates)
+    last_index = np.cumsum(per_year.sum(axis=1)) - 1
+    last_visit = visit_day[last_index]
+
+    reasons = np.array([f"{d} Follow-up" if d != 'None' else "Routine Checkup" for d in DIAGNOSES], dtype=object)
+    follow_up = (diagnosis[visit_patient] != 'None') & (rng.random(n_visits) < 0.5)
+    hours = np.array([f"{h}:00" for h in range(9, 17)], dtype=object)
+    appointments = {
+        'patient_id': pids[visit_patient],
+        'appointment_date': visit_day,
+        'appointment_time': hours[rng.integers(len(hours), size=n_visits)],
+        'doctor_name': np.array(DOCTORS, dtype=object)[rng.integers(len(DOCTORS), size=n_visits)],
+        'reason': np.where(follow_up, reasons[diag[visit_patient]], "Routine Checkup"),
+        'status': np.full(n_visits, 'Completed', dtype=object),
+        'notes': np.full(n_visits, 'Routine notes', dtype=object),
+    }
+
+    # --- Labs: one (visit x test) matrix, flattened visit by visit ---
+    at_risk = {group: flags[visit_patient] for group, flags in at_risk_patient.items()}
+    panel = LAB_PANEL + [HBA1C]
+    values = np.empty((n_visits, len(panel)))
+    interpretation = np.empty((n_visits, len(panel)), dtype=object)
+    for j, test in enumerate(panel):
+        values[:, j], interpretation[:, j] = _lab_values(rng, test, at_risk, n_visits)
+    present = np.ones((n_visits, len(panel)), dtype=bool)
+    present[:, -1] = at_risk['diabetes'] | (rng.random(n_visits) < 0.3)
+    keep = present.ravel()
+    lab_visit = np.repeat(np.arange(n_visits), len(panel))[keep]
+    lab_test = np.tile(np.arange(len(panel)), n_visits)[keep]
+    column = lambda k: np.array([t[k] for t in panel], dtype=object)[lab_test]
+    labs = {
+        'patient_id': pids[visit_patient[lab_visit]],
+        'result_date': visit_day[lab_visit],
+        'test_name': column(0),
+        'value': values.ravel()[keep],
+        'unit': column(1),
+        'reference_low': column(2),
+        'reference_high': column(3),
+        'interpretation': interpretation.ravel()[keep],
+    }
+
+    # --- Trend summary: a shard holds every row of its patients, so the
+    # per-(patient, test) aggregates are final and computed here instead of
+    # row by row in the database. x matches julianday(date) - 2451545.0.
+    x = (visit_dates - np.datetime64('2000-01-01')).astype(float)[lab_visit] - 0.5
+    y = labs['value']
+    group_key = visit_patient[lab_visit] * len(panel) + lab_test
+    order = np.argsort(group_key, kind='stable')   # keeps visit order within a group
+    starts = np.flatnonzero(np.r_[True, np.diff(group_key[order]) != 0])
+    ends = np.r_[starts[1:], len(order)] - 1
+    first_row, last_row = order[starts], order[ends]
+    x_sorted, y_sorted = x[order], y[order]
+    trends = {
+        'patient_id': labs['patient_id'][first_row],
+        'test_name': labs['test_name'][first_row],
+        'unit': labs['unit'][last_row],
+        'n': np.diff(np.r_[starts, len(order)]),
+        'first_date': labs['result_date'][first_row],
+        'first_value': y[first_row],
+        'latest_date': labs['result_date'][last_row],
+        'latest_value': y[last_row],
+        'min_value': np.minimum.reduceat(y_sorted, starts),
+        'max_value': np.maximum.reduceat(y_sorted, starts),
+        'sum_x': np.add.reduceat(x_sorted, starts),
+        'sum_y': np.add.reduceat(y_sorted, starts),
+        'sum_xx': np.add.reduceat(x_sorted * x_sorted, starts),
+        'sum_xy': np.add.reduceat(x_sorted * y_sorted, starts),
+    }
+
+    # --- Medications: one vectorized block per (diagnosis, template) ---
+    discontinued_hi = max(start_year, end_year - 2)
+    blocks = []
+    templates = [(d, m) for d, meds in DIAGNOSIS_MEDICATIONS.items() for m in meds]
+    for rank, (d, (name, dosage, freq, forced)) in enumerate(templates):
+        who = np.flatnonzero(diagnosis == d)
+        blocks.append((who, rank, name, dosage, freq, forced, None))
+    for rank, (name, dosage, freq, p, days) in enumerate(ANTIBIOTICS, len(templates)):
+        who = np.flatnonzero(rng.random(n) < p)
+        blocks.append((who, rank, name, dosage, freq, 'Discontinued', days))
+
+    med_patient, med_rank, names, dosages, freqs, starts, ends, statuses = [], [], [], [], [], [], [], []
+    for who, rank, name, dosage, freq, forced, days in blocks:
+        k = len(who)
+        active = np.full(k, forced == 'Active') if forced else rng.random(k) < 0.7
+        start = np.where(active,
+                         _random_dates(rng, max(start_year, end_year - 1), end_year, k),
+                         _random_dates(rng, start_year, discontinued_hi, k))
+        length = np.full(k, days) if days else rng.integers(90, 366, k)
+        end = _strings(start + length).astype(object)
+        end[active] = None
+        med_patient.append(who)
+        med_rank.append(np.full(k, rank))
+        names.append(np.full(k, name, dtype=object))
+        dosages.append(np.full(k, dosage, dtype=object))
+        freqs.append(np.full(k, freq, dtype=object))
+        starts.append(_strings(start))
+        ends.append(end)
+        statuses.append(np.where(active, 'Active', 'Discontinued').astype(object))
+    med_patient, med_rank = np.concatenate(med_patient), np.concatenate(med_rank)
+    order = np.lexsort((med_rank, med_patient))
+    medications = {
+        'patient_id': pids[med_patient[order]],
+        'medication_name': np.concatenate(names)[order],
+        'dosage': np.concatenate(dosages)[order],
+        'frequency': np.concatenate(freqs)[order],
+        'start_date': np.concatenate(starts)[order],
+        'end_date': np.concatenate(ends)[order],
+        'status': np.concatenate(statuses)[order],
+    }
+
+    patients = {
+        'patient_id': pids,
+        'first_name': first,
+        'last_name': last,
+        'date_of_birth': dob,
+        'age': end_year - 1 - birth_year,
+        'gender': np.array(['M', 'F'], dtype=object)[rng.integers(2, size=n)],
+        'contact_number': np.array([f'555-{x}' for x in rng.integers(1000, 10000, n)], dtype=object),
+        'email': np.char.lower((first + '.' + last + '@example.com').astype(str)),
+        'address': np.full(n, '123 Main St', dtype=object),
+        'primary_diagnosis': diagnosis,
+        'allergies': np.array(ALLERGIES, dtype=object)[rng.integers(len(ALLERGIES), size=n)],
+        'last_visit': last_visit,
+    }
+    return {'patients': patients, 'appointments': appointments, 'lab_results': labs,
+            'medications': medications, 'lab_trend_summary': trends}
+
+
+def _insert(conn, table, columns, batch_size=100_000):
+    names = TABLE_COLUMNS[table]
+    sql = f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+    lists = [columns[c].tolist() for c in names]
+    total = len(lists[0])
+    for i in range(0, total, batch_size):
+        conn.executemany(sql, zip(*(col[i:i + batch_size] for col in lists)))
+    return total
+
+
+def _write_shard(args):
+    """Worker: generate one shard into its own scratch database"""
+    path, shard, first_patient, n, seed, start_year, end_year, width = args
+    tables = generate_shard(shard, first_patient, n, seed, start_year, end_year, width)
+    conn = get_db_connection(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    # Scratch tables: no keys or AUTOINCREMENT bookkeeping, ids are assigned on merge
+    for table, names in TABLE_COLUMNS.items():
+        conn.execute(f"CREATE TABLE {table} ({', '.join(names)})")
+    counts = {table: _insert(conn, table, columns) for table, columns in tables.items()}
+    conn.commit()
+    conn.close()
+    return path, counts
+
+
+def generate(db_name, n_patients, start_year=2021, end_year=2025, seed=0, workers=None,
+             shard_size=5000, verbose=True):
+    """Fill a new (empty) database with `n_patients` synthetic patients.
+
+    workers: process count (default os.cpu_count(); 1 runs in-process).
+    Returns {table: rows}.
+    """
+    conn = get_db_connection(db_name)
+    create_tables(conn)
+    if conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0]:
+        conn.close()
+        raise ValueError(f"{db_name} already has patients; generate into a new database")
+    # Full schema up front: shards arrive in patient_id order, so the
+    # per-patient indexes grow at their right edge during the merge
+    apply_migrations(conn)
+    conn.execute("PRAGMA synchronous=OFF")
+    # Trend summaries come precomputed with each shard; summary snapshots are
+    # left stale for summaries.py (refresher or CLI) to build
+    triggers = [(name, ddl) for name, table, ddl in managed_triggers() if 'AFTER INSERT' in ddl]
+    for name, _ in triggers:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+    workers = workers or os.cpu_count() or 1
+    width = max(3, len(str(n_patients)))
+    totals = dict.fromkeys(TABLE_COLUMNS, 0)
+    start = time.perf_counter()
+    scratch = tempfile.mkdtemp(prefix='synthetic-', dir=os.path.dirname(os.path.abspath(db_name)))
+    jobs = [(os.path.join(scratch, f'shard-{k:06d}.db'), k, first, min(shard_size, n_patients - first + 1),
+             seed, start_year, end_year, width)
+            for k, first in enumerate(range(1, n_patients + 1, shard_size))]
+
+    def merge(path, counts):
+        # Shards are merged in order so row ids are deterministic too
+        conn.execute("ATTACH DATABASE ? AS shard", (path,))
+        with conn:
+            for table, names in TABLE_COLUMNS.items():
+                cols = ', '.join(names)
+                conn.execute(f"INSERT INTO main.{table} ({cols}) SELECT {cols} FROM shard.{table} ORDER BY rowid")
+        conn.execute("DETACH DATABASE shard")
+        os.remove(path)
+        for table, rows in counts.items():
+            totals[table] += rows
+        if verbose:
+            rate = totals['lab_results'] / (time.perf_counter() - start)
+            print(f"  {totals['patients']:,}/{n_patients:,} patients, {totals['lab_results']:,} lab rows "
+                  f"({rate:,.0f} lab rows/sec)")
+
+    try:
+        if workers == 1:
+            for job in jobs:
+                merge(*_write_shard(job))
+        else:
+            # Keep a bounded number of shards in flight so scratch files
+            # don't pile up on disk faster than they are merged
+            with ProcessPoolExecutor(workers) as pool:
+                pending = deque()
+                for job in jobs:
+                    pending.append(pool.submit(_write_shard, job))
+                    if len(pending) >= 2 * workers:
+                        merge(*pending.popleft().result())
+                while pending:
+                    merge(*pending.popleft().result())
+    finally:
+        for name in os.listdir(scratch):
+            os.remove(os.path.join(scratch, name))
+        os.rmdir(scratch)
+        touch_summaries(conn, 'patients')
+        for _, ddl in triggers:
+            conn.execute(ddl)
+        conn.commit()
+
+    conn.execute("ANALYZE")
+    conn.close()
+    if verbose:
+        print(f"✅ Generated {totals['patients']:,} patients, {totals['appointments']:,} appointments, "
+              f"{totals['medications']:,} medications and {totals['lab_results']:,} lab results "
+              f"in {time.perf_counter() - start:.1f}s")
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a large synthetic clinical database")
+    parser.add_argument('db', help="path of the new database")
+    parser.add_argument('--patients', type=int, default=100_000)
+    parser.add_argument('--years', type=int, nargs=2, default=[2021, 2025], metavar=('START', 'END'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help="default: one per CPU")
+    parser.add_argument('--shard-size', type=int, default=5000, help="patients per shard (part of the output's identity)")
+    args = parser.parse_args()
+    generate(args.db, args.patients, args.years[0], args.years[1], seed=args.seed,
+             workers=args.workers, shard_size=args.shard_size)
@@ -0,0 +1,100 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import bootstrap
+from assistant_service import AssistantService
+from bootstrap import build_once, stored_fingerprint
+
+
+def seed(value):
+    def build(conn):
+        conn.execute("CREATE TABLE t (value TEXT)")
+        conn.execute("INSERT INTO t VALUES (?)", [value])
+    return build
+
+
+class Reader:
+    """Stands in for the assistant: reads `t` through the service's pool"""
+
+    def __init__(self, db_path, pool):
+        self.pool = pool
+
+    def value(self):
+        with self.pool.reader() as conn:
+            return conn.execute("SELECT value FROM t").fetchone()[0]
+
+
+def is_open(path):
+    """Whether this process has a file descriptor on `path` (Linux)"""
+    fds = '/proc/self/fd'
+    for fd in os.listdir(fds):
+        try:
+            if os.readlink(os.path.join(fds, fd)) == path:
+                return True
+        except OSError:
+            pass
+    return False
+
+
+@unittest.skipUnless(os.name == 'nt' or os.path.isdir('/proc/self/fd'), "needs Windows or /proc")
+class BuildWhileOpenTest(unittest.TestCase):
+    """Rebuilding the database while the assistant service has it open.
+
+    Elsewhere than on Windows, os.replace is made to fail as it does there
+    while the target is open.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db_path = os.path.realpath(os.path.join(self.tmp.name, 'complete.db'))
+        build_once(self.db_path, 'v1', seed('old'))
+        if os.name != 'nt':
+            real_replace = os.replace
+
+            def replace(src, dst):
+                if is_open(dst):
+                    raise PermissionError(13, "The process cannot access the file because it is being "
+                                              "used by another process", dst)
+                real_replace(src, dst)
+
+            patch = mock.patch('os.replace', replace)
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.service = AssistantService(Reader, self.db_path)
+        self.addCleanup(self.service.shutdown)
+
+    def leftovers(self):
+        return [name for name in os.listdir(self.tmp.name) if name.endswith('.tmp')]
+
+    def test_release_closes_the_pool_before_the_swap(self):
+        self.assertEqual(self.service.assistant.value(), 'old')
+        self.assertTrue(build_once(self.db_path, 'v2', seed('new'), release=self.service.pool.close))
+        self.service.reopen()
+        self.assertEqual(self.service.assistant.value(), 'new')
+        self.assertEqual(stored_fingerprint(self.db_path), 'v2')
+        self.assertEqual(self.leftovers(), [])
+
+    def test_swap_waits_for_a_query_still_running(self):
+        self.assertEqual(self.service.assistant.value(), 'old')
+        running = sqlite3.connect(self.db_path)
+        # The query finishes while the swap is waiting
+        with mock.patch.object(bootstrap.time, 'sleep', lambda _: running.close()):
+            self.assertTrue(build_once(self.db_path, 'v2', seed('new'), release=self.service.pool.close))
+        self.assertEqual(stored_fingerprint(self.db_path), 'v2')
+
+    def test_busy_file_keeps_the_old_database(self):
+        self.assertEqual(self.service.assistant.value(), 'old')
+        with mock.patch.object(bootstrap, 'SWAP_TIMEOUT', 0.3):
+            with self.assertRaises(PermissionError):
+                build_once(self.db_path, 'v2', seed('new'))
+        self.assertEqual(stored_fingerprint(self.db_path), 'v1')
+        self.assertEqual(self.leftovers(), [])
+        self.assertEqual(self.service.assistant.value(), 'old')
+
+
+if __name__ == '__main__':
+    unittest.main()
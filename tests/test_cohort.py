@@ -0,0 +1,78 @@
+import unittest
+
+from cohort import Cohort, CohortCount, CohortError, Demographic, LabCount, LabStat, LatestLab, parse
+
+TESTS = ['BP Diastolic', 'BP Systolic', 'BUN', 'Creatinine', 'Glucose', 'HDL Cholesterol', 'HbA1c',
+         'Hemoglobin', 'LDL Cholesterol', 'Triglycerides']
+NOW = '2025-12-31'
+
+
+def parsed(text):
+    return parse(text, TESTS, NOW)
+
+
+class ParseTest(unittest.TestCase):
+    def test_cohort_conditions(self):
+        cohort = parsed("diagnosis = Hypertension AND latest BP Systolic > 140")
+        self.assertIsInstance(cohort, Cohort)
+        demographic, latest = cohort.conditions
+        self.assertIsInstance(demographic, Demographic)
+        self.assertEqual((demographic.field, demographic.op, demographic.value), ('diagnosis', '=', 'Hypertension'))
+        self.assertIsInstance(latest, LatestLab)
+        self.assertEqual((latest.test, latest.op, latest.value, latest.window), ('BP Systolic', '>', 140.0, None))
+
+    def test_count_condition(self):
+        for text in ("at least 3 High LDL in 2024", "≥3 High LDL in 2024", "count High LDL in 2024 >= 3"):
+            with self.subTest(text=text):
+                (condition,) = parsed(text).conditions
+                self.assertIsInstance(condition, LabCount)
+                self.assertEqual((condition.test, condition.min_count, condition.interpretation, condition.window),
+                                 ('LDL Cholesterol', 3, 'High', ('2024-01-01', '2025-01-01')))
+
+    def test_windows(self):
+        self.assertEqual(parsed("latest HbA1c since 2024-03-01 > 7").conditions[0].window, ('2024-03-01', None))
+        self.assertEqual(parsed("latest HbA1c before 2025-01-01 > 7").conditions[0].window, (None, '2025-01-01'))
+        self.assertEqual(parsed("latest HbA1c last 6 months > 7").conditions[0].window, ('2025-06-30', None))
+
+    def test_stat(self):
+        stat = parsed("median HbA1c by diagnosis by year where gender = F")
+        self.assertIsInstance(stat, LabStat)
+        self.assertEqual((stat.stat, stat.test, stat.by), ('median', 'HbA1c', ['diagnosis', 'year']))
+        self.assertEqual(repr(stat.cohort), "gender = 'F'")
+
+    def test_reading_count_stat(self):
+        stat = parsed("count LDL in 2024")
+        self.assertIsInstance(stat, LabStat)
+        self.assertEqual((stat.stat, stat.test, stat.window), ('count', 'LDL Cholesterol', ('2024-01-01', '2025-01-01')))
+
+    def test_patient_count(self):
+        for text in ("count of patients with ≥3 High LDL in 2024",
+                     "number of patients where at least 3 High LDL in 2024"):
+            with self.subTest(text=text):
+                stat = parsed(text)
+                self.assertIsInstance(stat, CohortCount)
+                (condition,) = stat.cohort.conditions
+                self.assertEqual(repr(condition), "at least 3 High LDL Cholesterol in [2024-01-01, 2025-01-01)")
+
+    def test_aliases(self):
+        self.assertEqual(parsed("mean a1c").test, 'HbA1c')
+        self.assertEqual(parsed("mean ldl cholesterol").test, 'LDL Cholesterol')
+        self.assertEqual(parsed("max triglycerides").test, 'Triglycerides')
+
+    def test_rejected(self):
+        for text in ("count of LDL in 2024",          # leftover words must not resolve through the alias
+                     "mean LDL patients",
+                     "median systolic bp",            # the BP alias alone is ambiguous
+                     "median cholesterol",            # alias of several tests
+                     "at least 3 High Ferritin",
+                     "latest HbA1c is high",
+                     "height > 180",
+                     "at least 0 LDL",
+                     "median HbA1c by week"):
+            with self.subTest(text=text):
+                with self.assertRaises(CohortError):
+                    parsed(text)
+
+
+if __name__ == '__main__':
+    unittest.main()
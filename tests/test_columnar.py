@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+import columnar
+from backend import ClinicalBackend
+from benchmarks._data import make_database
+from database import get_db_connection
+from migrations import apply_migrations
+
+QUERIES = [
+    "median HbA1c",
+    "mean LDL Cholesterol by year",
+    "median HbA1c by diagnosis by year",
+    "max Glucose since 2024-03-01 by gender",
+    "patients HbA1c by gender",
+    "count LDL in 2024 by month",
+    "median HbA1c where latest BP Systolic > 130",
+]
+# No readings selected: before the data starts, or an empty cohort
+EMPTY_QUERIES = [
+    "median HbA1c in 1990",
+    "mean HbA1c in 1990",
+    "count HbA1c in 1990",
+    "patients HbA1c in 1990",
+    "median HbA1c where diagnosis = Nothing",
+    "median HbA1c in 1990 by year",
+    "mean HbA1c in 1990 by gender",
+]
+
+
+@unittest.skipIf(columnar.pa is None, "needs pyarrow")
+class ColumnarParityTest(unittest.TestCase):
+    """cohort_stats gives the same frame from SQLite and from the Arrow mirror"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        db_path = os.path.join(cls.tmp.name, 'clinic.db')
+        conn = get_db_connection(db_path)
+        make_database(conn, 60, visits=4)
+        apply_migrations(conn)
+        conn.close()
+        cls.sqlite = ClinicalBackend(db_path)
+        cls.arrow = ClinicalBackend(db_path, use_columnar=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.sqlite.pool.close()
+        cls.tmp.cleanup()
+
+    def assertSameStats(self, query):
+        pd.testing.assert_frame_equal(self.arrow.cohort_stats(query), self.sqlite.cohort_stats(query))
+
+    def test_stats(self):
+        for query in QUERIES:
+            with self.subTest(query=query):
+                self.assertSameStats(query)
+
+    def test_empty_selection(self):
+        for query in EMPTY_QUERIES:
+            with self.subTest(query=query):
+                self.assertSameStats(query)
+        result = self.sqlite.cohort_stats("median HbA1c in 1990")
+        self.assertTrue(pd.isna(result.loc[0, 'median']))
+        self.assertEqual(result.loc[0, 'n'], 0)
+
+    def test_new_rows_reach_the_mirror(self):
+        with self.sqlite.pool.writer() as conn:
+            conn.execute("INSERT INTO lab_results (patient_id, result_date, test_name, value) "
+                         "VALUES ('P0000001', '1990-06-01', 'HbA1c', 6.1)")
+        self.addCleanup(self._delete_1990)
+        self.assertSameStats("median HbA1c in 1990")
+        self.assertEqual(self.arrow.cohort_stats("count HbA1c in 1990").loc[0, 'count'], 1)
+
+    def _delete_1990(self):
+        with self.sqlite.pool.writer() as conn:
+            conn.execute("DELETE FROM lab_results WHERE result_date = '1990-06-01'")
+        self.arrow.refresh_columnar(full=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,383 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# Per-stage latency tracing for the query pipeline.
+#
+# `with span('parse'):` times a stage; spans opened inside it become its
+# children, so one question yields a tree (run_analysis_query > fetch >
+# sql ...). Every statement run on a pooled connection (db_pool creates them
+# with TracedConnection) inside a traced call becomes an 'sql' leaf with its
+# text and row count; its time covers execute and every fetch from the
+# cursor, since SQLite does most of the work while rows are stepped.
+#
+# When a root span closes, each span's duration is added to a bounded
+# sample window per stage name (p50 / p95 come from it), the tree goes to
+# the recent-traces ring and, if a JSON lines file is configured, is
+# appended there. prometheus_text() renders the windows as a Prometheus
+# summary. A generator can't hold a span open across its yields (the
+# consumer runs in between); it resumes one around each step instead
+# (Span.resume / finish).
+#
+# Tracing is off unless CLINICAL_TRACE=1 or enable() is called;
+# CLINICAL_TRACE_FILE=path.jsonl sets the JSON lines file. Disabled, span()
+# returns a shared no-op and connections take the plain sqlite3 path, so
+# the cost is a flag check per call.
+
+SAMPLES = 5000          # durations kept per stage for percentiles
+RECENT = 50             # finished traces kept for display / export
+SQL_CHARS = 300
+
+_enabled = os.environ.get('CLINICAL_TRACE', '') not in ('', '0')
+_jsonl_path = os.environ.get('CLINICAL_TRACE_FILE') or None
+_local = threading.local()
+_lock = threading.Lock()
+_samples = {}           # stage -> deque of seconds
+_totals = {}            # stage -> [count, seconds, rows] since start / reset
+_recent = deque(maxlen=RECENT)
+
+
+def enabled():
+    return _enabled
+
+
+def enable(jsonl_path=None):
+    """Turn tracing on (process-wide); finished traces are appended to `jsonl_path` if given"""
+    global _enabled, _jsonl_path
+    _enabled = True
+    if jsonl_path is not None:
+        _jsonl_path = jsonl_path
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def current():
+    """Innermost open span on this thread, or None"""
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+class Span:
+    __slots__ = ('name', 'attrs', 'children', 'start', 'duration')
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.children = []
+        self.start = 0.0
+        self.duration = 0.0
+
+    def __enter__(self):
+        stack = _stack()
+        if stack:
+            stack[-1].children.append(self)
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.duration += time.perf_counter() - self.start
+        stack = _stack()
+        # Normally the top; a generator closed late may leave spans above it
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i] is self:
+                del stack[i:]
+                break
+        if not stack:
+            _finish(self)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def resume(self):
+        """Context manager that reopens the span for one step (for spans that can't stay
+        open across a generator's yields); call finish() after the last step"""
+        return _Resumed(self)
+
+    def finish(self):
+        _finish(self)
+
+    def to_dict(self):
+        return {'name': self.name, 'ms': round(self.duration * 1000, 3), **self.attrs,
+                'children': [child.to_dict() for child in self.children]}
+
+
+class _Resumed:
+    __slots__ = ('span',)
+
+    def __init__(self, span_):
+        self.span = span_
+
+    def __enter__(self):
+        _stack().append(self.span)
+        self.span.start = time.perf_counter()
+        return self.span
+
+    def __exit__(self, *exc):
+        self.span.duration += time.perf_counter() - self.span.start
+        stack = _stack()
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i] is self.span:
+                del stack[i:]
+                break
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def resume(self):
+        return self
+
+    def finish(self):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **attrs):
+    """Context manager timing stage `name` (a no-op while tracing is off)"""
+    if not _enabled:
+        return _NO_SPAN
+    return Span(name, attrs)
+
+
+def record(name, seconds):
+    """Add one sample for `name` measured outside a span (e.g. time to first byte)"""
+    if _enabled:
+        with _lock:
+            _add(name, seconds, 0)
+
+
+def _add(name, seconds, rows):
+    samples = _samples.get(name)
+    if samples is None:
+        samples = _samples[name] = deque(maxlen=SAMPLES)
+        _totals[name] = [0, 0.0, 0]
+    samples.append(seconds)
+    totals = _totals[name]
+    totals[0] += 1
+    totals[1] += seconds
+    totals[2] += rows
+
+
+def _walk(span_):
+    yield span_
+    for child in span_.children:
+        yield from _walk(child)
+
+
+def _finish(root):
+    with _lock:
+        for s in _walk(root):
+            _add(s.name, s.duration, s.attrs.get('rows', 0) if s.name == 'sql' else 0)
+        _recent.append(root)
+        path = _jsonl_path
+    if path:
+        line = json.dumps({'ts': round(time.time(), 3), **root.to_dict()}, default=str)
+        with _lock, open(path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+
+# --- SQL statements ---
+
+def _compact(sql):
+    sql = ' '.join(sql.split())
+    return sql if len(sql) <= SQL_CHARS else sql[:SQL_CHARS] + '...'
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor that adds an 'sql' span (text, rows, execute + fetch time) under the open span"""
+    _span = None
+
+    def _begin(self, sql):
+        parent = current()
+        if parent is None:
+            self._span = None
+            return None
+        self._span = Span('sql', {'sql': _compact(sql), 'rows': 0})
+        parent.children.append(self._span)
+        return time.perf_counter()
+
+    def execute(self, sql, parameters=()):
+        start = self._begin(sql)
+        if start is None:
+            return super().execute(sql, parameters)
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._span.duration += time.perf_counter() - start
+            if self.rowcount > 0:
+                self._span.attrs['rows'] = self.rowcount
+
+    def executemany(self, sql, seq_of_parameters):
+        start = self._begin(sql)
+        if start is None:
+            return super().executemany(sql, seq_of_parameters)
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._span.duration += time.perf_counter() - start
+            self._span.attrs['rows'] = max(self.rowcount, 0)
+
+    def _fetched(self, start, n):
+        self._span.duration += time.perf_counter() - start
+        self._span.attrs['rows'] += n
+
+    def fetchone(self):
+        if self._span is None:
+            return super().fetchone()
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        if self._span is None:
+            return super().fetchmany(self.arraysize if size is None else size)
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        if self._span is None:
+            return super().fetchall()
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+    def __next__(self):
+        if self._span is None:
+            return super().__next__()
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._span.duration += time.perf_counter() - start
+            raise
+        self._fetched(start, 1)
+        return row
+
+
+class TracedConnection(sqlite3.Connection):
+    """sqlite3 connection whose cursors are traced while tracing is on"""
+
+    def cursor(self, factory=None):
+        if factory is None:
+            factory = TracedCursor if _enabled else sqlite3.Cursor
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        if not _enabled:
+            return super().execute(sql, parameters)
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not _enabled:
+            return super().executemany(sql, seq_of_parameters)
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# --- Reports ---
+
+def stats():
+    """Per-stage latency over the sample window: count, p50 / p95 / max ms, total ms (slowest total first)"""
+    with _lock:
+        windows = {name: np.fromiter(samples, dtype=float) for name, samples in _samples.items()}
+        totals = {name: list(values) for name, values in _totals.items()}
+    rows = []
+    for name, seconds in windows.items():
+        p50, p95 = (float(v) for v in np.percentile(seconds, [50, 95]) * 1000)
+        rows.append({'stage': name, 'count': totals[name][0], 'p50_ms': round(p50, 3), 'p95_ms': round(p95, 3),
+                     'max_ms': round(float(seconds.max()) * 1000, 3), 'total_ms': round(totals[name][1] * 1000, 1)})
+    return sorted(rows, key=lambda row: -row['total_ms'])
+
+
+def recent_traces():
+    """The last RECENT finished traces as nested dicts, newest first"""
+    with _lock:
+        roots = list(_recent)
+    return [root.to_dict() for root in reversed(roots)]
+
+
+def format_trace(trace, indent=0):
+    """A trace dict as indented text lines"""
+    extra = {k: v for k, v in trace.items() if k not in ('name', 'ms', 'children', 'sql')}
+    line = '  ' * indent + f"{trace['name']} {trace['ms']:.2f} ms"
+    if extra:
+        line += ' ' + ' '.join(f"{k}={v}" for k, v in extra.items())
+    if 'sql' in trace:
+        line += f"  {trace['sql']}"
+    lines = [line]
+    for child in trace['children']:
+        lines += format_trace(child, indent + 1)
+    return lines
+
+
+def jsonl_text():
+    """Recent traces as JSON lines, oldest first"""
+    return ''.join(json.dumps(trace, default=str) + '\n' for trace in reversed(recent_traces()))
+
+
+def prometheus_text():
+    """Stage latencies in the Prometheus text exposition format (summary per stage)"""
+    with _lock:
+        windows = {name: np.fromiter(samples, dtype=float) for name, samples in _samples.items()}
+        totals = {name: list(values) for name, values in _totals.items()}
+    lines = ["# HELP clinical_stage_seconds Query pipeline stage latency (quantiles over the last "
+             f"{SAMPLES} samples).",
+             "# TYPE clinical_stage_seconds summary"]
+    for name in sorted(windows):
+        label = name.replace('\\', '\\\\').replace('"', '\\"')
+        for q in (0.5, 0.95):
+            lines.append(f'clinical_stage_seconds{{stage="{label}",quantile="{q}"}} '
+                         f'{np.percentile(windows[name], q * 100):.6g}')
+        lines.append(f'clinical_stage_seconds_sum{{stage="{label}"}} {totals[name][1]:.6g}')
+        lines.append(f'clinical_stage_seconds_count{{stage="{label}"}} {totals[name][0]}')
+    if 'sql' in totals:
+        lines += ["# HELP clinical_sql_rows_total Rows returned or changed by traced SQL statements.",
+                  "# TYPE clinical_sql_rows_total counter",
+                  f"clinical_sql_rows_total {totals['sql'][2]}"]
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path):
+    """Write prometheus_text() to `path` atomically (for a node-exporter textfile collector)"""
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(prometheus_text())
+    os.replace(path + '.tmp', path)
+
+
+def reset():
+    with _lock:
+        _samples.clear()
+        _totals.clear()
+        _recent.clear()